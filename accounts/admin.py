@@ -1,3 +1,44 @@
 from django.contrib import admin
+from django.utils import timezone
 
-# Register your models here.
+from .models import Notification, BackgroundTask
+from .sharding import get_shards
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """Просмотр уведомлений конкретного шарда"""
+    title = 'Шард'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(shard, shard) for shard in get_shards()]
+
+    def queryset(self, request, queryset):
+        if self.value() in get_shards():
+            return queryset.using(self.value())
+        return queryset
+
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('user', 'notification_type', 'message', 'is_read', 'created_at')
+    list_filter = (ShardFilter, 'notification_type', 'is_read')
+    raw_id_fields = ('user', 'related_user')
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = extra_context or {}
+        # Scatter-gather: сколько уведомлений во всех шардах
+        extra_context['subtitle'] = f'Всего во всех шардах: {Notification.objects.scatter_count()}'
+        return super().changelist_view(request, extra_context=extra_context)
+
+
+@admin.register(BackgroundTask)
+class BackgroundTaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'max_attempts', 'run_at', 'locked_by', 'finished_at')
+    list_filter = ('status', 'name')
+    search_fields = ('key',)
+    actions = ['requeue']
+
+    @admin.action(description='Вернуть в очередь')
+    def requeue(self, request, queryset):
+        queryset.exclude(status='running').update(status='queued', attempts=0, run_at=timezone.now())
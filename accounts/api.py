@@ -0,0 +1,64 @@
+"""
+Ресурсы пакетного API чтения (instagram_clone.read_api): профили и
+уведомления
+"""
+from django.utils import timezone
+
+from instagram_clone.read_api import Field, Resource, file_url
+
+from .models import Notification, Profile
+
+
+def full_name(first_name, last_name):
+    return f'{first_name} {last_name}'.strip()
+
+
+def is_online(last_seen):
+    # Как Profile.is_online()
+    return timezone.now() - last_seen < timezone.timedelta(minutes=5)
+
+
+class ProfileResource(Resource):
+    """Профиль по id пользователя (как в URL профиля)"""
+    model = Profile
+    lookup = 'user_id'
+    version_scope = 'profile'
+    fields = {
+        'id': Field('user_id'),
+        'username': Field('user__username'),
+        'full_name': Field('user__first_name', 'user__last_name', compute=full_name),
+        'avatar': Field('avatar', compute=file_url(Profile._meta.get_field('avatar'))),
+        'bio': Field('bio'),
+        'location': Field('location'),
+        'website': Field('website'),
+        'is_private': Field('is_private'),
+        'is_online': Field('last_seen', compute=is_online),
+        'posts_count': Field('posts_count'),
+        'friends_count': Field('friends_count'),
+    }
+
+
+class NotificationResource(Resource):
+    """
+    Уведомления текущего пользователя
+
+    Лежат в шарде без таблицы пользователей, поэтому отправитель — только
+    related_user_id: его профиль запрашивается в том же batch.
+    """
+    model = Notification
+    version_scope = 'notifications'
+    fields = {
+        'id': Field('id'),
+        'type': Field('notification_type'),
+        'message': Field('message'),
+        'is_read': Field('is_read'),
+        'created_at': Field('created_at'),
+        'link': Field('link'),
+        'related_user_id': Field('related_user_id'),
+    }
+
+    def queryset(self, request):
+        return Notification.objects.for_user(request.user)
+
+    def version_keys(self, request, ids):
+        return [request.user.id]
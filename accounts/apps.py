@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        # Регистрация обработчиков инвалидации кэша
+        from . import cache, metrics  # noqa: F401
+        # Журнал медленных запросов на каждом подключении к БД
+        from instagram_clone import slow_queries  # noqa: F401
+        # Проверки общего кэша (instagram_clone.shared_cache)
+        from instagram_clone import ratelimit  # noqa: F401
@@ -0,0 +1,397 @@
+"""
+Двухуровневый кэш объектов User/Profile
+Локальный LRU процесса перед общим Django cache backend
+
+Общий уровень используется, только если кэш действительно общий для
+процессов (instagram_clone.shared_cache): иначе инвалидация в одном
+воркере не дошла бы до остальных.
+"""
+import math
+import pickle
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from instagram_clone import loaders, shared_cache
+from instagram_clone.conditional import bump
+
+from .models import Profile
+
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 300,
+    'NEGATIVE_TIMEOUT': 30,
+    'LOCAL_MAXSIZE': 2048,
+    'LOCAL_TIMEOUT': 5,
+    # Меняется при изменении структуры кэшируемых объектов
+    'VERSION': 2,
+    # Защита от cache stampede (get_or_compute)
+    'STALE_TIMEOUT': 300,
+    'LOCK_TIMEOUT': 10,
+    'LOCK_WAIT': 0.5,
+    'EARLY_EXPIRATION_BETA': 1.0,
+}
+
+# Маркер отсутствующего объекта (негативное кэширование)
+MISSING = '__missing__'
+
+
+def get_setting(name):
+    return getattr(settings, 'OBJECT_CACHE', {}).get(name, DEFAULTS[name])
+
+
+shared_cache.require(
+    'OBJECT_CACHE', lambda: get_setting('CACHE_ALIAS'),
+    'общий уровень кэша объектов и get_or_compute отключены'
+)
+
+
+class LocalLRU:
+    """
+    Потокобезопасный LRU с TTL для одного процесса
+
+    Значения хранятся сериализованными: каждый get возвращает свою копию,
+    чтобы изменения объекта в одном запросе не попадали в другие.
+    """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                item = self._data.get(key)
+                if item is None:
+                    continue
+                expires, value = item
+                if expires < now:
+                    del self._data[key]
+                    continue
+                self._data.move_to_end(key)
+                found[key] = value
+        return {key: pickle.loads(value) for key, value in found.items()}
+
+    def set_many(self, mapping):
+        expires = time.monotonic() + self.timeout
+        mapping = {key: pickle.dumps(value, pickle.HIGHEST_PROTOCOL) for key, value in mapping.items()}
+        with self._lock:
+            for key, value in mapping.items():
+                self._data[key] = (expires, value)
+                self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class ObjectCache:
+    """
+    Read-through кэш объектов модели по первичному ключу
+
+    Порядок поиска: локальный LRU → общий кэш → база данных.
+    Отсутствующие id кэшируются как MISSING на NEGATIVE_TIMEOUT.
+    prepare() убирает из объекта то, что не должно попадать в кэш.
+    """
+
+    def __init__(self, name, queryset, prepare=None):
+        self.name = name
+        self.queryset = queryset
+        # Объект → то, что кладётся в кэш (без секретов)
+        self.prepare = prepare or (lambda obj: obj)
+        self.local = LocalLRU(get_setting('LOCAL_MAXSIZE'), get_setting('LOCAL_TIMEOUT'))
+        self._stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'negative_hits': 0}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def shared(self):
+        """Общий кэш или None, если он виден только своему процессу"""
+        alias = get_setting('CACHE_ALIAS')
+        return caches[alias] if shared_cache.is_shared(alias) else None
+
+    def make_key(self, pk):
+        return f"objcache:v{get_setting('VERSION')}:{self.name}:{pk}"
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for name, value in deltas.items():
+                self._stats[name] += value
+
+    def stats(self):
+        """Счётчики попаданий/промахов"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = sum(stats.values())
+        hits = stats['local_hits'] + stats['shared_hits'] + stats['negative_hits']
+        stats['hit_ratio'] = hits / lookups if lookups else 0.0
+        return stats
+
+    def reset_stats(self):
+        with self._stats_lock:
+            for name in self._stats:
+                self._stats[name] = 0
+
+    def get_many(self, ids):
+        """
+        Получить объекты по списку id
+
+        Args:
+            ids: Итерируемое первичных ключей
+
+        Returns:
+            dict: {id: объект} только для существующих объектов
+        """
+        ids = list(dict.fromkeys(int(pk) for pk in ids))
+        if not ids:
+            return {}
+
+        keys = {self.make_key(pk): pk for pk in ids}
+
+        values = self.local.get_many(keys)
+        stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'negative_hits': 0}
+        for value in values.values():
+            stats['negative_hits' if value == MISSING else 'local_hits'] += 1
+
+        remaining = [key for key in keys if key not in values]
+        if remaining and self.shared is not None:
+            shared = self.shared.get_many(remaining)
+            for value in shared.values():
+                stats['negative_hits' if value == MISSING else 'shared_hits'] += 1
+            self.local.set_many(shared)
+            values.update(shared)
+
+        missing_ids = [keys[key] for key in keys if key not in values]
+        if missing_ids:
+            stats['misses'] = len(missing_ids)
+            loaded = self.queryset.in_bulk(missing_ids)
+            fresh = {self.make_key(pk): self.prepare(obj) for pk, obj in loaded.items()}
+            absent = {self.make_key(pk): MISSING for pk in missing_ids if pk not in loaded}
+
+            if self.shared is not None:
+                if fresh:
+                    self.shared.set_many(fresh, get_setting('TIMEOUT'))
+                if absent:
+                    self.shared.set_many(absent, get_setting('NEGATIVE_TIMEOUT'))
+            self.local.set_many({**fresh, **absent})
+            values.update(fresh)
+            values.update(absent)
+
+        self._count(**stats)
+        return {
+            pk: values[key] for key, pk in keys.items()
+            if values[key] != MISSING
+        }
+
+    def get(self, pk):
+        """Получить объект по id или None"""
+        return self.get_many([pk]).get(int(pk))
+
+    def invalidate(self, *ids):
+        """
+        Сбросить объекты из кэша
+
+        Внутри транзакции сброс повторяется после фиксации: иначе
+        параллельный запрос мог бы между сбросом и COMMIT снова положить
+        в кэш старую строку — до TIMEOUT.
+        """
+        keys = [self.make_key(pk) for pk in ids]
+        self._delete(keys)
+        loaders.forget(self.queryset.model, *ids)
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(lambda: self._delete(keys))
+
+    def _delete(self, keys):
+        self.local.delete_many(keys)
+        if self.shared is not None:
+            self.shared.delete_many(keys)
+
+
+class ComputeStats:
+    """Счётчики get_or_compute"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.computes = 0
+        self.early_refreshes = 0
+        self.stale_served = 0
+        self.waits = 0
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'computes': self.computes,
+                'early_refreshes': self.early_refreshes,
+                'stale_served': self.stale_served,
+                'waits': self.waits,
+            }
+
+
+compute_stats = ComputeStats()
+
+
+def _is_fresh(entry, beta):
+    """
+    Вероятностное раннее истечение (XFetch): чем ближе срок и чем
+    дольше пересчёт, тем выше шанс обновить значение заранее
+    """
+    _, delta, expires_at = entry
+    return time.time() - delta * beta * math.log(1.0 - random.random()) < expires_at
+
+
+def get_or_compute(key, compute, timeout, cache_alias=None):
+    """
+    Read-through кэш с защитой от одновременного пересчёта
+
+    Пересчитывает только воркер, захвативший блокировку (cache.add);
+    остальные получают устаревшее значение или ждут до LOCK_WAIT секунд.
+    Запись живёт timeout + STALE_TIMEOUT, чтобы было что отдать.
+
+    Args:
+        key: Ключ кэша
+        compute: Функция без аргументов, возвращающая значение
+        timeout: Время жизни свежего значения в секундах
+        cache_alias: Алиас кэша (по умолчанию OBJECT_CACHE['CACHE_ALIAS'])
+
+    Returns:
+        Значение из кэша или результат compute()
+    """
+    alias = cache_alias or get_setting('CACHE_ALIAS')
+    if not shared_cache.is_shared(alias):
+        # expire() в одном процессе не дошёл бы до остальных
+        compute_stats.incr('computes')
+        return compute()
+    shared = caches[alias]
+    entry = shared.get(key)
+
+    if entry is not None:
+        if _is_fresh(entry, get_setting('EARLY_EXPIRATION_BETA')):
+            compute_stats.incr('hits')
+            return entry[0]
+        if entry[2] > time.time():
+            compute_stats.incr('early_refreshes')
+
+    lock_key = f'{key}:lock'
+    token = secrets.token_hex(8)
+    if shared.add(lock_key, token, get_setting('LOCK_TIMEOUT')):
+        try:
+            return _compute_and_store(shared, key, compute, timeout)
+        finally:
+            # Пересчёт дольше LOCK_TIMEOUT: блокировка уже чужая, не снимаем её
+            if shared.get(lock_key) == token:
+                shared.delete(lock_key)
+
+    if entry is not None:
+        compute_stats.incr('stale_served')
+        return entry[0]
+
+    # Холодный ключ: ждём результат воркера, захватившего блокировку
+    compute_stats.incr('waits')
+    deadline = time.monotonic() + get_setting('LOCK_WAIT')
+    while time.monotonic() < deadline:
+        time.sleep(0.01)
+        entry = shared.get(key)
+        if entry is not None:
+            return entry[0]
+
+    return _compute_and_store(shared, key, compute, timeout)
+
+
+def _compute_and_store(shared, key, compute, timeout):
+    compute_stats.incr('computes')
+    started = time.time()
+    value = compute()
+    delta = time.time() - started
+    shared.set(key, (value, delta, time.time() + timeout), timeout + get_setting('STALE_TIMEOUT'))
+    return value
+
+
+def expire(key, cache_alias=None):
+    """
+    Мягкая инвалидация: значение помечается устаревшим, но остаётся
+    доступным остальным воркерам, пока один пересчитывает его
+    """
+    alias = cache_alias or get_setting('CACHE_ALIAS')
+    if not shared_cache.is_shared(alias):
+        return
+    shared = caches[alias]
+    entry = shared.get(key)
+    if entry is not None:
+        shared.set(key, (entry[0], entry[1], 0), get_setting('STALE_TIMEOUT'))
+
+
+def without_password(user):
+    """
+    Пользователь для кэша: вместо хэша пароля — производный от него
+    хэш сессии (его проверяет UserHydrationMiddleware). Поле password
+    становится отложенным и при обращении загружается из БД.
+    """
+    user.session_auth_hash = user.get_session_auth_hash()
+    del user.__dict__['password']
+    return user
+
+
+def session_auth_hash(user):
+    """Хэш сессии пользователя (из кэша — без обращения к паролю)"""
+    return getattr(user, 'session_auth_hash', None) or user.get_session_auth_hash()
+
+
+# Пользователи вместе с профилем — как select_related('profile')
+user_cache = ObjectCache('user', User.objects.select_related('profile'), prepare=without_password)
+
+
+def get_user(user_id):
+    """Закэшированный User с профилем или None"""
+    return user_cache.get(user_id)
+
+
+def get_users(user_ids):
+    """Закэшированные User с профилями: {id: User}"""
+    return user_cache.get_many(user_ids)
+
+
+# Загрузчики запроса (attach, get_loader) берут пользователей из кэша
+loaders.register_fetcher(User, get_users)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    user_cache.invalidate(instance.pk)
+    bump('profile', instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_profile(sender, instance, **kwargs):
+    user_cache.invalidate(instance.user_id)
+    bump('profile', instance.user_id)
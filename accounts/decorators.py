@@ -0,0 +1,22 @@
+from functools import wraps
+
+from django.contrib.auth.views import redirect_to_login
+
+
+def alogin_required(view):
+    """
+    login_required для async-представлений (в Django 5.0 он их не
+    поддерживает)
+
+    Пользователь загружается через request.auser() и кладётся в
+    request.user, чтобы представление не обращалось к ленивому
+    объекту (синхронный запрос к БД) из event loop.
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,108 @@
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test import override_settings
+from django.urls import path
+
+from accounts.views import search_users, get_unread_notifications
+from instagram_clone.loadtest import LoadRunner
+
+
+def sync_twin(view):
+    """
+    Та же работа, но как синхронное представление: поток занят на всё
+    время запроса, как было до перевода на async
+    """
+    def wrapper(request, *args, **kwargs):
+        return async_to_sync(view)(request, *args, **kwargs)
+    return wrapper
+
+
+# URLconf прогона (ROOT_URLCONF указывает на этот модуль)
+urlpatterns = [
+    path('async/search/', search_users, name='async:search_users'),
+    path('sync/search/', sync_twin(search_users), name='sync:search_users'),
+    path('async/unread/', get_unread_notifications, name='async:unread_notifications'),
+    path('sync/unread/', sync_twin(get_unread_notifications), name='sync:unread_notifications'),
+]
+
+
+class ThreadSampler:
+    """Пиковое число потоков процесса во время прогона"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class Command(BaseCommand):
+    help = (
+        'JSON-эндпоинты под ASGI: async-представления против синхронных '
+        '(пропускная способность, перцентили, пик потоков на воркер)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--db-latency-ms', type=float, default=2,
+                            help='Искусственная задержка каждого SQL-запроса (сетевая БД)')
+
+    def handle(self, *args, **options):
+        viewer = User.objects.order_by('-profile__friends_count', 'id').first()
+        if viewer is None:
+            raise CommandError('Нет данных: сначала выполните generate_social_graph')
+
+        latency = options['db_latency_ms'] / 1000
+
+        def slow_execute(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            connection.execute_wrappers.append(slow_execute)
+
+        # Каждый поток открывает своё подключение
+        connections.close_all()
+        connection_created.connect(add_latency)
+        try:
+            with override_settings(ROOT_URLCONF=__name__, ALLOWED_HOSTS=['testserver']):
+                for endpoint, query in (('search', f'?q={viewer.username[:3]}'), ('unread', '')):
+                    for variant in ('sync', 'async'):
+                        self.run_variant(variant, endpoint, query, viewer, options)
+        finally:
+            connection_created.disconnect(add_latency)
+            connections.close_all()
+
+    def run_variant(self, variant, endpoint, query, viewer, options):
+        requests = [
+            {'method': 'GET', 'path': f'/{variant}/{endpoint}/{query}', 'user_id': viewer.id}
+        ] * options['requests']
+        runner = LoadRunner('asgi', options['concurrency'])
+        with ThreadSampler() as threads:
+            report = runner.run(requests)
+
+        self.stdout.write(
+            f"{variant:>5} {endpoint:<7} {report['throughput_rps']:>8} rps  "
+            f"p50 {report['p50_ms']:>8} мс  p95 {report['p95_ms']:>8} мс  "
+            f"p99 {report['p99_ms']:>8} мс  ошибок {report['error_rate']:.2%}  "
+            f"потоков (пик) {threads.peak}"
+        )
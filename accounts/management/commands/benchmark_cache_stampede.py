@@ -0,0 +1,103 @@
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from accounts.cache import get_or_compute, compute_stats, get_setting
+from instagram_clone import shared_cache
+
+
+class Command(BaseCommand):
+    help = 'Сравнение числа запросов к БД при истечении горячего ключа: наивный кэш и get_or_compute'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=50)
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument('--compute-ms', type=int, default=50,
+                            help='Дополнительная задержка пересчёта (имитация тяжёлого контекста)')
+
+    def handle(self, *args, **options):
+        alias = get_setting('CACHE_ALIAS')
+        if shared_cache.is_shared(alias):
+            return self.run(options)
+        # Все потоки бенчмарка — в этом процессе, поэтому локальный кэш
+        # для них общий. Без этого get_or_compute не берёт блокировку
+        # и single-flight ничем не отличался бы от наивного кэша
+        self.stdout.write(
+            f'Кэш {alias!r} локален для процесса: в рамках бенчмарка он '
+            f'считается общим (SINGLE_PROCESS)'
+        )
+        with override_settings(SINGLE_PROCESS=True):
+            return self.run(options)
+
+    def run(self, options):
+        self.threads = options['threads']
+        self.compute_delay = options['compute_ms'] / 1000
+        shared = caches[get_setting('CACHE_ALIAS')]
+
+        for name, fetch in (('naive', self.naive_fetch), ('single-flight', self.guarded_fetch)):
+            total_queries = 0
+            elapsed = 0.0
+            for round_no in range(options['rounds']):
+                key = f'benchmark_stampede:{name}:{round_no}'
+                shared.delete(key)
+                queries, seconds = self.run_round(key, fetch)
+                total_queries += queries
+                elapsed += seconds
+
+            rounds = options['rounds']
+            self.stdout.write(
+                f'{name:>14}: {total_queries / rounds:.1f} запросов к БД на истечение, '
+                f'{elapsed / rounds * 1000:.0f} мс на раунд ({self.threads} потоков)'
+            )
+
+        self.stdout.write(f'get_or_compute: {compute_stats.as_dict()}')
+
+    def compute(self):
+        value = User.objects.count()
+        time.sleep(self.compute_delay)
+        return value
+
+    def naive_fetch(self, key):
+        shared = caches[get_setting('CACHE_ALIAS')]
+        value = shared.get(key)
+        if value is None:
+            value = self.compute()
+            shared.set(key, value, 60)
+        return value
+
+    def guarded_fetch(self, key):
+        return get_or_compute(key, self.compute, 60)
+
+    def run_round(self, key, fetch):
+        barrier = threading.Barrier(self.threads)
+        counts = []
+        lock = threading.Lock()
+
+        def worker():
+            executed = [0]
+
+            def counter(execute, sql, params, many, context):
+                executed[0] += 1
+                return execute(sql, params, many, context)
+
+            barrier.wait()
+            try:
+                with connection.execute_wrapper(counter):
+                    fetch(key)
+            finally:
+                connection.close()
+            with lock:
+                counts.append(executed[0])
+
+        threads = [threading.Thread(target=worker) for _ in range(self.threads)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sum(counts), time.perf_counter() - started
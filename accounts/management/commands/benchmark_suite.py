@@ -0,0 +1,95 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from instagram_clone.benchmarks import run_suite, compare
+
+
+def default_baseline():
+    return os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json')
+
+
+class Command(BaseCommand):
+    help = (
+        'Бенчмарки горячих представлений и сервисов: p50/p95/p99, SQL-запросы, '
+        'пик памяти; сравнение с baseline. Baseline зависит от машины и в '
+        'репозитории не хранится: сначала сохраните его (--update-baseline) '
+        'на той машине, где будут сравниваться запуски'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--only', help='Только сценарии, содержащие подстроку')
+        parser.add_argument('--output', help='Куда записать результат (JSON)')
+        parser.add_argument(
+            '--baseline',
+            help='Файл baseline (по умолчанию benchmarks/baseline.json). Если файла по '
+                 'умолчанию нет, сравнение пропускается и команда завершается успешно; '
+                 'явно указанный отсутствующий файл — ошибка'
+        )
+        parser.add_argument('--update-baseline', action='store_true',
+                            help='Сохранить результат как новый baseline')
+        parser.add_argument('--latency-threshold', type=float, default=0.2,
+                            help='Допустимый рост p95 (доля)')
+        parser.add_argument('--memory-threshold', type=float, default=0.25,
+                            help='Допустимый рост пика памяти (доля)')
+
+    def handle(self, *args, **options):
+        try:
+            current = run_suite(
+                iterations=options['iterations'],
+                warmup=options['warmup'],
+                only=options['only'],
+                progress=self.report_case,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['output']:
+            self.write_json(options['output'], current)
+
+        baseline_path = options['baseline'] or default_baseline()
+        if options['update_baseline']:
+            self.write_json(baseline_path, current)
+            self.stdout.write(self.style.SUCCESS(f'Baseline сохранён: {baseline_path}'))
+            return
+
+        if not os.path.exists(baseline_path):
+            if options['baseline']:
+                raise CommandError(f'Baseline не найден: {baseline_path}')
+            self.stdout.write(self.style.WARNING(
+                f'Baseline не найден ({baseline_path}), сравнение пропущено. '
+                f'Сохраните его: manage.py benchmark_suite --update-baseline'
+            ))
+            return
+
+        with open(baseline_path) as fh:
+            baseline = json.load(fh)
+
+        regressions = compare(
+            current, baseline,
+            latency_threshold=options['latency_threshold'],
+            memory_threshold=options['memory_threshold'],
+        )
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS('Регрессий относительно baseline нет'))
+            return
+
+        for name, metric, before, after in regressions:
+            self.stdout.write(self.style.ERROR(f'{name}: {metric} {before} → {after}'))
+        raise CommandError(f'Регрессий: {len(regressions)}')
+
+    def report_case(self, name, result):
+        self.stdout.write(
+            f"{name:<34} p50 {result['p50_ms']:>8.2f} мс  p95 {result['p95_ms']:>8.2f} мс  "
+            f"p99 {result['p99_ms']:>8.2f} мс  SQL {result['queries']:>6}  "
+            f"память {result['peak_memory_kb']:>8.1f} КБ"
+        )
+
+    def write_json(self, path, data):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as fh:
+            json.dump(data, fh, ensure_ascii=False, indent=2)
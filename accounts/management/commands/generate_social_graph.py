@@ -0,0 +1,292 @@
+import itertools
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import CharField, F, Max, Value
+from django.db.models.functions import Cast, LPad
+from django.db.models.constants import OnConflict
+
+from accounts.models import Profile, FriendRequest, BlockedUser, Notification
+from accounts.sharding import get_shards, hash_shard
+from posts.models import Post, Comment
+
+
+NOTIFICATION_TYPES = [code for code, _ in Notification.NOTIFICATION_TYPES]
+
+# Момент, от которого отсчитываются сгенерированные даты: с одним --seed
+# набор одинаков при каждом запуске
+ANCHOR = '2025-01-01T00:00:00+00:00'
+
+
+def parse_anchor(value):
+    anchor = datetime.fromisoformat(value)
+    if anchor.tzinfo is None:
+        anchor = anchor.replace(tzinfo=dt_timezone.utc)
+    return anchor
+
+
+class Command(BaseCommand):
+    help = (
+        'Синтетические данные: пользователи, степенной граф дружбы, запросы, '
+        'блокировки, посты, комментарии и уведомления (bulk_create пачками). '
+        'Набор определяется --seed и --anchor, если БД пуста; в непустую БД '
+        'данные добавляются только с --append, и их id сдвигаются на уже '
+        'существующие'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--avg-friends', type=float, default=20,
+                            help='Среднее число друзей на пользователя')
+        parser.add_argument('--exponent', type=float, default=2.5,
+                            help='Показатель степенного распределения степеней')
+        parser.add_argument('--pending-per-user', type=float, default=1)
+        parser.add_argument('--blocked-per-user', type=float, default=0.1)
+        parser.add_argument('--posts-per-user', type=float, default=3)
+        parser.add_argument('--comments-per-post', type=float, default=2)
+        parser.add_argument('--notifications-per-user', type=float, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--anchor', type=parse_anchor, default=ANCHOR,
+                            help=f'Дата, от которой отсчитываются даты (ISO 8601, по умолчанию {ANCHOR}). '
+                                 'Поля auto_now_add (created_at профилей и уведомлений) '
+                                 'получают время запуска')
+        parser.add_argument('--append', action='store_true',
+                            help='Разрешить запуск на непустой БД (id не воспроизводятся)')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='gen',
+                            help='Префикс имён пользователей')
+        parser.add_argument('--password', default='password')
+        parser.add_argument('--skip-counters', action='store_true',
+                            help='Не пересчитывать счётчики профилей в конце')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.started = time.monotonic()
+        self.anchor = options['anchor']
+
+        existing = {model._meta.verbose_name_plural: model.objects.count() for model in (User, Profile, Post)}
+        if any(existing.values()) and not options['append']:
+            raise CommandError(
+                'БД не пуста ({}): id сгенерированных строк сдвинулись бы на уже '
+                'существующие. Используйте пустую БД или --append'.format(
+                    ', '.join(f'{name}: {count}' for name, count in existing.items())
+                )
+            )
+
+        n = options['users']
+        user_start = (User.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+        profile_start = (Profile.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+        post_start = (Post.objects.aggregate(m=Max('id'))['m'] or 0) + 1
+
+        # Ранг по степени не совпадает с порядком id: популярные
+        # пользователи разбросаны по всему диапазону
+        order = list(range(n))
+        self.rng.shuffle(order)
+        weights = [(rank + 1) ** (-1 / (options['exponent'] - 1)) for rank in range(n)]
+        self.cum_weights = list(itertools.accumulate(weights))
+        self.order = order
+        self.n = n
+
+        self.create_users(n, user_start, profile_start, options['prefix'], options['password'])
+        self.create_friendships(int(n * options['avg_friends'] / 2), profile_start)
+        self.create_pairs(
+            FriendRequest, 'from_user_id', 'to_user_id',
+            int(n * options['pending_per_user']), user_start, status='pending'
+        )
+        self.create_pairs(
+            BlockedUser, 'blocker_id', 'blocked_id',
+            int(n * options['blocked_per_user']), user_start
+        )
+        posts = int(n * options['posts_per_user'])
+        self.create_posts(posts, post_start, user_start)
+        self.create_comments(int(posts * options['comments_per_post']), post_start, posts, options['prefix'])
+        self.create_notifications(int(n * options['notifications_per_user']), user_start)
+
+        if not options['skip_counters']:
+            self.log('Пересчёт счётчиков профилей')
+            call_command('reconcile_profile_counters', batch_size=self.batch_size, stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(f'Готово за {time.monotonic() - self.started:.1f} с'))
+
+    def log(self, message):
+        self.stdout.write(f'[{time.monotonic() - self.started:7.1f} с] {message}')
+
+    def popular(self, k):
+        """k индексов пользователей со степенным распределением"""
+        ranks = self.rng.choices(range(self.n), cum_weights=self.cum_weights, k=k)
+        return [self.order[rank] for rank in ranks]
+
+    def uniform(self, k):
+        return [self.rng.randrange(self.n) for _ in range(k)]
+
+    def timestamp(self, days=365):
+        return self.anchor - timedelta(seconds=self.rng.randrange(days * 86400))
+
+    def batches(self, total):
+        for offset in range(0, total, self.batch_size):
+            yield offset, min(self.batch_size, total - offset)
+
+    def create_users(self, n, user_start, profile_start, prefix, password):
+        # Один хэш на всех: PBKDF2 на каждого пользователя занял бы часы
+        password = make_password(password)
+        shards = get_shards()
+        self.log(f'Пользователи: {n}')
+
+        for offset, size in self.batches(n):
+            users = []
+            profiles = []
+            for i in range(offset, offset + size):
+                user_id = user_start + i
+                joined = self.timestamp(days=3 * 365)
+                users.append(User(
+                    id=user_id,
+                    username=f'{prefix}{i}',
+                    email=f'{prefix}{i}@example.com',
+                    first_name=f'Имя{i}',
+                    last_name=f'Фамилия{i}',
+                    password=password,
+                    date_joined=joined,
+                ))
+                # Напрямую, минуя сигнал create_or_update_profile
+                profiles.append(Profile(
+                    id=profile_start + i,
+                    user_id=user_id,
+                    is_private=self.rng.random() < 0.1,
+                    last_seen=self.timestamp(days=30),
+                    notification_shard=hash_shard(user_id, shards) if len(shards) > 1 else '',
+                ))
+            with transaction.atomic():
+                User.objects.bulk_create(users)
+                Profile.objects.bulk_create(profiles)
+
+    def create_friendships(self, edges, profile_start):
+        """
+        Неориентированные рёбра с концами по степенному закону (модель
+        Чунга — Лу); в symmetrical-таблице обе стороны, дубли и петли
+        отбрасываются
+
+        Самая большая таблица пишется через executemany без создания
+        объектов модели: bulk_create здесь в несколько раз медленнее.
+        """
+        through = Profile.friends.through
+        fields = [through._meta.get_field('from_profile'), through._meta.get_field('to_profile')]
+        ops = connection.ops
+        sql = '{} {} ({}) VALUES (%s, %s) {}'.format(
+            ops.insert_statement(on_conflict=OnConflict.IGNORE),
+            ops.quote_name(through._meta.db_table),
+            ', '.join(ops.quote_name(f.column) for f in fields),
+            ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None),
+        )
+        self.log(f'Дружба: {edges} рёбер')
+
+        for _, size in self.batches(edges):
+            rows = []
+            for a, b in zip(self.popular(size), self.popular(size)):
+                if a == b:
+                    continue
+                a, b = profile_start + a, profile_start + b
+                rows.append((a, b))
+                rows.append((b, a))
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, rows)
+
+    def create_pairs(self, model, from_field, to_field, total, user_start, **fields):
+        """Направленные пары: отправитель случайный, получатель популярный"""
+        self.log(f'{model._meta.verbose_name_plural}: {total}')
+
+        for _, size in self.batches(total):
+            rows = [
+                model(**{from_field: user_start + a, to_field: user_start + b}, **fields)
+                for a, b in zip(self.uniform(size), self.popular(size))
+                if a != b
+            ]
+            with transaction.atomic():
+                model.objects.bulk_create(rows, ignore_conflicts=True)
+
+    def create_posts(self, total, post_start, user_start):
+        self.log(f'Посты: {total}')
+
+        for offset, size in self.batches(total):
+            authors = self.popular(size)
+            posts = [
+                Post(
+                    id=post_start + offset + i,
+                    author_id=user_start + author,
+                    title=f'Пост {offset + i}',
+                    content='Сгенерированный пост',
+                    created_at=self.timestamp(),
+                    likes=int(self.rng.paretovariate(1.5)) - 1,
+                )
+                for i, author in enumerate(authors)
+            ]
+            with transaction.atomic():
+                Post.objects.bulk_create(posts)
+
+    def create_comments(self, total, post_start, posts, prefix):
+        """
+        Комментарии верхнего уровня. bulk_create обходит Comment.save():
+        path (id с нулями) и счётчики постов проставляются отдельно
+        """
+        if not posts:
+            return
+        self.log(f'Комментарии: {total}')
+        counts = Counter()
+
+        for _, size in self.batches(total):
+            comments = [
+                Comment(
+                    post_id=post_start + self.rng.randrange(posts),
+                    author=f'{prefix}{author}',
+                    text='Сгенерированный комментарий',
+                    created_at=self.timestamp(),
+                )
+                for author in self.uniform(size)
+            ]
+            counts.update(comment.post_id for comment in comments)
+            with transaction.atomic():
+                Comment.objects.bulk_create(comments)
+                Comment.objects.filter(path='').update(
+                    path=LPad(Cast('id', CharField()), Comment.PATH_STEP, Value('0'))
+                )
+
+        by_count = {}
+        for post_id, count in counts.items():
+            by_count.setdefault(count, []).append(post_id)
+        with transaction.atomic():
+            for count, post_ids in by_count.items():
+                for offset in range(0, len(post_ids), 500):
+                    Post.objects.filter(id__in=post_ids[offset:offset + 500]).update(
+                        comments_count=F('comments_count') + count
+                    )
+
+    def create_notifications(self, total, user_start):
+        """
+        Уведомления сразу в шард получателя: шард уже записан в профиль
+        при создании, поэтому assign_shard (запрос на пользователя) не нужен
+        """
+        shards = get_shards()
+        self.log(f'Уведомления: {total}')
+
+        for _, size in self.batches(total):
+            by_shard = {}
+            for user, related in zip(self.popular(size), self.uniform(size)):
+                user_id = user_start + user
+                shard = hash_shard(user_id, shards) if len(shards) > 1 else shards[0]
+                by_shard.setdefault(shard, []).append(Notification(
+                    user_id=user_id,
+                    related_user_id=user_start + related,
+                    notification_type=self.rng.choice(NOTIFICATION_TYPES),
+                    message='Сгенерированное уведомление',
+                    is_read=self.rng.random() < 0.7,
+                ))
+            for shard, group in by_shard.items():
+                with transaction.atomic(using=shard):
+                    Notification._base_manager.using(shard).bulk_create(group)
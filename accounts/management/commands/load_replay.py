@@ -0,0 +1,61 @@
+import itertools
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from instagram_clone.loadtest import LoadRunner, SCENARIOS, read_jsonl
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон: повтор записанных запросов (JSONL) или сценария '
+        'с заданной параллельностью; пропускная способность, ошибки и перцентили по маршрутам'
+    )
+
+    def add_arguments(self, parser):
+        source = parser.add_mutually_exclusive_group()
+        source.add_argument('--file', help='JSONL с запросами (RequestRecorderMiddleware)')
+        source.add_argument('--scenario', choices=sorted(SCENARIOS), default='mix')
+        parser.add_argument('--requests', type=int, default=1000,
+                            help='Сколько запросов выполнить (для --file — не больше стольких)')
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--target', choices=['wsgi', 'asgi', 'http'], default='wsgi')
+        parser.add_argument('--url', default='http://127.0.0.1:8000',
+                            help='Адрес сервера для --target http')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Куда записать отчёт (JSON)')
+
+    def handle(self, *args, **options):
+        try:
+            if options['file']:
+                requests = list(itertools.islice(read_jsonl(options['file']), options['requests']))
+            else:
+                requests = list(SCENARIOS[options['scenario']](options['requests'], seed=options['seed']))
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+        if not requests:
+            raise CommandError('Нет запросов для выполнения')
+
+        runner = LoadRunner(options['target'], options['concurrency'], options['url'])
+        # Тестовый клиент ходит с Host: testserver
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            report = runner.run(requests)
+
+        if options['output']:
+            with open(options['output'], 'w') as fh:
+                json.dump(report, fh, ensure_ascii=False, indent=2)
+
+        self.stdout.write(
+            f"{report['requests']} запросов за {report['elapsed_s']} с: "
+            f"{report['throughput_rps']} rps, ошибок {report['error_rate']:.2%}, "
+            f"p50 {report['p50_ms']} мс, p95 {report['p95_ms']} мс, p99 {report['p99_ms']} мс"
+        )
+        for route, stats in report['routes'].items():
+            self.stdout.write(
+                f"  {route:<36} {stats['requests']:>6}  ошибок {stats['error_rate']:>7.2%}  "
+                f"p50 {stats['p50_ms']:>8} мс  p95 {stats['p95_ms']:>8} мс  "
+                f"p99 {stats['p99_ms']:>8} мс  {stats['statuses']}"
+            )
+            if stats['sample_error']:
+                self.stdout.write(f"    {stats['sample_error']}")
@@ -0,0 +1,19 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from instagram_clone.profiling import get_setting, make_token
+
+
+class Command(BaseCommand):
+    help = ('Подписанный токен для заголовка X-Profile-Token (профилирование запроса). '
+            'Действует только в сессии указанного сотрудника')
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Сотрудник, который будет отправлять запросы')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(username=options['username'], is_staff=True).first()
+        if user is None:
+            raise CommandError(f"Сотрудник {options['username']!r} не найден")
+        self.stdout.write(make_token(user))
+        self.stderr.write(f"Действует {get_setting('TOKEN_MAX_AGE')} с")
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from accounts.models import Profile, FriendRequest
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт денормализованных счётчиков профилей пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        friendship = Profile.friends.through
+
+        last_id = 0
+        fixed = 0
+        total = 0
+
+        while True:
+            batch = list(
+                Profile.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .only('id', 'user_id', *Profile.COUNTER_FIELDS)[:batch_size]
+            )
+            if not batch:
+                break
+
+            last_id = batch[-1].id
+            profile_ids = [p.id for p in batch]
+            user_ids = [p.user_id for p in batch]
+
+            posts = dict(
+                Post.objects.filter(author_id__in=user_ids)
+                .order_by().values('author_id').annotate(c=Count('id'))
+                .values_list('author_id', 'c')
+            )
+            friends = dict(
+                friendship.objects.filter(from_profile_id__in=profile_ids)
+                .order_by().values('from_profile_id').annotate(c=Count('id'))
+                .values_list('from_profile_id', 'c')
+            )
+            pending = dict(
+                FriendRequest.objects.filter(to_user_id__in=user_ids, status='pending')
+                .order_by().values('to_user_id').annotate(c=Count('id'))
+                .values_list('to_user_id', 'c')
+            )
+
+            changed = []
+            for profile in batch:
+                actual = (
+                    posts.get(profile.user_id, 0),
+                    friends.get(profile.id, 0),
+                    pending.get(profile.user_id, 0),
+                )
+                current = tuple(getattr(profile, f) for f in Profile.COUNTER_FIELDS)
+                if actual != current:
+                    for field, value in zip(Profile.COUNTER_FIELDS, actual):
+                        setattr(profile, field, value)
+                    changed.append(profile)
+
+            with transaction.atomic():
+                Profile.objects.bulk_update(changed, Profile.COUNTER_FIELDS)
+
+            fixed += len(changed)
+            total += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено профилей: {total}, исправлено: {fixed}'
+        ))
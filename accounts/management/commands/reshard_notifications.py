@@ -0,0 +1,142 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import Notification, Profile, invalidate_cached_users
+from accounts.sharding import get_shards, hash_shard
+
+# Поля, по которым скопированная строка узнаётся в целевом шарде (id там
+# свой): повторный запуск после сбоя не создаёт дублей
+NATURAL_KEY = ('notification_type', 'related_user_id', 'message', 'link', 'created_at')
+
+
+class Command(BaseCommand):
+    help = ('Перенос уведомлений пользователей в шард по хэшу id для текущего '
+            'SHARDING["SHARDS"] (пачками пользователей и строк). Команду можно '
+            'запускать повторно: прерванный перенос продолжится')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Профилей за проход')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Строк за транзакцию')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        shards = get_shards()
+        self.chunk_size = options['chunk_size']
+
+        moved_users = 0
+        moved_rows = 0
+        last_id = 0
+
+        while True:
+            batch = list(
+                Profile.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', 'user_id', 'notification_shard')[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            # Строки ищутся во всех шардах, а не только в закреплённом:
+            # остатки прерванного переноса и строки неразмещённых пользователей
+            user_ids = [user_id for _, user_id, _ in batch]
+            present = {
+                shard: set(
+                    Notification._base_manager.using(shard)
+                    .filter(user_id__in=user_ids).values_list('user_id', flat=True).distinct()
+                )
+                for shard in shards
+            }
+
+            for _, user_id, assigned in batch:
+                target = hash_shard(user_id, shards)
+                sources = [s for s in shards if s != target and user_id in present[s]]
+                if not sources:
+                    if assigned and assigned != target and not options['dry_run']:
+                        self.switch(user_id, target)
+                    continue
+
+                if options['dry_run']:
+                    for source in sources:
+                        count = Notification._base_manager.using(source).filter(user_id=user_id).count()
+                        self.stdout.write(f'user {user_id}: {source} → {target} ({count} строк)')
+                        moved_rows += count
+                    moved_users += 1
+                    continue
+
+                moved_rows += self.move_user(user_id, sources, target, switch=assigned != target)
+                moved_users += 1
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено пользователей: {moved_users}, строк: {moved_rows}'
+        ))
+        for shard in shards:
+            count = Notification._base_manager.using(shard).count()
+            self.stdout.write(f'  {shard}: {count} уведомлений')
+
+    def switch(self, user_id, target):
+        Profile.objects.filter(user_id=user_id).update(notification_shard=target)
+        invalidate_cached_users(user_id)
+
+    def move_user(self, user_id, sources, target, switch=True):
+        """
+        1. Копируем строки в целевой шард, не удаляя: пока профиль
+           указывает на источник, чтение видит все строки.
+        2. Переключаем пользователя (новые записи и чтение — в цели).
+        3. Удаляем строки из источников, докопировав записанные во время
+           копирования.
+
+        Сбой на любом шаге оставляет строки доступными или в источнике;
+        повторный запуск продолжает перенос (уже скопированные строки
+        узнаются по NATURAL_KEY).
+        """
+        for source in sources:
+            after = 0
+            while True:
+                rows = self.chunk(source, user_id, after)
+                if not rows:
+                    break
+                self.copy(rows, target, user_id)
+                after = rows[-1].id
+
+        if switch:
+            self.switch(user_id, target)
+
+        moved = 0
+        for source in sources:
+            while True:
+                rows = self.chunk(source, user_id)
+                if not rows:
+                    break
+                moved += self.copy(rows, target, user_id)
+                with transaction.atomic(using=source):
+                    Notification._base_manager.using(source).filter(
+                        id__in=[row.id for row in rows]
+                    ).delete()
+        return moved
+
+    def chunk(self, source, user_id, after=0):
+        return list(
+            Notification._base_manager.using(source)
+            .filter(user_id=user_id, id__gt=after)
+            .order_by('id')[:self.chunk_size]
+        )
+
+    def copy(self, rows, target, user_id):
+        """Вставить в target строки, которых там ещё нет; вернуть число строк"""
+        existing = set(
+            Notification._base_manager.using(target)
+            .filter(user_id=user_id, created_at__in={row.created_at for row in rows})
+            .values_list(*NATURAL_KEY)
+        )
+        with transaction.atomic(using=target):
+            for row in rows:
+                if tuple(getattr(row, field) for field in NATURAL_KEY) in existing:
+                    continue
+                row = Notification(**{
+                    f.attname: getattr(row, f.attname)
+                    for f in Notification._meta.concrete_fields if not f.primary_key
+                })
+                # raw: сохраняем created_at как есть (без auto_now_add)
+                row.save_base(raw=True, force_insert=True, using=target)
+        return len(rows)
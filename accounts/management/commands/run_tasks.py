@@ -0,0 +1,67 @@
+import multiprocessing
+import signal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from instagram_clone.task_queue import Worker, stats
+
+
+def work(batch_size, once, stop):
+    # Дочерний процесс: свои соединения с БД, остановка — по событию родителя
+    connections.close_all()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    worker = Worker(batch_size=batch_size)
+    worker.run(should_stop=stop.is_set, once=once)
+
+
+class Command(BaseCommand):
+    help = 'Воркеры фоновой очереди задач (instagram_clone.task_queue)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить все готовые задачи и выйти')
+        parser.add_argument('--stats', action='store_true',
+                            help='Показать число задач по статусам и выйти')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            for status, count in sorted(stats().items()):
+                self.stdout.write(f'{status}: {count}')
+            return
+
+        # SIGTERM/SIGINT: воркеры доделывают текущую пачку и выходят
+        stop = multiprocessing.Event()
+        previous = {
+            signum: signal.signal(signum, lambda *_: stop.set())
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        try:
+            self.run_workers(stop, options)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def run_workers(self, stop, options):
+        if options['processes'] <= 1:
+            worker = Worker(batch_size=options['batch_size'])
+            worker.run(should_stop=stop.is_set, once=options['once'])
+            self.stdout.write(f'Выполнено: {worker.processed}, ошибок: {worker.failed}')
+            return
+
+        # Соединения родителя не должны достаться дочерним процессам
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(
+                target=work, args=(options['batch_size'], options['once'], stop), daemon=True
+            )
+            for _ in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.stdout.write(f'Воркеры остановлены: {len(processes)}')
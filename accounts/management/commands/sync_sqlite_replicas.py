@@ -0,0 +1,34 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from instagram_clone.routers import PRIMARY, get_setting
+
+
+class Command(BaseCommand):
+    help = ('Копирование SQLite primary в файлы реплик (DATABASE_REPLICAS) '
+            'через backup API — локальная замена настоящей репликации')
+
+    def handle(self, *args, **options):
+        primary = connections[PRIMARY]
+        if primary.vendor != 'sqlite':
+            raise CommandError('Команда работает только с SQLite')
+
+        replicas = get_setting('ALIASES')
+        if not replicas:
+            self.stdout.write('Реплики не настроены (DATABASE_REPLICAS["ALIASES"])')
+            return
+
+        source = sqlite3.connect(primary.settings_dict['NAME'])
+        try:
+            for alias in replicas:
+                connections[alias].close()
+                target = sqlite3.connect(connections[alias].settings_dict['NAME'])
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(self.style.SUCCESS(f'{alias}: синхронизирована'))
+        finally:
+            source.close()
@@ -0,0 +1,41 @@
+"""
+Метрики приложения accounts: доменные события и статистика кэшей
+"""
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from instagram_clone.metrics import registry, events
+
+from .cache import user_cache, compute_stats
+from .models import FriendRequest, Notification
+
+
+@registry.collector
+def cache_stats():
+    stats = user_cache.stats()
+    return [
+        (
+            'object_cache_lookups',
+            'Обращения к кэшу User/Profile по результату',
+            'result',
+            {name: stats[name] for name in ('local_hits', 'shared_hits', 'negative_hits', 'misses')},
+        ),
+        (
+            'cached_compute',
+            'get_or_compute: попадания, пересчёты, устаревшие ответы',
+            'result',
+            compute_stats.as_dict(),
+        ),
+    ]
+
+
+@receiver(post_save, sender=FriendRequest)
+def count_friend_request(sender, instance, created, **kwargs):
+    if created:
+        events.inc(event='friend_request')
+
+
+@receiver(post_save, sender=Notification)
+def count_notification(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        events.inc(event='notification')
@@ -0,0 +1,65 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+from .cache import get_user, session_auth_hash
+
+
+def get_hydrated_user(request):
+    """
+    Пользователь вместе с профилем и счётчиками из кэша объектов
+
+    При промахе — один запрос (User + Profile). Все нестандартные
+    случаи (аноним, другой backend, сменённый пароль) отдаём
+    django.contrib.auth.get_user.
+    """
+    session = request.session
+    user_id = session.get(SESSION_KEY)
+    backend_path = session.get(BACKEND_SESSION_KEY)
+
+    if user_id is None or backend_path not in settings.AUTHENTICATION_BACKENDS:
+        return auth.get_user(request)
+
+    user = get_user(user_id)
+    if user is None or not user.is_active:
+        return auth.get_user(request)
+
+    session_hash = session.get(HASH_SESSION_KEY)
+    if not session_hash or not constant_time_compare(session_hash, session_auth_hash(user)):
+        return auth.get_user(request)
+
+    user.backend = backend_path
+    return user
+
+
+class UserHydrationMiddleware:
+    """
+    Заменяет ленивый request.user из AuthenticationMiddleware на
+    пользователя с уже загруженным профилем (request.user.profile
+    больше не стоит отдельного запроса).
+
+    Должен стоять сразу после AuthenticationMiddleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        request.user = SimpleLazyObject(lambda: get_hydrated_user(request))
+
+        async def auser():
+            if not hasattr(request, '_acached_user'):
+                request._acached_user = await sync_to_async(get_hydrated_user)(request)
+            return request._acached_user
+
+        request.auser = auser
+        # В async-режиме get_response возвращает корутину
+        return self.get_response(request)
@@ -1,10 +1,15 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, pre_delete
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
+from instagram_clone.conditional import bump
+
+from .sharding import ShardedByUserManager, delete_user_rows
+
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
@@ -19,6 +24,16 @@ class Profile(models.Model):
     is_private = models.BooleanField(default=False)
     last_seen = models.DateTimeField(default=timezone.now)
 
+    # Денормализованные счётчики (обновляются через F-выражения)
+    posts_count = models.PositiveIntegerField(default=0)
+    friends_count = models.PositiveIntegerField(default=0)
+    pending_requests_count = models.PositiveIntegerField(default=0)
+
+    # Алиас БД-шарда с уведомлениями пользователя (см. accounts.sharding)
+    notification_shard = models.CharField(max_length=50, blank=True)
+
+    COUNTER_FIELDS = ('posts_count', 'friends_count', 'pending_requests_count')
+
     class Meta:
         db_table = 'profiles'
         verbose_name = 'Профиль'
@@ -32,13 +47,94 @@ class Profile(models.Model):
         """Проверка активности пользователя (онлайн последние 5 минут)"""
         return timezone.now() - self.last_seen < timezone.timedelta(minutes=5)
 
+    def save(self, *args, **kwargs):
+        # Счётчики меняются только атомарно, не перезаписываем их устаревшими значениями
+        # и не догружаем отложенные (only()/defer()) поля, которые вызывающий не менял
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.COUNTER_FIELDS
+                and f.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
     def get_friends_count(self):
-        return self.friends.count()
+        return self.friends_count
 
     def are_friends(self, other_profile):
         """Проверка дружбы с другим профилем"""
         return self.friends.filter(id=other_profile.id).exists()
 
+    def _friendship_rows(self, other_profile):
+        """Строки связи дружбы в обе стороны (M2M symmetrical)"""
+        through = Profile.friends.through
+        return through.objects.filter(
+            models.Q(from_profile_id=self.id, to_profile_id=other_profile.id) |
+            models.Q(from_profile_id=other_profile.id, to_profile_id=self.id)
+        )
+
+    def add_friend(self, other_profile):
+        """Добавить в друзья с обновлением счётчиков"""
+        through = Profile.friends.through
+        with transaction.atomic():
+            # Параллельные принятия одной дружбы выполняются по очереди
+            list(Profile.objects.select_for_update().filter(
+                id__in=[self.id, other_profile.id]
+            ).order_by('id').values_list('id', flat=True))
+            before = self._friendship_rows(other_profile).count()
+            through.objects.bulk_create([
+                through(from_profile_id=self.id, to_profile_id=other_profile.id),
+                through(from_profile_id=other_profile.id, to_profile_id=self.id),
+            ], ignore_conflicts=True)
+            # Счётчики — только если связь действительно появилась
+            if self._friendship_rows(other_profile).count() == before:
+                return False
+            Profile.objects.filter(
+                id__in=[self.id, other_profile.id]
+            ).update(friends_count=F('friends_count') + 1)
+        invalidate_cached_users(self.user_id, other_profile.user_id)
+        expire_profile_sections(self.user_id, other_profile.user_id)
+        return True
+
+    def remove_friend(self, other_profile):
+        """Удалить из друзей с обновлением счётчиков"""
+        with transaction.atomic():
+            # Число удалённых строк: параллельное удаление не уменьшит счётчики дважды
+            deleted, _ = self._friendship_rows(other_profile).delete()
+            if not deleted:
+                return False
+            Profile.objects.filter(
+                id__in=[self.id, other_profile.id],
+                friends_count__gt=0
+            ).update(friends_count=F('friends_count') - 1)
+        invalidate_cached_users(self.user_id, other_profile.user_id)
+        expire_profile_sections(self.user_id, other_profile.user_id)
+        return True
+
+    @staticmethod
+    def increment_counter(user_id, field, delta=1):
+        """Атомарное изменение счётчика профиля пользователя"""
+        queryset = Profile.objects.filter(user_id=user_id)
+        if delta < 0:
+            queryset = queryset.filter(**{f'{field}__gte': -delta})
+        queryset.update(**{field: F(field) + delta})
+        invalidate_cached_users(user_id)
+
+
+def invalidate_cached_users(*user_ids):
+    """Сброс кэша пользователей после update() в обход сигналов"""
+    from .cache import user_cache
+    user_cache.invalidate(*user_ids)
+    bump('profile', *user_ids)
+
+
+def expire_profile_sections(*user_ids):
+    """Пометить кэш друзей/постов профиля устаревшим"""
+    from .services import ProfileService
+    ProfileService.expire_profile_sections(*user_ids)
+    bump('profile', *user_ids)
+
 
 @receiver(post_save, sender=User)
 def create_or_update_profile(sender, instance, created, **kwargs):
@@ -50,6 +146,12 @@ def create_or_update_profile(sender, instance, created, **kwargs):
         Profile.objects.get_or_create(user=instance)
 
 
+@receiver(pre_delete, sender=User)
+def delete_sharded_rows(sender, instance, **kwargs):
+    """Каскадное удаление из шардов вне primary"""
+    delete_user_rows(instance.pk)
+
+
 class FriendRequest(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Ожидает'),
@@ -105,36 +207,84 @@ class FriendRequest(models.Model):
         self.clean()
         super().save(*args, **kwargs)
 
-    def accept(self):
-        """Принять запрос в друзья"""
-        if self.status != 'pending':
+    def _resolve(self, status):
+        """
+        Перевести запрос из pending в status (вызывается в транзакции)
+
+        Условный UPDATE: из параллельных accept/reject (и автопринятия
+        встречного запроса) срабатывает один, счётчик уменьшается один раз.
+        """
+        updated = FriendRequest.objects.filter(pk=self.pk, status='pending').update(
+            status=status, updated_at=timezone.now()
+        )
+        if not updated:
             raise ValidationError("Запрос уже обработан")
+        self.status = status
 
-        self.status = 'accepted'
-        self.save()
+        Profile.increment_counter(self.to_user_id, 'pending_requests_count', -1)
+        # update() не отправляет post_save
+        bump('profile', self.from_user_id, self.to_user_id)
 
-        # Добавляем в друзья
-        from_profile = self.from_user.profile
-        to_profile = self.to_user.profile
+    def accept(self):
+        """Принять запрос в друзья"""
+        with transaction.atomic():
+            self._resolve('accepted')
 
-        from_profile.friends.add(to_profile)
-        to_profile.friends.add(from_profile)
+            # Добавляем в друзья
+            from_profile = self.from_user.profile
+            to_profile = self.to_user.profile
 
-        # Создаём уведомление
-        Notification.objects.create(
-            user=self.from_user,
-            notification_type='friend_accepted',
-            related_user=self.to_user,
-            message=f"{self.to_user.username} принял ваш запрос в друзья"
-        )
+            from_profile.add_friend(to_profile)
+
+            # Уведомление — фоновой задачей после фиксации
+            from .tasks import create_notification
+            create_notification.enqueue(
+                self.from_user_id,
+                'friend_accepted',
+                f"{self.to_user.username} принял ваш запрос в друзья",
+                related_user_id=self.to_user_id,
+                key=f'friend_accepted:{self.id}'
+            )
 
     def reject(self):
         """Отклонить запрос"""
-        if self.status != 'pending':
-            raise ValidationError("Запрос уже обработан")
+        with transaction.atomic():
+            self._resolve('rejected')
 
-        self.status = 'rejected'
-        self.save()
+
+@receiver(post_save, sender=FriendRequest)
+def increment_pending_requests(sender, instance, created, **kwargs):
+    if created and instance.status == 'pending':
+        Profile.increment_counter(instance.to_user_id, 'pending_requests_count')
+
+
+@receiver(post_delete, sender=FriendRequest)
+def decrement_pending_requests(sender, instance, **kwargs):
+    if instance.status == 'pending':
+        Profile.increment_counter(instance.to_user_id, 'pending_requests_count', -1)
+
+
+@receiver(post_save, sender=FriendRequest)
+@receiver(post_delete, sender=FriendRequest)
+def bump_request_profiles(sender, instance, **kwargs):
+    # Кнопки отношений на странице профиля у обеих сторон
+    bump('profile', instance.from_user_id, instance.to_user_id)
+
+
+@receiver(post_save, sender='posts.Post')
+def increment_posts_count(sender, instance, created, **kwargs):
+    if not instance.author_id:
+        return
+    if created:
+        Profile.increment_counter(instance.author_id, 'posts_count')
+    expire_profile_sections(instance.author_id)
+
+
+@receiver(post_delete, sender='posts.Post')
+def decrement_posts_count(sender, instance, **kwargs):
+    if instance.author_id:
+        Profile.increment_counter(instance.author_id, 'posts_count', -1)
+        expire_profile_sections(instance.author_id)
 
 
 class Notification(models.Model):
@@ -146,10 +296,13 @@ class Notification(models.Model):
         ('mention', 'Упоминание'),
     ]
 
+    # Шардируется по user_id: без FK-ограничений в БД,
+    # пользователи хранятся только в primary
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
-        related_name='notifications'
+        related_name='notifications',
+        db_constraint=False
     )
     notification_type = models.CharField(max_length=20, choices=NOTIFICATION_TYPES)
     related_user = models.ForeignKey(
@@ -157,12 +310,17 @@ class Notification(models.Model):
         on_delete=models.CASCADE,
         related_name='triggered_notifications',
         null=True,
-        blank=True
+        blank=True,
+        db_constraint=False
     )
     message = models.CharField(max_length=255)
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     link = models.CharField(max_length=200, blank=True)
+    # Ключ идемпотентности создавшей задачи (accounts.tasks)
+    key = models.CharField(max_length=200, null=True, blank=True)
+
+    objects = ShardedByUserManager()
 
     class Meta:
         db_table = 'notifications'
@@ -172,6 +330,9 @@ class Notification(models.Model):
         indexes = [
             models.Index(fields=['user', 'is_read', '-created_at']),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='notifications_user_key_uniq'),
+        ]
 
     def __str__(self):
         return f"{self.user.username}: {self.get_notification_type_display()}"
@@ -181,6 +342,12 @@ class Notification(models.Model):
         self.save()
 
 
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+def bump_notifications(sender, instance, **kwargs):
+    bump('notifications', instance.user_id, using=instance._state.db)
+
+
 class BlockedUser(models.Model):
     """Модель для блокировки пользователей"""
     blocker = models.ForeignKey(
@@ -203,4 +370,46 @@ class BlockedUser(models.Model):
         verbose_name_plural = 'Заблокированные пользователи'
 
     def __str__(self):
-        return f"{self.blocker.username} заблокировал {self.blocked.username}"
\ No newline at end of file
+        return f"{self.blocker.username} заблокировал {self.blocked.username}"
+
+class BackgroundTask(models.Model):
+    """Задача фоновой очереди (instagram_clone.task_queue)"""
+    STATUS_CHOICES = [
+        ('queued', 'В очереди'),
+        ('running', 'Выполняется'),
+        ('done', 'Выполнена'),
+        ('failed', 'Ошибка'),
+    ]
+
+    # Путь к функции задачи (accounts.tasks.create_notification)
+    name = models.CharField(max_length=200)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    # Ключ идемпотентности: повторная постановка с тем же ключом игнорируется
+    key = models.CharField(max_length=200, null=True, blank=True, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'background_tasks'
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.get_status_display()})"
+
+
+@receiver(post_save, sender=BlockedUser)
+@receiver(post_delete, sender=BlockedUser)
+def bump_block_profiles(sender, instance, **kwargs):
+    bump('profile', instance.blocker_id, instance.blocked_id)
@@ -5,8 +5,12 @@
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.db import transaction, models
-from django.db.models import Q, Count
-from .models import FriendRequest, Profile, Notification, BlockedUser
+from django.db.models import Q, Count, Exists, OuterRef, Subquery
+from instagram_clone.loaders import attach
+
+from .models import FriendRequest, Profile, BlockedUser
+from .cache import get_user, get_or_compute, expire
+from .tasks import create_notification
 
 
 class FriendshipService:
@@ -28,9 +32,8 @@ class FriendshipService:
         Raises:
             ValidationError: При невалидных данных
         """
-        try:
-            to_user = User.objects.select_related('profile').get(id=to_user_id)
-        except User.DoesNotExist:
+        to_user = get_user(to_user_id)
+        if to_user is None:
             raise ValidationError("Пользователь не найден")
 
         # Проверки
@@ -78,13 +81,14 @@ class FriendshipService:
                 message=message
             )
 
-            # Создаём уведомление
-            Notification.objects.create(
-                user=to_user,
-                notification_type='friend_request',
-                related_user=from_user,
-                message=f"{from_user.username} отправил вам запрос в друзья",
-                link=f"/accounts/friend-requests/"
+            # Уведомление — фоновой задачей после фиксации
+            create_notification.enqueue(
+                to_user.id,
+                'friend_request',
+                f"{from_user.username} отправил вам запрос в друзья",
+                related_user_id=from_user.id,
+                link="/accounts/friend-requests/",
+                key=f'friend_request:{friend_request.id}'
             )
 
         return friend_request
@@ -101,9 +105,8 @@ class FriendshipService:
         Raises:
             ValidationError: При невалидных данных
         """
-        try:
-            friend_user = User.objects.select_related('profile').get(id=friend_user_id)
-        except User.DoesNotExist:
+        friend_user = get_user(friend_user_id)
+        if friend_user is None:
             raise ValidationError("Пользователь не найден")
 
         user_profile = user.profile
@@ -114,7 +117,7 @@ class FriendshipService:
 
         with transaction.atomic():
             # Удаляем из друзей (ManyToMany symmetrical=True удалит с обеих сторон)
-            user_profile.friends.remove(friend_profile)
+            user_profile.remove_friend(friend_profile)
 
             # Удаляем все связанные запросы в друзья
             FriendRequest.objects.filter(
@@ -215,8 +218,7 @@ class BlockingService:
             blocker_profile = blocker.profile
             blocked_profile = blocked.profile
 
-            if blocker_profile.are_friends(blocked_profile):
-                blocker_profile.friends.remove(blocked_profile)
+            blocker_profile.remove_friend(blocked_profile)
 
             # Удаляем все запросы в друзья
             FriendRequest.objects.filter(
@@ -248,4 +250,157 @@ class BlockingService:
         if not block:
             raise ValidationError("Пользователь не заблокирован")
 
-        block.delete()
\ No newline at end of file
+        block.delete()
+
+class NotificationService:
+    """Сервис для уведомлений"""
+
+    @staticmethod
+    def attach_related_users(notifications):
+        """
+        Подставить related_user (с профилем) из кэша пользователей
+
+        Уведомления шардируются и не могут делать JOIN с таблицей
+        пользователей, поэтому авторы загружаются пакетом через
+        загрузчик запроса (из кэша, повторно — из его памяти).
+
+        Args:
+            notifications: Список Notification
+        """
+        attach(notifications, 'related_user')
+        return notifications
+
+
+class ProfileService:
+    """Сервис для данных страницы профиля"""
+
+    SECTIONS_TIMEOUT = 60
+
+    @staticmethod
+    def sections_cache_key(user_id):
+        return f'profile_sections:{user_id}'
+
+    @staticmethod
+    def get_profile_sections(profile):
+        """
+        Друзья и последние посты профиля (общие для всех зрителей)
+
+        Кэшируется с защитой от stampede: при истечении ключа
+        популярного профиля пересчитывает только один воркер.
+
+        Args:
+            profile: Профиль (Profile)
+
+        Returns:
+            dict: {'friends': [Profile], 'posts': [Post]}
+        """
+        from posts.models import Post
+
+        def compute():
+            return {
+                # В кэш не попадают хэши паролей друзей
+                'friends': list(profile.friends.select_related('user').defer('user__password')[:12]),
+                'posts': list(Post.objects.filter(
+                    author_id=profile.user_id
+                ).order_by('-created_at')[:9]),
+            }
+
+        return get_or_compute(
+            ProfileService.sections_cache_key(profile.user_id),
+            compute,
+            ProfileService.SECTIONS_TIMEOUT
+        )
+
+    @staticmethod
+    def expire_profile_sections(*user_ids):
+        for user_id in user_ids:
+            expire(ProfileService.sections_cache_key(user_id))
+
+    @staticmethod
+    def get_profile_header(viewer, profile_user_id):
+        """
+        Шапка профиля одним запросом: пользователь, профиль,
+        отношения со зрителем и счётчики
+
+        Args:
+            viewer: Текущий пользователь (User)
+            profile_user_id: ID просматриваемого пользователя
+
+        Returns:
+            dict: Данные шапки профиля
+
+        Raises:
+            User.DoesNotExist: Если пользователь не найден
+        """
+        friendship = Profile.friends.through
+
+        user = User.objects.select_related('profile').annotate(
+            is_friend=Exists(friendship.objects.filter(
+                from_profile__user=OuterRef('pk'),
+                to_profile__user=viewer.id
+            )),
+            request_sent=Exists(FriendRequest.objects.filter(
+                from_user=viewer.id,
+                to_user=OuterRef('pk'),
+                status='pending'
+            )),
+            incoming_request_id=Subquery(FriendRequest.objects.filter(
+                from_user=OuterRef('pk'),
+                to_user=viewer.id,
+                status='pending'
+            ).values('id')[:1]),
+            is_blocked=Exists(BlockedUser.objects.filter(
+                blocker=viewer.id,
+                blocked=OuterRef('pk')
+            )),
+        ).get(id=profile_user_id)
+
+        try:
+            profile = user.profile
+        except Profile.DoesNotExist:
+            # Старые пользователи без профиля
+            profile, _ = Profile.objects.get_or_create(user=user)
+
+        return {
+            'user': user,
+            'profile': profile,
+            'is_self': viewer.id == user.id,
+            'is_friend': user.is_friend,
+            'request_sent': user.request_sent,
+            'incoming_request_id': user.incoming_request_id,
+            'is_blocked': user.is_blocked,
+            'posts_count': profile.posts_count,
+            'friends_count': profile.friends_count,
+        }
+
+    @staticmethod
+    def header_as_dict(header):
+        """
+        Сериализация шапки профиля для JSON API
+
+        Args:
+            header: Результат get_profile_header
+
+        Returns:
+            dict: JSON-совместимые данные
+        """
+        user = header['user']
+        profile = header['profile']
+        return {
+            'id': user.id,
+            'username': user.username,
+            'full_name': user.get_full_name(),
+            'avatar': profile.avatar.url if profile.avatar else None,
+            'bio': profile.bio,
+            'location': profile.location,
+            'website': profile.website,
+            'is_private': profile.is_private,
+            'is_online': profile.is_online(),
+            'is_self': header['is_self'],
+            'is_friend': header['is_friend'],
+            'request_sent': header['request_sent'],
+            'incoming_request_id': header['incoming_request_id'],
+            'is_blocked': header['is_blocked'],
+            'posts_count': header['posts_count'],
+            'friends_count': header['friends_count'],
+        }
@@ -0,0 +1,263 @@
+"""
+Шардирование по user_id для быстрорастущих таблиц (уведомления)
+
+Активные шарды — settings.SHARDING['SHARDS'] (алиасы DATABASES).
+Шард пользователя хранится в Profile.notification_shard:
+- пусто — пользователь ещё не размещён, его данные в первом шарде;
+- при первой записи пользователь закрепляется за шардом по хэшу id —
+  или за первым шардом, если там уже лежат его строки (записанные до
+  добавления шардов): переносит их только reshard_notifications;
+- reshard_notifications переносит пользователей, чей шард не совпадает
+  с хэшем по текущему списку шардов, и строки, оставшиеся в других
+  шардах.
+
+Таблицы шардируемых моделей не имеют внешних ключей на уровне БД:
+пользователи живут только в primary.
+"""
+import heapq
+import zlib
+
+from django.conf import settings
+from django.db import models
+
+from instagram_clone.conditional import bump
+from instagram_clone.metrics import events
+
+
+PRIMARY = 'default'
+
+DEFAULTS = {
+    'SHARDS': [PRIMARY],
+    'MODELS': ['accounts.notification'],
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'SHARDING', {}).get(name, DEFAULTS[name])
+
+
+def get_shards():
+    return list(get_setting('SHARDS'))
+
+
+def is_sharded(model):
+    return model._meta.label_lower in get_setting('MODELS')
+
+
+def hash_shard(user_id, shards=None):
+    """Шард по хэшу id (куда пользователь попадёт при размещении)"""
+    shards = shards or get_shards()
+    return shards[zlib.crc32(str(user_id).encode()) % len(shards)]
+
+
+def _assigned_shard(user):
+    from .cache import get_user
+
+    if isinstance(user, models.Model):
+        # Загруженный профиль мог устареть, если пользователя разместили
+        # после загрузки; пустое значение перепроверяем через кэш
+        profile = user._state.fields_cache.get('profile')
+        if profile is not None and profile.notification_shard:
+            return profile.notification_shard
+        user = user.pk
+
+    cached = get_user(user)
+    if cached is None:
+        return ''
+    return cached.profile.notification_shard
+
+
+def shard_for_user(user):
+    """
+    Алиас БД с данными пользователя
+
+    Args:
+        user: User или его id
+    """
+    shards = get_shards()
+    if len(shards) == 1:
+        return shards[0]
+    return _assigned_shard(user) or shards[0]
+
+
+def assign_shard(user_id):
+    """
+    Шард для новой записи; при первой записи закрепляет пользователя
+    за шардом по хэшу
+    """
+    from .models import Profile, invalidate_cached_users
+
+    shards = get_shards()
+    if len(shards) == 1:
+        return shards[0]
+
+    assigned = _assigned_shard(user_id)
+    if assigned:
+        return assigned
+
+    shard = hash_shard(user_id, shards)
+    if shard != shards[0] and has_rows(user_id, shards[0]):
+        # Закрепление по хэшу сделало бы старые строки невидимыми
+        shard = shards[0]
+    updated = Profile.objects.filter(
+        user_id=user_id, notification_shard=''
+    ).update(notification_shard=shard)
+    invalidate_cached_users(user_id)
+    if not updated:
+        # Пользователя успели разместить раньше (или у него нет профиля)
+        return shard_for_user(user_id)
+    return shard
+
+
+def has_rows(user_id, shard):
+    """Есть ли в шарде строки пользователя (любой шардируемой модели)"""
+    from django.apps import apps
+
+    return any(
+        apps.get_model(label)._base_manager.using(shard).filter(user_id=user_id).exists()
+        for label in get_setting('MODELS')
+    )
+
+
+class ShardedByUserQuerySet(models.QuerySet):
+
+    def for_user(self, user):
+        """Записи пользователя из его шарда"""
+        user_id = user.pk if isinstance(user, models.Model) else user
+        return self.using(shard_for_user(user)).filter(user_id=user_id)
+
+    def create(self, **kwargs):
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=self._shard_for(obj))
+        return obj
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Вставка пачками: один bulk INSERT на шард"""
+        objs = list(objs)
+        shard_of_user = {}
+        by_shard = {}
+        for obj in objs:
+            if obj.user_id not in shard_of_user:
+                shard_of_user[obj.user_id] = assign_shard(obj.user_id)
+            by_shard.setdefault(shard_of_user[obj.user_id], []).append(obj)
+
+        for shard, group in by_shard.items():
+            super(ShardedByUserQuerySet, self.using(shard)).bulk_create(group, *args, **kwargs)
+
+        # bulk_create не отправляет post_save
+        events.inc(len(objs), event='notification')
+        for shard, group in by_shard.items():
+            bump('notifications', *{obj.user_id for obj in group}, using=shard)
+        return objs
+
+    def _shard_for(self, obj):
+        return assign_shard(obj.user_id)
+
+    def scatter(self, order_by=None, limit=None):
+        """
+        Scatter-gather: выполнить запрос на всех шардах и слить результат
+
+        Args:
+            order_by: Поле сортировки ('-created_at'); каждый шард
+                сортирует сам, результаты сливаются heapq.merge
+            limit: Сколько записей вернуть всего
+
+        Returns:
+            list: Объекты со всех шардов
+        """
+        parts = []
+        for shard in get_shards():
+            queryset = self.using(shard)
+            if order_by:
+                queryset = queryset.order_by(order_by)
+            if limit:
+                queryset = queryset[:limit]
+            parts.append(list(queryset))
+
+        if order_by:
+            field = order_by.lstrip('-')
+            merged = heapq.merge(
+                *parts,
+                key=lambda obj: getattr(obj, field),
+                reverse=order_by.startswith('-')
+            )
+        else:
+            merged = (obj for part in parts for obj in part)
+
+        result = []
+        for obj in merged:
+            if limit and len(result) >= limit:
+                break
+            result.append(obj)
+        return result
+
+    def scatter_count(self):
+        """Количество записей по всем шардам"""
+        return sum(self.using(shard).count() for shard in get_shards())
+
+
+ShardedByUserManager = models.Manager.from_queryset(ShardedByUserQuerySet)
+
+
+class ShardRouter:
+    """
+    Роутер шардируемых моделей: запись и чтение в шард пользователя
+    из подсказки instance. Для остальных моделей решение принимает
+    следующий роутер.
+    """
+
+    def _shard_from_hints(self, hints):
+        instance = hints.get('instance')
+        if instance is None:
+            return None
+        if instance._meta.label_lower == 'auth.user':
+            return shard_for_user(instance)
+        if is_sharded(instance._meta.model):
+            if instance._state.db:
+                return instance._state.db
+            return shard_for_user(instance.user_id)
+        return None
+
+    def db_for_read(self, model, **hints):
+        if is_sharded(model):
+            return self._shard_from_hints(hints)
+        return None
+
+    def db_for_write(self, model, **hints):
+        if is_sharded(model):
+            return self._shard_from_hints(hints) or PRIMARY
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(obj1._meta.model) or is_sharded(obj2._meta.model):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == PRIMARY or db in getattr(settings, 'DATABASE_REPLICAS', {}).get('ALIASES', []):
+            return None
+        # Отдельные БД-шарды содержат только шардируемые таблицы
+        if model_name is None:
+            return False
+        return f'{app_label}.{model_name}' in get_setting('MODELS')
+
+
+def delete_user_rows(user_id):
+    """
+    Удалить записи пользователя (и записи, где он related_*) из
+    отдельных шардов: каскад Django работает только внутри primary
+    """
+    from django.apps import apps
+
+    for label in get_setting('MODELS'):
+        model = apps.get_model(label)
+        user_fields = [
+            f.attname for f in model._meta.concrete_fields
+            if f.is_relation and f.related_model._meta.label_lower == 'auth.user'
+        ]
+        for shard in get_shards():
+            if shard == PRIMARY:
+                continue
+            for attname in user_fields:
+                model._base_manager.using(shard).filter(**{attname: user_id}).delete()
@@ -0,0 +1,33 @@
+"""
+Фоновые задачи accounts (instagram_clone.task_queue)
+
+Уведомление хранит ключ идемпотентности создавшей его задачи
+(уникален для получателя): повторное выполнение задачи после сбоя
+воркера не создаёт дублей.
+"""
+from instagram_clone.task_queue import current_key, task
+
+from .models import Notification
+
+
+@task
+def create_notification(user_id, notification_type, message, related_user_id=None, link=''):
+    """Создать уведомление в шарде получателя"""
+    create_notifications([user_id], notification_type, message, related_user_id, link)
+
+
+@task
+def create_notifications(user_ids, notification_type, message, related_user_id=None, link=''):
+    """Одно уведомление нескольким получателям: один bulk INSERT на шард"""
+    key = current_key()
+    Notification.objects.bulk_create([
+        Notification(
+            user_id=user_id,
+            notification_type=notification_type,
+            related_user_id=related_user_id,
+            message=message,
+            link=link,
+            key=key
+        )
+        for user_id in user_ids
+    ], ignore_conflicts=key is not None)
@@ -0,0 +1,14 @@
+from django import template
+
+from instagram_clone.loaders import attach
+
+register = template.Library()
+
+
+@register.filter(name='attach')
+def attach_filter(objects, paths):
+    """{% for req in requests|attach:"from_user,to_user" %}"""
+    objects = list(objects)
+    for path in paths.split(','):
+        attach(objects, path.strip())
+    return objects
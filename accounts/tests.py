@@ -1,3 +1,1276 @@
-from django.test import TestCase
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, RequestFactory, override_settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command, CommandError
+from django.urls import reverse, ResolverMatch
+from django.utils import timezone
+
+from .cache import user_cache, get_user, get_users, get_or_compute, expire
+from .models import FriendRequest, BlockedUser, Profile, Notification, BackgroundTask
+from .services import FriendshipService, ProfileService
+from .sharding import hash_shard
+from .tasks import create_notification
+from instagram_clone import loaders, metrics, profiling, ratelimit, routers, task_queue
+from instagram_clone.slow_queries import slow_query_log
+from instagram_clone.query_inspector import (
+    QueryInspectorMiddleware, QueryBudgetExceeded, normalize_sql, query_budget, view_stats
+)
+from posts.models import Comment, Post
+
+
+class ProfileHeaderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.viewer = User.objects.create_user('viewer', password='pass12345')
+        self.owner = User.objects.create_user('owner', password='pass12345')
+        self.friend = User.objects.create_user('friend', password='pass12345')
+
+        self.owner.profile.add_friend(self.friend.profile)
+        Post.objects.create(author=self.owner, title='1')
+        Post.objects.create(author=self.owner, title='2')
+        FriendRequest.objects.create(from_user=self.owner, to_user=self.viewer)
+        BlockedUser.objects.create(blocker=self.viewer, blocked=self.owner)
+
+    def test_header_single_query(self):
+        with self.assertNumQueries(1):
+            header = ProfileService.get_profile_header(self.viewer, self.owner.id)
+
+        self.assertEqual(header['posts_count'], 2)
+        self.assertEqual(header['friends_count'], 1)
+        self.assertFalse(header['is_friend'])
+        self.assertFalse(header['request_sent'])
+        self.assertIsNotNone(header['incoming_request_id'])
+        self.assertTrue(header['is_blocked'])
+        self.assertFalse(header['is_self'])
+
+    def test_header_is_friend(self):
+        header = ProfileService.get_profile_header(self.friend, self.owner.id)
+        self.assertTrue(header['is_friend'])
+        self.assertIsNone(header['incoming_request_id'])
+
+    def test_profile_view_query_count(self):
+        self.client.force_login(self.viewer)
+        url = reverse('accounts:profile', args=[self.owner.id])
+        # сессия, пользователь с профилем, шапка профиля, друзья, посты
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['posts_count'], 2)
+
+    def test_profile_api(self):
+        self.client.force_login(self.viewer)
+        response = self.client.get(reverse('accounts:profile_api', args=[self.owner.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['friends_count'], 1)
+
+        response = self.client.get(reverse('accounts:profile_api', args=[999999]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ProfileCountersTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pass12345')
+        self.bob = User.objects.create_user('bob', password='pass12345')
+
+    def counters(self, user):
+        profile = Profile.objects.get(user=user)
+        return profile.posts_count, profile.friends_count, profile.pending_requests_count
+
+    def test_posts_count(self):
+        post = Post.objects.create(author=self.alice, title='1')
+        Post.objects.create(author=self.alice, title='2')
+        self.assertEqual(self.counters(self.alice)[0], 2)
+
+        post.delete()
+        self.assertEqual(self.counters(self.alice)[0], 1)
+
+    def test_friend_request_lifecycle(self):
+        request = FriendRequest.objects.create(from_user=self.alice, to_user=self.bob)
+        self.assertEqual(self.counters(self.bob), (0, 0, 1))
+
+        request.accept()
+        self.assertEqual(self.counters(self.bob), (0, 1, 0))
+        self.assertEqual(self.counters(self.alice), (0, 1, 0))
+
+        FriendshipService.remove_friend(self.alice, self.bob.id)
+        self.assertEqual(self.counters(self.bob), (0, 0, 0))
+        self.assertEqual(self.counters(self.alice), (0, 0, 0))
+
+    def test_concurrent_friendship_changes_count_once(self):
+        alice, bob = self.alice.profile, self.bob.profile
+        # Параллельное принятие уже вставило связь
+        alice.friends.add(bob)
+        self.assertFalse(alice.add_friend(bob))
+        self.assertEqual(self.counters(self.alice)[1], 0)
+        alice.friends.remove(bob)
+
+        self.assertTrue(alice.add_friend(bob))
+        self.assertFalse(bob.add_friend(alice))
+        self.assertEqual((self.counters(self.alice)[1], self.counters(self.bob)[1]), (1, 1))
+
+        self.assertTrue(bob.remove_friend(alice))
+        self.assertFalse(alice.remove_friend(bob))
+        self.assertEqual((self.counters(self.alice)[1], self.counters(self.bob)[1]), (0, 0))
+
+    def test_concurrent_accept_counts_once(self):
+        request = FriendRequest.objects.create(from_user=self.alice, to_user=self.bob)
+        # Второй воркер загрузил тот же запрос до принятия
+        stale = FriendRequest.objects.get(pk=request.pk)
+        request.accept()
+        with self.assertRaisesMessage(ValidationError, 'Запрос уже обработан'):
+            stale.reject()
+        self.assertEqual(FriendRequest.objects.get(pk=request.pk).status, 'accepted')
+        self.assertEqual(self.counters(self.bob), (0, 1, 0))
+
+    def test_cancelled_request(self):
+        request = FriendRequest.objects.create(from_user=self.alice, to_user=self.bob)
+        request.delete()
+        self.assertEqual(self.counters(self.bob)[2], 0)
+
+    def test_profile_save_keeps_counters(self):
+        profile = self.alice.profile
+        Post.objects.create(author=self.alice, title='1')
+        profile.bio = 'hello'
+        profile.save()
+        self.assertEqual(self.counters(self.alice)[0], 1)
+
+    def test_profile_save_skips_deferred_fields(self):
+        profile = Profile.objects.only('id', 'user_id', 'bio').get(user=self.alice)
+        Profile.objects.filter(user=self.alice).update(website='https://example.com')
+        profile.bio = 'hello'
+        with self.assertNumQueries(1):
+            profile.save()
+        saved = Profile.objects.get(user=self.alice)
+        self.assertEqual((saved.bio, saved.website), ('hello', 'https://example.com'))
+
+    def test_reconcile_command(self):
+        Post.objects.create(author=self.alice, title='1')
+        Profile.objects.update(posts_count=5, friends_count=3)
+
+        call_command('reconcile_profile_counters', batch_size=1, stdout=StringIO())
+        self.assertEqual(self.counters(self.alice), (1, 0, 0))
+        self.assertEqual(self.counters(self.bob), (0, 0, 0))
+
+
+class ObjectCacheTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pass12345')
+        self.bob = User.objects.create_user('bob', password='pass12345')
+        user_cache.local.clear()
+        user_cache.shared.clear()
+        user_cache.reset_stats()
+
+    def test_read_through(self):
+        with self.assertNumQueries(1):
+            users = get_users([self.alice.id, self.bob.id])
+        self.assertEqual(users[self.alice.id].profile.user_id, self.alice.id)
+
+        with self.assertNumQueries(0):
+            users = get_users([self.alice.id, self.bob.id])
+            self.assertEqual(users[self.bob.id].username, 'bob')
+
+        stats = user_cache.stats()
+        self.assertEqual(stats['misses'], 2)
+        self.assertEqual(stats['local_hits'], 2)
+
+    def test_shared_tier(self):
+        get_user(self.alice.id)
+        user_cache.local.clear()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_user(self.alice.id).username, 'alice')
+        self.assertEqual(user_cache.stats()['shared_hits'], 1)
+
+    def test_negative_caching(self):
+        self.assertIsNone(get_user(999999))
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_user(999999))
+        self.assertEqual(user_cache.stats()['negative_hits'], 1)
+
+    def test_invalidation_on_save(self):
+        get_user(self.alice.id)
+        self.alice.first_name = 'Alice'
+        self.alice.save()
+        self.assertEqual(get_user(self.alice.id).first_name, 'Alice')
+
+        profile = self.alice.profile
+        profile.bio = 'bio'
+        profile.save()
+        self.assertEqual(get_user(self.alice.id).profile.bio, 'bio')
+
+    def test_invalidation_on_counter_update(self):
+        get_user(self.alice.id)
+        Post.objects.create(author=self.alice, title='1')
+        self.assertEqual(get_user(self.alice.id).profile.posts_count, 1)
+
+    def test_password_hash_not_cached(self):
+        get_user(self.alice.id)
+        cached = user_cache.shared.get(user_cache.make_key(self.alice.id))
+        self.assertNotIn('password', cached.__dict__)
+        self.assertEqual(cached.session_auth_hash, self.alice.get_session_auth_hash())
+
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('accounts:friend_requests'))
+        self.assertEqual(response.context['user'].pk, self.alice.pk)
+        # Пароль загружается по требованию
+        self.assertTrue(get_user(self.alice.id).check_password('pass12345'))
+
+    def test_profile_sections_without_passwords(self):
+        self.alice.profile.add_friend(self.bob.profile)
+        ProfileService.get_profile_sections(self.alice.profile)
+        sections, _, _ = cache.get(ProfileService.sections_cache_key(self.alice.id))
+        friend = sections['friends'][0]
+        self.assertEqual(friend.user.username, 'bob')
+        self.assertNotIn('password', friend.user.__dict__)
+
+    def test_invalidation_repeated_after_commit(self):
+        key = user_cache.make_key(self.alice.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.first_name = 'Alice'
+            self.alice.save()
+            # Параллельный запрос успел положить строку до COMMIT
+            stale = User.objects.select_related('profile').get(pk=self.alice.pk)
+            stale.first_name = ''
+            user_cache.local.set_many({key: stale})
+            user_cache.shared.set(key, stale)
+        self.assertEqual(get_user(self.alice.id).first_name, 'Alice')
+
+    @override_settings(SINGLE_PROCESS=False)
+    def test_process_local_cache_skips_shared_tier(self):
+        from instagram_clone.shared_cache import check_shared_caches
+        self.assertIsNone(user_cache.shared)
+        self.assertIn('instagram_clone.W001', [w.id for w in check_shared_caches(None)])
+
+        get_user(self.alice.id)
+        user_cache.local.clear()
+        with self.assertNumQueries(1):
+            get_user(self.alice.id)
+
+
+class UserHydrationMiddlewareTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pass12345')
+        self.bob = User.objects.create_user('bob', password='pass12345')
+        FriendRequest.objects.create(from_user=self.bob, to_user=self.alice)
+        self.client.force_login(self.alice)
+
+    def test_user_loaded_once_and_cached(self):
+        url = reverse('accounts:friend_requests')
+        # сессия, пользователь с профилем, входящие запросы, отправитель
+        # (attach в шаблоне, кэш пользователей пуст)
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.context['incoming_count'], 1)
+
+        # пользователь и отправитель уже в кэше
+        with self.assertNumQueries(2):
+            self.client.get(url)
+
+    def test_password_change_logs_out(self):
+        self.client.get(reverse('accounts:friend_requests'))
+        self.alice.set_password('other12345')
+        self.alice.save()
+
+        response = self.client.get(reverse('accounts:friend_requests'))
+        self.assertEqual(response.status_code, 302)
+
+
+class GetOrComputeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def compute(self):
+        with self.lock:
+            self.calls += 1
+        time.sleep(0.05)
+        return self.calls
+
+    def test_single_flight(self):
+        barrier = threading.Barrier(20)
+        results = []
+
+        def worker():
+            barrier.wait()
+            results.append(get_or_compute('stampede', self.compute, 60))
+
+        threads = [threading.Thread(target=worker) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(results, [1] * 20)
+
+    def test_stale_value_served_while_locked(self):
+        get_or_compute('stampede', self.compute, 60)
+        expire('stampede')
+
+        cache.add('stampede:lock', 1)
+        self.assertEqual(get_or_compute('stampede', self.compute, 60), 1)
+        self.assertEqual(self.calls, 1)
+
+        cache.delete('stampede:lock')
+        self.assertEqual(get_or_compute('stampede', self.compute, 60), 2)
+
+    def test_lock_of_next_holder_kept(self):
+        def slow_compute():
+            # Пересчёт дольше LOCK_TIMEOUT: блокировку уже взял другой воркер
+            cache.delete('stampede:lock')
+            cache.add('stampede:lock', 'other')
+            return 1
+
+        get_or_compute('stampede', slow_compute, 60)
+        self.assertEqual(cache.get('stampede:lock'), 'other')
+
+
+@override_settings(DATABASE_REPLICAS={'ALIASES': ['replica'], 'MAX_LAG': 5, 'COOKIE_NAME': 'db_pin'})
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        routers.reset()
+        self.router = routers.PrimaryReplicaRouter()
+
+    def tearDown(self):
+        routers.reset()
+
+    def test_reads_go_to_replica_outside_transactions(self):
+        # TestCase оборачивает тест в транзакцию
+        self.assertEqual(self.router.db_for_read(User), 'default')
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            self.assertEqual(self.router.db_for_read(User), 'replica')
+
+    def test_write_pins_reads_to_primary(self):
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            self.assertEqual(self.router.db_for_write(User), 'default')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+
+    def test_middleware_sticky_cookie(self):
+        factory = RequestFactory()
+
+        def write_view(request):
+            self.router.db_for_write(User)
+            return HttpResponse()
+
+        response = routers.ReplicaPinningMiddleware(write_view)(factory.post('/'))
+        self.assertIn('db_pin', response.cookies)
+
+        def read_view(request):
+            return HttpResponse(str(routers.is_pinned()))
+
+        request = factory.get('/')
+        request.COOKIES['db_pin'] = response.cookies['db_pin'].value
+        response = routers.ReplicaPinningMiddleware(read_view)(request)
+        self.assertEqual(response.content, b'True')
+        self.assertNotIn('db_pin', response.cookies)
+
+        response = routers.ReplicaPinningMiddleware(read_view)(factory.get('/'))
+        self.assertEqual(response.content, b'False')
+
+
+TWO_SHARDS = {'SHARDS': ['default', 'notifications_1'], 'MODELS': ['accounts.notification']}
+
+
+@override_settings(SHARDING=TWO_SHARDS)
+class NotificationShardingTests(TestCase):
+    databases = {'default', 'notifications_1'}
+
+    def setUp(self):
+        cache.clear()
+        user_cache.local.clear()
+        self.users = [User.objects.create_user(f'user{i}', password='pass12345') for i in range(6)]
+        self.sharded = next(u for u in self.users if hash_shard(u.id) == 'notifications_1')
+        self.local = next(u for u in self.users if hash_shard(u.id) == 'default')
+
+    def notify(self, user, **kwargs):
+        return Notification.objects.create(
+            user=user, notification_type='mention', message='hi', **kwargs
+        )
+
+    def test_rows_placed_by_user_hash(self):
+        self.notify(self.sharded, related_user=self.local)
+        self.notify(self.local)
+
+        self.assertEqual(Notification._base_manager.using('notifications_1').count(), 1)
+        self.assertEqual(Notification._base_manager.using('default').count(), 1)
+        self.assertEqual(Profile.objects.get(user=self.sharded).notification_shard, 'notifications_1')
+        self.assertEqual(Notification.objects.for_user(self.sharded).count(), 1)
+        self.assertEqual(Notification.objects.scatter_count(), 2)
+
+    def test_related_manager_and_api(self):
+        self.notify(self.sharded, related_user=self.local)
+        self.client.force_login(self.sharded)
+
+        response = self.client.get(reverse('accounts:get_unread_notifications'))
+        data = response.json()
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['notifications'][0]['user']['username'], self.local.username)
+
+    def test_bulk_create_groups_by_shard(self):
+        Notification.objects.bulk_create([
+            Notification(user=user, notification_type='mention', message='hi')
+            for user in self.users
+        ])
+        self.assertEqual(Notification.objects.scatter_count(), len(self.users))
+        for user in self.users:
+            self.assertEqual(Notification.objects.for_user(user).count(), 1)
+
+    def test_scatter_merges_in_order(self):
+        first = self.notify(self.sharded)
+        second = self.notify(self.local)
+        third = self.notify(self.sharded)
+        rows = Notification.objects.scatter(order_by='-id', limit=2)
+        self.assertEqual(len(rows), 2)
+        ids = [(n._state.db, n.id) for n in rows]
+        self.assertIn(('notifications_1', third.id), ids)
+
+    def test_reshard_moves_rows(self):
+        with override_settings(SHARDING={**TWO_SHARDS, 'SHARDS': ['default']}):
+            old = self.notify(self.sharded)
+        created_at = Notification._base_manager.get(id=old.id).created_at
+
+        call_command('reshard_notifications', chunk_size=1, stdout=StringIO())
+
+        self.assertFalse(Notification._base_manager.using('default').exists())
+        moved = Notification.objects.for_user(self.sharded).get()
+        self.assertEqual(moved._state.db, 'notifications_1')
+        self.assertEqual(moved.created_at, created_at)
+
+    def test_rows_from_single_shard_stay_reachable_until_reshard(self):
+        with override_settings(SHARDING={**TWO_SHARDS, 'SHARDS': ['default']}):
+            self.notify(self.sharded)
+        # Шардов стало два: новая запись не должна прятать старые строки
+        self.notify(self.sharded)
+        self.assertEqual(Profile.objects.get(user=self.sharded).notification_shard, 'default')
+        self.assertEqual(Notification.objects.for_user(self.sharded).count(), 2)
+
+        call_command('reshard_notifications', stdout=StringIO())
+        self.assertFalse(Notification._base_manager.using('default').exists())
+        self.assertEqual(Notification.objects.for_user(self.sharded).count(), 2)
+        self.assertEqual(Profile.objects.get(user=self.sharded).notification_shard, 'notifications_1')
+
+    def test_interrupted_reshard_resumes_without_duplicates(self):
+        from accounts.management.commands.reshard_notifications import Command
+
+        with override_settings(SHARDING={**TWO_SHARDS, 'SHARDS': ['default']}):
+            for _ in range(3):
+                self.notify(self.sharded)
+        with mock.patch.object(Command, 'switch', side_effect=RuntimeError('сбой')):
+            with self.assertRaises(RuntimeError):
+                call_command('reshard_notifications', chunk_size=2, stdout=StringIO())
+        # Строки скопированы, но пользователь ещё читает источник
+        self.assertEqual(Notification.objects.for_user(self.sharded).count(), 3)
+
+        call_command('reshard_notifications', chunk_size=2, stdout=StringIO())
+        self.assertEqual(Notification.objects.scatter_count(), 3)
+        self.assertEqual(Notification.objects.for_user(self.sharded).count(), 3)
+
+    def test_user_delete_cleans_shards(self):
+        self.notify(self.sharded)
+        self.notify(self.local, related_user=self.sharded)
+        self.sharded.delete()
+        self.assertEqual(Notification.objects.scatter_count(), 0)
+
+
+class GenerateSocialGraphTests(TestCase):
+    def generate(self, prefix, **options):
+        call_command(
+            'generate_social_graph', users=60, avg_friends=6, posts_per_user=1,
+            notifications_per_user=2, seed=7, batch_size=25, prefix=prefix, stdout=StringIO(),
+            **options
+        )
+        users = User.objects.filter(username__startswith=prefix)
+        start = users.order_by('id').first().id
+        edges = set(
+            Profile.friends.through.objects.filter(from_profile__user__in=users)
+            .values_list('from_profile__user_id', 'to_profile__user_id')
+        )
+        return users, {(a - start, b - start) for a, b in edges}
+
+    def post_dates(self, users):
+        return list(Post.objects.filter(author__in=users).order_by('title').values_list('title', 'created_at'))
+
+    def test_generates_consistent_deterministic_graph(self):
+        users, edges = self.generate('a')
+
+        self.assertEqual(users.count(), 60)
+        self.assertEqual(Profile.objects.filter(user__in=users).count(), 60)
+        self.assertTrue(edges)
+        self.assertTrue(all((b, a) in edges for a, b in edges))
+        self.assertEqual(Notification.objects.filter(user__in=users).count(), 120)
+
+        profile = Profile.objects.filter(user__in=users).order_by('-friends_count').first()
+        self.assertEqual(profile.friends_count, profile.friends.count())
+
+        post = Post.objects.filter(author__in=users).order_by('-comments_count').first()
+        self.assertEqual(post.comments_count, post.comments.count())
+        comment = post.comments.first()
+        self.assertEqual(comment.path, Comment.path_segment(comment.id))
+
+        # Даты отсчитываются от --anchor, а не от времени запуска
+        with self.assertRaisesMessage(CommandError, 'БД не пуста'):
+            self.generate('b')
+        other, again = self.generate('b', append=True)
+        self.assertEqual(edges, again)
+        self.assertEqual(self.post_dates(users), self.post_dates(other))
+
+
+class BenchmarkSuiteTests(TestCase):
+    def test_baseline_comparison_flags_query_regression(self):
+        call_command('generate_social_graph', users=40, seed=3, stdout=StringIO())
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline = os.path.join(tmp, 'baseline.json')
+            options = {'iterations': 3, 'warmup': 1, 'only': 'service:', 'baseline': baseline, 'stdout': StringIO()}
+
+            call_command('benchmark_suite', update_baseline=True, **options)
+            with open(baseline) as fh:
+                data = json.load(fh)
+            self.assertIn('service:send_friend_request', data['results'])
+            self.assertEqual(
+                set(data['results']['service:get_mutual_friends']),
+                {'iterations', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'queries', 'peak_memory_kb'}
+            )
+
+            data['results']['service:get_mutual_friends']['queries'] -= 1
+            with open(baseline, 'w') as fh:
+                json.dump(data, fh)
+            with self.assertRaisesMessage(CommandError, 'Регрессий'):
+                call_command('benchmark_suite', latency_threshold=100, memory_threshold=100, **options)
+
+    def test_missing_baseline(self):
+        options = {'iterations': 1, 'warmup': 0, 'only': 'service:get_mutual_friends'}
+        call_command('generate_social_graph', users=10, seed=3, stdout=StringIO())
+        with tempfile.TemporaryDirectory() as tmp:
+            missing = os.path.join(tmp, 'baseline.json')
+            out = StringIO()
+            with mock.patch('accounts.management.commands.benchmark_suite.default_baseline', return_value=missing):
+                call_command('benchmark_suite', stdout=out, **options)
+            self.assertIn('сравнение пропущено', out.getvalue())
+
+            with self.assertRaisesMessage(CommandError, 'Baseline не найден'):
+                call_command('benchmark_suite', baseline=missing, stdout=StringIO(), **options)
+
+
+class LoadReplayTests(TransactionTestCase):
+    def test_records_and_replays_requests(self):
+        alice = User.objects.create_user('alice', password='pass12345')
+        Post.objects.create(author=alice, title='Пост')
+
+        with tempfile.TemporaryDirectory() as tmp:
+            record = os.path.join(tmp, 'requests.jsonl')
+            report = os.path.join(tmp, 'report.json')
+
+            self.client.force_login(alice)
+            with override_settings(LOADTEST={'RECORD_FILE': record}):
+                self.client.get(reverse('posts:post_list'))
+                self.client.get(reverse('accounts:friend_requests'))
+                self.client.post(reverse('accounts:login'), {'username': 'alice', 'password': 'secret'})
+
+            with open(record) as fh:
+                lines = [json.loads(line) for line in fh]
+            self.assertEqual(lines[0]['user_id'], alice.id)
+            self.assertNotIn('password', lines[2]['data'])
+
+            call_command(
+                'load_replay', file=record, concurrency=2, output=report,
+                stdout=StringIO()
+            )
+            with open(report) as fh:
+                data = json.load(fh)
+
+        self.assertEqual(data['requests'], 3)
+        self.assertEqual(data['routes']['accounts:friend_requests']['statuses'], {'200': 1})
+        self.assertEqual(data['routes']['posts:post_list']['error_rate'], 0)
+
+
+class AsyncViewsTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pass12345')
+        self.bob = User.objects.create_user('bobby', password='pass12345')
+        self.bonnie = User.objects.create_user('bonnie', password='pass12345')
+        self.alice.profile.add_friend(self.bob.profile)
+        FriendshipService.send_friend_request(self.alice, self.bonnie.id)
+
+    async def test_search_users(self):
+        await self.async_client.aforce_login(self.alice)
+        response = await self.async_client.get(reverse('accounts:search_users'), {'q': 'bo'})
+
+        users = {u['username']: u for u in response.json()['users']}
+        self.assertTrue(users['bobby']['is_friend'])
+        self.assertFalse(users['bobby']['request_sent'])
+        self.assertTrue(users['bonnie']['request_sent'])
+
+    async def test_anonymous_redirected_to_login(self):
+        response = await self.async_client.get(reverse('accounts:get_unread_notifications'))
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/login', response['Location'])
+
+    async def test_accept_via_ajax(self):
+        friend_request = await FriendRequest.objects.aget(to_user=self.bonnie)
+        await self.async_client.aforce_login(self.bonnie)
+
+        response = await self.async_client.post(
+            reverse('accounts:accept_friend_request', args=[friend_request.id]),
+            headers={'X-Requested-With': 'XMLHttpRequest'}
+        )
+        self.assertEqual(response.json(), {'success': True, 'message': 'Запрос принят'})
+
+        response = await self.async_client.get(reverse('accounts:get_unread_notifications'))
+        data = response.json()
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(data['notifications'][0]['type'], 'friend_request')
+        self.assertEqual(data['notifications'][0]['user']['username'], 'alice')
+
+
+@task_queue.task(max_attempts=2)
+def failing_task(message):
+    raise RuntimeError(message)
+
+
+@override_settings(TASK_QUEUE={'EAGER': False})
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pass12345')
+        self.bob = User.objects.create_user('bob', password='pass12345')
+
+    def test_enqueued_on_commit_and_executed_by_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            friend_request = FriendshipService.send_friend_request(self.alice, self.bob.id)
+            self.assertFalse(BackgroundTask.objects.exists())
+        self.assertFalse(Notification.objects.exists())
+
+        # Повтор с тем же ключом идемпотентности игнорируется
+        with self.captureOnCommitCallbacks(execute=True):
+            create_notification.enqueue(
+                self.bob.id, 'friend_request', 'again', key=f'friend_request:{friend_request.id}'
+            )
+        task = BackgroundTask.objects.get()
+        self.assertEqual(task.key, f'friend_request:{friend_request.id}')
+
+        worker = task_queue.Worker(name='w1')
+        self.assertEqual(worker.run_once(), 1)
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts, task.locked_by), ('done', 1, ''))
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.user, self.bob)
+        self.assertEqual(notification.related_user, self.alice)
+        self.assertEqual(worker.run_once(), 0)
+
+    def test_rollback_discards_task(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            try:
+                with transaction.atomic():
+                    FriendshipService.send_friend_request(self.alice, self.bob.id)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertEqual(callbacks, [])
+        self.assertFalse(BackgroundTask.objects.exists())
+
+    def test_retry_with_backoff_then_failed(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            failing_task.enqueue('boom')
+
+        worker = task_queue.Worker(name='w1')
+        with self.assertLogs('instagram_clone.task_queue', 'WARNING'):
+            worker.run_once()
+        task = BackgroundTask.objects.get()
+        self.assertEqual((task.status, task.attempts), ('queued', 1))
+        self.assertIn('RuntimeError: boom', task.last_error)
+        self.assertGreater(task.run_at, timezone.now())
+        self.assertEqual(worker.run_once(), 0)
+
+        BackgroundTask.objects.update(run_at=timezone.now())
+        with self.assertLogs('instagram_clone.task_queue', 'WARNING'):
+            worker.run_once()
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), ('failed', 2))
+        self.assertIsNotNone(task.finished_at)
+
+    def test_stale_task_reclaimed_and_batched(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(3):
+                create_notification.enqueue(self.bob.id, 'mention', f'm{i}')
+        BackgroundTask.objects.filter(id=BackgroundTask.objects.order_by('id').first().id).update(
+            status='running', locked_by='dead', locked_at=timezone.now() - timedelta(hours=1)
+        )
+
+        call_command('run_tasks', once=True, batch_size=2, stdout=StringIO())
+
+        self.assertEqual(Notification.objects.count(), 3)
+        self.assertEqual(BackgroundTask.objects.filter(status='done').count(), 3)
+
+    def test_redelivered_task_creates_notification_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            create_notification.enqueue(self.bob.id, 'mention', 'keyed', key='mention:1')
+            create_notification.enqueue(self.bob.id, 'mention', 'unkeyed')
+        task_queue.Worker(name='w1').run_once()
+
+        # Воркер выполнил задачи, но не успел подтвердить их
+        BackgroundTask.objects.update(
+            status='running', locked_by='dead', locked_at=timezone.now() - timedelta(hours=1)
+        )
+        task_queue.Worker(name='w2').run_once()
+
+        self.assertEqual(BackgroundTask.objects.filter(status='done').count(), 2)
+        self.assertEqual(
+            sorted(Notification.objects.values_list('message', flat=True)), ['keyed', 'unkeyed']
+        )
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='pass12345')
+        self.post = Post.objects.create(author=self.alice, title='t')
+
+    def test_process_local_cache_warned(self):
+        from instagram_clone.shared_cache import check_shared_caches
+
+        def rate_limit_warnings():
+            return [w for w in check_shared_caches(None) if w.msg.startswith('RATE_LIMIT')]
+
+        self.assertEqual(rate_limit_warnings(), [])
+        with override_settings(SINGLE_PROCESS=False):
+            self.assertEqual([w.id for w in rate_limit_warnings()], ['instagram_clone.W001'])
+            with override_settings(RATE_LIMIT={'ENABLED': False}):
+                self.assertEqual(rate_limit_warnings(), [])
+
+    def test_bucket_refills_at_rate(self):
+        rule = ratelimit.Rule('60/m', burst=3)
+        now = 1_000_000_000
+        allowed = [ratelimit.consume(rule, 'rl:test', now).allowed for _ in range(4)]
+        self.assertEqual(allowed, [True, True, True, False])
+
+        denied = ratelimit.consume(rule, 'rl:test', now)
+        self.assertAlmostEqual(denied.retry_after, 1.0)
+        # Отказы не расходуют токены: через секунду — ровно один
+        self.assertTrue(ratelimit.consume(rule, 'rl:test', now + 1_000_000).allowed)
+        self.assertFalse(ratelimit.consume(rule, 'rl:test', now + 1_000_000).allowed)
+        # Простой дольше окна — снова полное ведро
+        decision = ratelimit.consume(rule, 'rl:test', now + 10_000_000)
+        self.assertEqual((decision.allowed, decision.remaining), (True, 2))
+
+    def test_like_returns_429_with_retry_after(self):
+        self.client.force_login(self.alice)
+        url = reverse('posts:post_like', args=[self.post.id])
+        statuses = [self.client.post(url).status_code for _ in range(11)]
+        self.assertEqual(statuses, [302] * 10 + [429])
+
+        response = self.client.post(url, headers={'X-Requested-With': 'XMLHttpRequest'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertFalse(response.json()['success'])
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes, 10)
+
+        # Ведро своё у каждого пользователя
+        self.client.force_login(User.objects.create_user('bob', password='pass12345'))
+        self.assertEqual(self.client.post(url).status_code, 302)
+
+    @override_settings(RATE_LIMIT={'RULES': {'accounts:login': {'rate': '1/h', 'key': 'ip'}}})
+    def test_settings_override_and_ip_key(self):
+        url = reverse('accounts:login')
+        data = {'username': 'alice', 'password': 'wrong'}
+        self.assertEqual(self.client.post(url, data).status_code, 200)
+        self.assertEqual(self.client.post(url, data).status_code, 429)
+        self.assertEqual(self.client.post(url, data, REMOTE_ADDR='10.0.0.2').status_code, 200)
+        # GET не ограничивается
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    async def test_async_view(self):
+        bob = await User.objects.acreate(username='bob')
+        await self.async_client.aforce_login(self.alice)
+        url = reverse('accounts:send_friend_request', args=[bob.id])
+        with override_settings(RATE_LIMIT={'RULES': {
+            'accounts:send_friend_request': {'rate': '1/m'}
+        }}):
+            self.assertEqual((await self.async_client.post(url)).status_code, 302)
+            self.assertEqual((await self.async_client.post(url)).status_code, 429)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='pass12345')
+        self.bob = User.objects.create_user('bob', password='pass12345')
+        self.client.force_login(self.alice)
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, headers={'If-None-Match': etag})
+
+    def test_profile_304_until_relationship_changes(self):
+        url = reverse('accounts:profile', args=[self.bob.id])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertIn('private', response['Cache-Control'])
+
+        # Без рендеринга: только сессия
+        with self.assertNumQueries(1):
+            response = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        FriendshipService.send_friend_request(self.bob, self.alice.id)
+        response = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'handleFriendRequest')
+
+        # ETag персональный
+        self.client.force_login(self.bob)
+        self.assertEqual(self.revalidate(url, response['ETag']).status_code, 200)
+
+    @override_settings(SINGLE_PROCESS=False)
+    def test_disabled_with_process_local_cache(self):
+        url = reverse('accounts:get_unread_notifications')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+
+    def test_unread_poll(self):
+        url = reverse('accounts:get_unread_notifications')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.revalidate(url, etag).status_code, 304)
+
+        notification = Notification.objects.create(user=self.alice, notification_type='mention', message='hi')
+        response = self.revalidate(url, etag)
+        self.assertEqual(response.json()['count'], 1)
+
+        etag = response['ETag']
+        notification.mark_as_read()
+        response = self.revalidate(url, etag)
+        self.assertEqual(response.json()['count'], 0)
+
+    def test_post_detail_changes_on_edit(self):
+        post = Post.objects.create(author=self.bob, title='before')
+        url = reverse('posts:post_detail', args=[post.id])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.revalidate(url, etag).status_code, 304)
+
+        post.title = 'after'
+        post.save()
+        self.assertContains(self.revalidate(url, etag), 'after')
+
+
+class ReadApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='pass12345', first_name='Alice')
+        self.bob = User.objects.create_user('bob', password='pass12345')
+        self.carol = User.objects.create_user('carol', password='pass12345')
+        Profile.objects.filter(user=self.carol).update(is_private=True)
+        self.bob_post = Post.objects.create(author=self.bob, title='bob', image='post_images/b.jpg')
+        self.carol_post = Post.objects.create(author=self.carol, title='carol')
+        self.notification = Notification.objects.create(
+            user=self.alice, notification_type='mention', message='hi', related_user=self.bob
+        )
+        self.client.force_login(self.alice)
+        self.url = reverse('api_batch')
+
+    def batch(self, ids, **fields):
+        params = {'ids': ids, **{f'fields[{kind}]': value for kind, value in fields.items()}}
+        return self.client.get(self.url, params)
+
+    def test_mixed_types_one_query_each(self):
+        ids = (f'profile:{self.alice.id},profile:{self.bob.id},post:{self.bob_post.id},'
+               f'notification:{self.notification.id}')
+        # Сессия, пользователь и по запросу на тип
+        with self.assertNumQueries(5):
+            response = self.batch(ids, profile='username,full_name', post='title,image')
+        data = response.json()
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(data['missing'], [])
+        self.assertEqual(data['data']['profile'][str(self.alice.id)],
+                         {'username': 'alice', 'full_name': 'Alice'})
+        self.assertEqual(data['data']['post'][str(self.bob_post.id)],
+                         {'title': 'bob', 'image': '/media/post_images/b.jpg'})
+        notification = data['data']['notification'][str(self.notification.id)]
+        self.assertEqual(notification['related_user_id'], self.bob.id)
+        self.assertIn('created_at', notification)
+
+    def test_private_posts_and_foreign_notifications_are_missing(self):
+        other = Notification.objects.create(user=self.bob, notification_type='mention', message='x')
+        ids = f'post:{self.carol_post.id},post:{self.bob_post.id},notification:{other.id},profile:999'
+        data = self.batch(ids).json()
+        self.assertEqual(list(data['data']['post']), [str(self.bob_post.id)])
+        self.assertEqual(data['missing'], [
+            f'post:{self.carol_post.id}', f'notification:{other.id}', 'profile:999'
+        ])
+
+        self.carol.profile.add_friend(self.alice.profile)
+        data = self.batch(f'post:{self.carol_post.id}').json()
+        self.assertEqual(data['missing'], [])
+
+    def test_errors(self):
+        self.assertEqual(self.batch('').status_code, 400)
+        self.assertEqual(self.batch('video:1').status_code, 400)
+        self.assertEqual(self.batch('post:x').status_code, 400)
+        response = self.batch(f'post:{self.bob_post.id}', post='title,password')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('password', response.json()['error'])
+        with override_settings(READ_API={'MAX_IDS': 2}):
+            self.assertEqual(self.batch('post:1,post:2,post:3').status_code, 400)
+
+    def test_revalidation(self):
+        ids = f'profile:{self.bob.id},post:{self.bob_post.id}'
+        etag = self.batch(ids)['ETag']
+        response = self.client.get(self.url, {'ids': ids}, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+        self.bob_post.title = 'new'
+        self.bob_post.save()
+        response = self.client.get(self.url, {'ids': ids}, headers={'If-None-Match': etag})
+        self.assertEqual(response.json()['data']['post'][str(self.bob_post.id)]['title'], 'new')
+
+
+class LoaderTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user_cache.local.clear()
+        self.users = [User.objects.create_user(f'user{i}', password='pass12345') for i in range(3)]
+        self.posts = [Post.objects.create(author=user, title=user.username) for user in self.users]
+
+    def test_deferred_keys_load_in_one_batch_and_are_memoized(self):
+        with loaders.scope():
+            posts = loaders.get_loader(Post)
+            self.assertIs(loaders.get_loader('posts.Post'), posts)
+            posts.defer(self.posts[0].id, self.posts[1].id, 999)
+            with self.assertNumQueries(1):
+                post = posts.get(self.posts[2].id)
+            self.assertEqual(post.title, 'user2')
+            with self.assertNumQueries(0):
+                self.assertEqual(len(posts.get_many([p.id for p in self.posts] + [999])), 3)
+                self.assertIsNone(posts.get(999))
+
+            # Изменение объекта сбрасывает его из загрузчика
+            post.title = 'new'
+            post.save()
+            self.assertNotIn(post.id, posts.cache)
+
+        # Вне scope() — без общей памяти
+        self.assertIsNot(loaders.get_loader(Post), loaders.get_loader(Post))
+
+    def test_attach_by_foreign_key_and_reverse_one_to_one(self):
+        profiles = list(Profile.objects.filter(user__in=self.users))
+        with loaders.scope():
+            with self.assertNumQueries(1):
+                loaders.attach(profiles, 'user')
+                loaders.attach(profiles, 'user')
+            self.assertEqual({p.user.username for p in profiles}, {'user0', 'user1', 'user2'})
+
+            users = list(User.objects.filter(id__in=[u.id for u in self.users]))
+            with self.assertNumQueries(1):
+                loaders.attach(users, 'profile')
+            with self.assertNumQueries(0):
+                self.assertEqual([u.profile.user_id for u in users], [u.id for u in users])
+
+    def test_template_filter_uses_user_cache(self):
+        for user in self.users[1:]:
+            FriendRequest.objects.create(from_user=user, to_user=self.users[0])
+        get_users(u.id for u in self.users)
+        template = Template(
+            '{% load loaders %}{% for req in requests|attach:"from_user" %}'
+            '{{ req.from_user.username }}:{{ req.from_user.profile.friends_count }} {% endfor %}'
+        )
+        with loaders.scope(), self.assertNumQueries(1):
+            output = template.render(Context({
+                'requests': FriendRequest.objects.filter(to_user=self.users[0]).order_by('id')
+            }))
+        self.assertEqual(output, 'user1:0 user2:0 ')
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        for name, content in (('avatars/a.png', b'0123456789'), ('post_images/p.jpg', b'secret')):
+            os.makedirs(os.path.join(self.tmp.name, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(self.tmp.name, name), 'wb') as f:
+                f.write(content)
+        override = override_settings(MEDIA_ROOT=self.tmp.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.owner = User.objects.create_user('owner', password='pass12345')
+        self.friend = User.objects.create_user('friend', password='pass12345')
+        self.stranger = User.objects.create_user('stranger', password='pass12345')
+        self.owner.profile.add_friend(self.friend.profile)
+        Post.objects.create(author=self.owner, image='post_images/p.jpg')
+
+    def content(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_ranges_and_validators(self):
+        url = '/media/avatars/a.png'
+        response = self.client.get(url)
+        self.assertEqual(self.content(response), b'0123456789')
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('public', response['Cache-Control'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        etag = response['ETag']
+
+        self.assertEqual(self.client.get(url, headers={'If-None-Match': etag}).status_code, 304)
+
+        response = self.client.get(url, headers={'Range': 'bytes=2-5'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(self.content(response), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+
+        response = self.client.get(url, headers={'Range': 'bytes=-3'})
+        self.assertEqual(self.content(response), b'789')
+
+        response = self.client.get(url, headers={'Range': 'bytes=20-'})
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+
+        # Файл изменился с тех пор, как клиент получил первую часть
+        response = self.client.get(url, headers={'Range': 'bytes=2-5', 'If-Range': '"old"'})
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.client.get('/media/../manage.py').status_code, 404)
+        self.assertEqual(self.client.get('/media/avatars/missing.png').status_code, 404)
+
+    def test_private_profile_images(self):
+        url = '/media/post_images/p.jpg'
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.owner.profile.is_private = True
+        self.owner.profile.save()
+
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_login(self.stranger)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        for user in (self.friend, self.owner):
+            self.client.force_login(user)
+            response = self.client.get(url)
+            self.assertEqual(self.content(response), b'secret')
+            # Браузер перепроверяет доступ при каждом обращении
+            self.assertIn('private', response['Cache-Control'])
+            self.assertIn('no-cache', response['Cache-Control'])
+            self.assertNotIn('immutable', response['Cache-Control'])
+            revalidated = self.client.get(url, headers={'If-None-Match': response['ETag']})
+            self.assertEqual(revalidated.status_code, 304)
+
+        # Файл без поста
+        os.rename(os.path.join(self.tmp.name, 'post_images/p.jpg'),
+                  os.path.join(self.tmp.name, 'post_images/orphan.jpg'))
+        self.assertEqual(self.client.get('/media/post_images/orphan.jpg').status_code, 404)
+
+    @override_settings(MEDIA_SERVING={'MODE': 'x-accel', 'ACCEL_PREFIX': '/protected-media/'})
+    def test_accel_redirect(self):
+        response = self.client.get('/media/avatars/a.png')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/avatars/a.png')
+        self.assertEqual(response.content, b'')
+
+
+class QueryInspectorTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        view_stats.reset()
+
+    def run_view(self, view):
+        request = self.factory.get('/')
+        request.resolver_match = ResolverMatch(view, (), {}, url_name='view', namespaces=['test'])
+        return request, QueryInspectorMiddleware(view)(request)
+
+    def test_normalize_collapses_literals_and_in_lists(self):
+        self.assertEqual(
+            normalize_sql("SELECT * FROM t WHERE id IN (%s, %s, %s) AND name = 'x' LIMIT 21"),
+            normalize_sql("SELECT * FROM t WHERE id IN (%s, %s) AND name = 'y' LIMIT 5"),
+        )
+
+    def test_budget_exceeded_raises_in_tests(self):
+        User.objects.create_user('alice', password='pass12345')
+
+        @query_budget(1)
+        def view(request):
+            list(User.objects.all())
+            list(User.objects.all())
+            return HttpResponse()
+
+        with self.assertRaises(QueryBudgetExceeded):
+            self.run_view(view)
+
+    @override_settings(QUERY_INSPECTOR={'RAISE': False, 'REPEAT_THRESHOLD': 2})
+    def test_repeated_queries_logged(self):
+        users = [User.objects.create_user(f'u{i}', password='pass12345') for i in range(4)]
+
+        def view(request):
+            for user in users:
+                User.objects.get(id=user.id)
+            return HttpResponse()
+
+        with self.assertLogs('instagram_clone.queries', level='WARNING') as logs:
+            request, _ = self.run_view(view)
+
+        self.assertEqual(request.query_stats.count, 4)
+        self.assertIn('N+1', logs.output[0])
+        stats = view_stats.snapshot()['test:view']
+        self.assertEqual(stats['queries'], 4)
+        self.assertEqual(len(stats['repeated']), 1)
+
+
+@override_settings(SLOW_QUERIES={'THRESHOLD_MS': 0})
+class SlowQueryLogTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # С порогом 0 медленный каждый запрос, включая транзакции самого
+        # TestCase: предупреждения проверяются через assertLogs, остальные
+        # не выводятся
+        logger = logging.getLogger('instagram_clone.slow_queries')
+        cls.addClassCleanup(logger.setLevel, logger.level)
+        logger.setLevel(logging.ERROR)
+        super().setUpClass()
+
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pass12345')
+        slow_query_log.reset()
+
+    def test_records_call_site_and_plan(self):
+        with self.assertLogs('instagram_clone.slow_queries', level='WARNING'):
+            ProfileService.get_profile_header(self.alice, self.alice.id)
+            ProfileService.get_profile_header(self.alice, self.alice.id)
+
+        report = slow_query_log.report()
+        entry = next(
+            e for e in report
+            if 'accounts.services.ProfileService.get_profile_header' in e['callers']
+        )
+        self.assertGreaterEqual(entry['count'], 2)
+        self.assertTrue(entry['plan'])
+
+    def test_failed_query_not_recorded(self):
+        from django.db import IntegrityError
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create_user('alice', password='pass12345')
+        self.assertFalse(any('INSERT' in e['sample'] for e in slow_query_log.report()))
+
+    def test_full_scan_flagged_and_view_reported(self):
+        self.client.force_login(self.alice)
+        with self.assertLogs('instagram_clone.slow_queries', level='WARNING'):
+            self.client.get(reverse('accounts:search_users'), {'q': 'ali'})
+
+        scans = [e for e in slow_query_log.report() if e['full_scan']]
+        self.assertTrue(any('accounts.views.search_users' in e['views'] for e in scans))
+
+        self.alice.is_staff = True
+        self.alice.save()
+        response = self.client.get(reverse('slow_queries'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['queries'])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pass12345')
+
+    def test_endpoint_reports_requests_and_templates(self):
+        self.client.force_login(self.alice)
+        self.client.get(reverse('accounts:friend_requests'))
+
+        self.alice.is_staff = True
+        self.alice.save()
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('http_request_duration_seconds_count{view="accounts:friend_requests",method="GET"}', body)
+        self.assertIn('db_queries_total{view="accounts:friend_requests"}', body)
+        self.assertIn('template_render_seconds_count{template="accounts/friend_requests.html"}', body)
+        self.assertIn('object_cache_lookups_total{result="misses"}', body)
+
+    def test_domain_events(self):
+        before = dict((tuple(k), v) for k, v in metrics.events.dump()).get(('friend_request',), 0)
+        bob = User.objects.create_user('bob', password='pass12345')
+        FriendshipService.send_friend_request(self.alice, bob.id)
+        after = dict((tuple(k), v) for k, v in metrics.events.dump())
+        self.assertEqual(after[('friend_request',)], before + 1)
+
+    def test_forbidden_without_staff_or_token(self):
+        # Адрес прокси на той же машине — не аутентификация
+        self.assertEqual(self.client.get(reverse('metrics'), REMOTE_ADDR='127.0.0.1').status_code, 403)
+        self.client.force_login(self.alice)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+
+    @override_settings(METRICS={'TOKEN': 's3cret', 'ALLOWED_IPS': ['10.0.0.0/8']})
+    def test_bearer_token(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong', REMOTE_ADDR='10.1.2.3').status_code, 403)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer s3cret', REMOTE_ADDR='10.1.2.3').status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer s3cret', REMOTE_ADDR='192.0.2.1').status_code, 403)
+
+    def test_multiprocess_snapshots_are_summed(self):
+        registry = metrics.Registry()
+        counter = registry.counter('jobs', 'test', ('kind',))
+        counter.inc(2, kind='a')
+
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(METRICS={'MULTIPROCESS_DIR': directory}):
+                other = {'metrics': {'jobs': [[['a'], 3]]}, 'collected': {}}
+                with open(os.path.join(directory, '999999.json'), 'w') as fh:
+                    json.dump(other, fh)
+                self.assertIn('jobs_total{kind="a"} 5', registry.render())
+
+
+class ProfilingMiddlewareTests(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.staff = User.objects.create_user('staff', password='pass12345', is_staff=True)
+        self.client.force_login(self.staff)
+
+    def test_signed_header_triggers_profile(self):
+        for mode in ('cprofile', 'sampler'):
+            with override_settings(PROFILING={'DIR': self.tmp.name, 'MODE': mode, 'SAMPLE_INTERVAL': 0.0005}):
+                self.client.get(reverse('accounts:friend_requests'), HTTP_X_PROFILE_TOKEN=profiling.make_token(self.staff))
+
+        with override_settings(PROFILING={'DIR': self.tmp.name}):
+            profiles = profiling.list_profiles()
+            self.assertEqual({p['mode'] for p in profiles}, {'cprofile', 'sampler'})
+            self.assertEqual(profiles[0]['view'], 'accounts:friend_requests')
+
+            index = self.client.get(reverse('profile_index'))
+            self.assertContains(index, 'accounts:friend_requests')
+
+            cprof = next(p for p in profiles if p['mode'] == 'cprofile')
+            detail = self.client.get(reverse('profile_detail', args=[cprof['id']]))
+            self.assertContains(detail, 'function calls')
+
+    def test_invalid_token_ignored(self):
+        with override_settings(PROFILING={'DIR': self.tmp.name}):
+            self.client.get(reverse('accounts:friend_requests'), HTTP_X_PROFILE_TOKEN='bad')
+            self.assertEqual(profiling.list_profiles(), [])
+
+    def test_token_bound_to_staff_session(self):
+        token = profiling.make_token(self.staff)
+        other = User.objects.create_user('other', password='pass12345', is_staff=True)
+        with override_settings(PROFILING={'DIR': self.tmp.name}):
+            self.client.logout()
+            self.client.get(reverse('accounts:friend_requests'), HTTP_X_PROFILE_TOKEN=token)
+            self.client.force_login(other)
+            self.client.get(reverse('accounts:friend_requests'), HTTP_X_PROFILE_TOKEN=token)
+            self.assertEqual(profiling.list_profiles(), [])
+
+    def test_index_staff_only(self):
+        self.client.force_login(User.objects.create_user('bob', password='pass12345'))
+        response = self.client.get(reverse('profile_index'))
+        self.assertEqual(response.status_code, 302)
@@ -17,6 +17,7 @@ from .views import (
     all_users,
     search_users,
     profile_view,
+    profile_api,
     friends_list_view,
     edit_profile_view,  # <-- ДОБАВЬТЕ ЭТОТ ИМПОРТ!
 
@@ -46,6 +47,7 @@ urlpatterns = [
     path('search-users/', search_users, name='search_users'),
     path('profile/<int:user_id>/', profile_view, name='profile'),
     path('profile/<int:user_id>/friends/', friends_list_view, name='friends_list'),
+    path('api/profile/<int:user_id>/', profile_api, name='profile_api'),
     path('edit-profile/', edit_profile_view, name='edit_profile'),  # <-- ПЕРЕМЕСТИТЕ В ЭТОТ РАЗДЕЛ!
 
     # ============ Notifications ============
@@ -1,10 +1,11 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.models import User
 from django.views.generic import ListView, DetailView
-from django.http import JsonResponse
+from django.http import JsonResponse, Http404
 from django.db.models import Q
 from django.core.paginator import Paginator
 from django.contrib import messages
@@ -12,10 +13,14 @@ from django.utils import timezone
 from django.views.decorators.http import require_POST
 from django.core.exceptions import ValidationError
 
+from .decorators import alogin_required
 from .forms import RegisterForm
-from .models import FriendRequest, Profile, BlockedUser
-from .services import FriendshipService
+from .models import FriendRequest, Profile, BlockedUser, Notification
+from .services import FriendshipService, ProfileService, NotificationService
 from posts.models import Post
+from instagram_clone.conditional import conditional, get_versions, bump
+from instagram_clone.query_inspector import query_budget
+from instagram_clone.ratelimit import rate_limit
 
 
 # ============ Authentication Views ============
@@ -39,6 +44,7 @@ def register_view(request):
     return render(request, 'accounts/register.html', {'form': form})
 
 
+@rate_limit('10/m', burst=5, key='ip')
 def login_view(request):
     if request.user.is_authenticated:
         return redirect('accounts:profile', user_id=request.user.id)
@@ -94,13 +100,14 @@ def logout_view(request):
 
 # ============ Friend Request Views ============
 
-@login_required
+@rate_limit('20/m', burst=10)
+@alogin_required
 @require_POST
-def send_friend_request(request, user_id):
+async def send_friend_request(request, user_id):
     """Отправка запроса в друзья"""
     try:
-        service = FriendshipService()
-        friend_request = service.send_friend_request(request.user, user_id)
+        # Сервис выполняет несколько проверок и запись — целиком в потоке
+        friend_request = await sync_to_async(FriendshipService.send_friend_request)(request.user, user_id)
 
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({
@@ -119,13 +126,16 @@ def send_friend_request(request, user_id):
         return redirect('accounts:profile', user_id=user_id)
 
 
+@query_budget(5)
 @login_required
 def friend_requests_view(request):
     """Список входящих запросов"""
+    # Отправители (с профилями) подставляются в шаблоне фильтром
+    # attach — из кэша пользователей, без JOIN
     incoming_requests = FriendRequest.objects.filter(
         to_user=request.user,
         status='pending'
-    ).select_related('from_user', 'from_user__profile').order_by('-timestamp')
+    ).order_by('-timestamp')
 
     outgoing_requests = FriendRequest.objects.filter(
         from_user=request.user,
@@ -135,24 +145,24 @@ def friend_requests_view(request):
     context = {
         'incoming_requests': incoming_requests,
         'outgoing_requests': outgoing_requests,
-        'incoming_count': incoming_requests.count(),
+        'incoming_count': request.user.profile.pending_requests_count,
     }
 
     return render(request, 'accounts/friend_requests.html', context)
 
 
-@login_required
+@alogin_required
 @require_POST
-def accept_friend_request(request, request_id):
+async def accept_friend_request(request, request_id):
     """Принять запрос в друзья"""
     try:
-        friend_request = get_object_or_404(
-            FriendRequest,
+        friend_request = await aget_object_or_404(
+            FriendRequest.objects.select_related('from_user'),
             id=request_id,
             to_user=request.user,
             status='pending'
         )
-        friend_request.accept()
+        await sync_to_async(friend_request.accept)()
 
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({'success': True, 'message': 'Запрос принят'})
@@ -173,17 +183,17 @@ def accept_friend_request(request, request_id):
         return redirect('accounts:friend_requests')
 
 
-@login_required
+@alogin_required
 @require_POST
-def reject_friend_request(request, request_id):
+async def reject_friend_request(request, request_id):
     """Отклонить запрос"""
-    friend_request = get_object_or_404(
+    friend_request = await aget_object_or_404(
         FriendRequest,
         id=request_id,
         to_user=request.user,
         status='pending'
     )
-    friend_request.reject()
+    await sync_to_async(friend_request.reject)()
 
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({'success': True, 'message': 'Запрос отклонён'})
@@ -192,17 +202,17 @@ def reject_friend_request(request, request_id):
     return redirect('accounts:friend_requests')
 
 
-@login_required
+@alogin_required
 @require_POST
-def cancel_friend_request(request, request_id):
+async def cancel_friend_request(request, request_id):
     """Отменить отправленный запрос"""
-    friend_request = get_object_or_404(
+    friend_request = await aget_object_or_404(
         FriendRequest,
         id=request_id,
         from_user=request.user,
         status='pending'
     )
-    friend_request.delete()
+    await friend_request.adelete()
 
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({'success': True, 'message': 'Запрос отменён'})
@@ -211,13 +221,12 @@ def cancel_friend_request(request, request_id):
     return redirect('accounts:friend_requests')
 
 
-@login_required
+@alogin_required
 @require_POST
-def remove_friend(request, user_id):
+async def remove_friend(request, user_id):
     """Удалить из друзей"""
     try:
-        service = FriendshipService()
-        service.remove_friend(request.user, user_id)
+        await sync_to_async(FriendshipService.remove_friend)(request.user, user_id)
 
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return JsonResponse({'success': True, 'message': 'Удалено из друзей'})
@@ -265,85 +274,113 @@ class AllUsersView(LoginRequiredMixin, ListView):
         return context
 
 
-@login_required
-def search_users(request):
+@query_budget(5)
+@alogin_required
+async def search_users(request):
     query = request.GET.get('q', '').strip()
 
     if len(query) < 2:
         return JsonResponse({'users': [], 'message': 'Введите минимум 2 символа'})
 
-    users = User.objects.filter(
-        Q(username__icontains=query) |
-        Q(first_name__icontains=query) |
-        Q(last_name__icontains=query)
-    ).exclude(id=request.user.id).select_related('profile')[:20]
-
-    blocked_ids = BlockedUser.objects.filter(blocker=request.user).values_list('blocked_id', flat=True)
-    users = users.exclude(id__in=blocked_ids)
-
-    data = []
-    for user in users:
-        is_friend = request.user.profile.are_friends(user.profile)
-        request_sent = FriendRequest.objects.filter(from_user=request.user, to_user=user, status='pending').exists()
-
-        data.append({
-            'id': user.id,
-            'username': user.username,
-            'full_name': user.get_full_name(),
-            'avatar': user.profile.avatar.url if user.profile.avatar else None,
-            'is_friend': is_friend,
-            'request_sent': request_sent,
-            'is_online': user.profile.is_online(),
-        })
+    viewer = request.user
+    blocked_ids = BlockedUser.objects.filter(blocker=viewer).values_list('blocked_id', flat=True)
+    users = [
+        user async for user in User.objects.filter(
+            Q(username__icontains=query) |
+            Q(first_name__icontains=query) |
+            Q(last_name__icontains=query)
+        ).exclude(id=viewer.id).exclude(id__in=blocked_ids).select_related('profile')[:20]
+    ]
+    ids = [user.id for user in users]
+
+    # Дружба и запросы — одним запросом на всех найденных
+    friend_ids = {
+        user_id async for user_id in Profile.friends.through.objects.filter(
+            from_profile__user_id=viewer.id, to_profile__user_id__in=ids
+        ).values_list('to_profile__user_id', flat=True)
+    }
+    sent_ids = {
+        user_id async for user_id in FriendRequest.objects.filter(
+            from_user_id=viewer.id, to_user_id__in=ids, status='pending'
+        ).values_list('to_user_id', flat=True)
+    }
+
+    data = [{
+        'id': user.id,
+        'username': user.username,
+        'full_name': user.get_full_name(),
+        'avatar': user.profile.avatar.url if user.profile.avatar else None,
+        'is_friend': user.id in friend_ids,
+        'request_sent': user.id in sent_ids,
+        'is_online': user.profile.is_online(),
+    } for user in users]
 
     return JsonResponse({'users': data})
 
 
 # ============ Profile Views ============
 
+def profile_etag(request, user_id):
+    """
+    ETag страницы профиля: версии профиля и зрителя (поля, счётчики,
+    разделы, отношения)
+    """
+    return get_versions('profile', request.user.id, user_id)
+
+
 class ProfileView(LoginRequiredMixin, DetailView):
     model = User
     template_name = 'accounts/profile.html'
     context_object_name = 'profile_user'
     pk_url_kwarg = 'user_id'
 
+    def get_object(self, queryset=None):
+        try:
+            self.header = ProfileService.get_profile_header(
+                self.request.user,
+                self.kwargs[self.pk_url_kwarg]
+            )
+        except User.DoesNotExist:
+            raise Http404("Пользователь не найден")
+        return self.header['user']
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        profile_user = self.object
-        profile, _ = Profile.objects.get_or_create(user=profile_user)
+        header = self.header
+        profile = header['profile']
 
         context['profile'] = profile
-        context['is_self'] = (self.request.user == profile_user)
-        context['is_friend'] = self.request.user.profile.are_friends(profile)
-        context['request_sent'] = FriendRequest.objects.filter(
-            from_user=self.request.user,
-            to_user=profile_user,
-            status='pending'
-        ).exists()
-        context['incoming_request'] = FriendRequest.objects.filter(
-            from_user=profile_user,
-            to_user=self.request.user,
-            status='pending'
-        ).first()
-        context['is_blocked'] = BlockedUser.objects.filter(
-            blocker=self.request.user,
-            blocked=profile_user
-        ).exists()
+        context['is_self'] = header['is_self']
+        context['is_friend'] = header['is_friend']
+        context['request_sent'] = header['request_sent']
+        context['incoming_request_id'] = header['incoming_request_id']
+        context['is_blocked'] = header['is_blocked']
+        context['posts_count'] = header['posts_count']
+        context['friends_count'] = header['friends_count']
+
+        # Друзья и посты — общие для всех зрителей, из кэша
+        sections = ProfileService.get_profile_sections(profile)
+        context['friends'] = sections['friends']
+        context['posts'] = sections['posts']
 
-        # Друзья — выбираем Profile объектов друзей
-        context['friends'] = profile.friends.all()[:12]  # уже Profile объекты
+        return context
 
-        # Посты
-        context['posts'] = Post.objects.filter(
-            author=profile_user
-        ).order_by('-created_at')[:9]
 
-        return context
+@query_budget(3)
+@login_required
+def profile_api(request, user_id):
+    """Шапка профиля в JSON"""
+    try:
+        header = ProfileService.get_profile_header(request.user, user_id)
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'Пользователь не найден'}, status=404)
 
-        return context
+    return JsonResponse(ProfileService.header_as_dict(header))
 
 
 @login_required
+@conditional(lambda request, user_id: get_versions('profile', user_id),
+             max_age=ProfileService.SECTIONS_TIMEOUT)
 def friends_list_view(request, user_id):
     user = get_object_or_404(User, id=user_id)
     profile = user.profile
@@ -366,15 +403,24 @@ def friends_list_view(request, user_id):
 
 @login_required
 def notifications_view(request):
-    notifications = request.user.notifications.select_related('related_user', 'related_user__profile').order_by('-created_at')[:50]
+    notifications = list(request.user.notifications.order_by('-created_at')[:50])
+    # Уведомления могут лежать в шарде без таблицы пользователей — без JOIN
+    NotificationService.attach_related_users(notifications)
     request.user.notifications.filter(is_read=False).update(is_read=True)
+    bump('notifications', request.user.id)
 
     return render(request, 'accounts/notifications.html', {'notifications': notifications})
 
 
-@login_required
-def get_unread_notifications(request):
-    notifications = request.user.notifications.filter(is_read=False).select_related('related_user')[:10]
+@query_budget(5)
+@alogin_required
+@conditional(lambda request: get_versions('notifications', request.user.id), html=False)
+async def get_unread_notifications(request):
+    # Выбор шарда может обратиться к кэшу пользователей (и к БД)
+    mine = await sync_to_async(Notification.objects.for_user)(request.user)
+    unread = mine.filter(is_read=False)
+    notifications = [n async for n in unread[:10]]
+    await sync_to_async(NotificationService.attach_related_users)(notifications)
 
     data = [{
         'id': n.id,
@@ -388,7 +434,7 @@ def get_unread_notifications(request):
         }
     } for n in notifications]
 
-    return JsonResponse({'notifications': data, 'count': request.user.notifications.filter(is_read=False).count()})
+    return JsonResponse({'notifications': data, 'count': await unread.acount()})
 
 
 from django.contrib.auth.decorators import login_required
@@ -433,4 +479,8 @@ def handler403(request, exception):
 
 # Создаём экземпляры для urls.py
 all_users = AllUsersView.as_view()
-profile_view = ProfileView.as_view()
+# Статус «онлайн», имена и аватары друзей в разделах версией не
+# отслеживаются — max_age
+profile_view = query_budget(5)(
+    conditional(profile_etag, max_age=ProfileService.SECTIONS_TIMEOUT)(ProfileView.as_view())
+)
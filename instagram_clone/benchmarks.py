@@ -0,0 +1,276 @@
+"""
+Набор бенчмарков горячих представлений и сервисов
+
+Каждый сценарий выполняется на текущих данных (generate_social_graph
+с фиксированным seed) WARMUP + ITERATIONS раз. Для него фиксируются
+p50/p95/p99 времени, число SQL-запросов на вызов и пик памяти Python
+(tracemalloc, отдельный прогон). Изменяющие сценарии выполняются в
+транзакции с откатом, так что набор можно запускать повторно на одних
+и тех же данных.
+
+Результат — JSON; compare() сравнивает его с сохранённым baseline.
+"""
+import platform
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import Profile, BlockedUser, FriendRequest
+from accounts.services import FriendshipService, BlockingService
+from posts.models import Post
+
+
+class Case:
+    """
+    Сценарий бенчмарка
+
+    Args:
+        name: Имя в отчёте
+        run: Функция без аргументов — измеряемый вызов
+        setup: Подготовка перед каждым вызовом (не измеряется)
+        writes: Выполнять каждый вызов в транзакции с откатом
+    """
+
+    def __init__(self, name, run, setup=None, writes=False):
+        self.name = name
+        self.run = run
+        self.setup = setup
+        self.writes = writes
+
+    def call(self, timed):
+        if not self.writes:
+            return timed(self.run)
+        with transaction.atomic():
+            if self.setup:
+                self.setup()
+            result = timed(self.run)
+            transaction.set_rollback(True)
+        return result
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def pick_subjects():
+    """
+    Участники сценариев: самый «дружный» пользователь, не-друг без
+    запросов и блокировок, один из его друзей и самый комментируемый пост
+    """
+    viewer_profile = Profile.objects.order_by('-friends_count', 'id').select_related('user').first()
+    if viewer_profile is None:
+        raise ValueError('Нет данных: сначала выполните generate_social_graph')
+    viewer = viewer_profile.user
+
+    friend_ids = list(viewer_profile.friends.values_list('user_id', flat=True)[:1])
+    related = set(friend_ids) | {viewer.id}
+    related.update(FriendRequest.objects.filter(from_user=viewer).values_list('to_user_id', flat=True))
+    related.update(FriendRequest.objects.filter(to_user=viewer).values_list('from_user_id', flat=True))
+    related.update(BlockedUser.objects.filter(blocker=viewer).values_list('blocked_id', flat=True))
+    related.update(BlockedUser.objects.filter(blocked=viewer).values_list('blocker_id', flat=True))
+    stranger = User.objects.exclude(id__in=related).order_by('id').first()
+
+    post = Post.objects.annotate(n=Count('comments')).order_by('-n', 'id').first()
+
+    return {
+        'viewer': viewer,
+        'friend': User.objects.get(id=friend_ids[0]) if friend_ids else None,
+        'stranger': stranger,
+        'post': post,
+    }
+
+
+def build_cases(subjects):
+    viewer = subjects['viewer']
+    friend = subjects['friend']
+    stranger = subjects['stranger']
+    post = subjects['post']
+
+    client = Client()
+    client.force_login(viewer)
+
+    def get(url, **params):
+        def run():
+            response = client.get(url, params)
+            assert response.status_code < 400, f'{url}: {response.status_code}'
+        return run
+
+    cases = [
+        Case('view:post_list', get(reverse('posts:post_list'))),
+        Case('view:profile', get(reverse('accounts:profile', args=[stranger.id if stranger else viewer.id]))),
+        Case('view:all_users', get(reverse('accounts:all_users'))),
+        Case('view:search_users', get(reverse('accounts:search_users'), q=viewer.username[:3])),
+        Case('view:friend_requests', get(reverse('accounts:friend_requests'))),
+        Case('view:unread_notifications', get(reverse('accounts:get_unread_notifications'))),
+        Case(
+            'service:get_friend_suggestions',
+            lambda: list(FriendshipService.get_friend_suggestions(viewer))
+        ),
+    ]
+
+    if post is not None:
+        cases += [
+            Case('view:post_detail', get(reverse('posts:post_detail', args=[post.id]))),
+            Case(
+                'view:post_like',
+                lambda: client.post(reverse('posts:post_like', args=[post.id])),
+                writes=True
+            ),
+        ]
+
+    if friend is not None:
+        cases += [
+            Case(
+                'service:get_mutual_friends',
+                lambda: list(FriendshipService.get_mutual_friends(viewer, friend))
+            ),
+            Case(
+                'service:remove_friend',
+                lambda: FriendshipService.remove_friend(viewer, friend.id),
+                writes=True
+            ),
+        ]
+
+    if stranger is not None:
+        cases += [
+            Case(
+                'service:send_friend_request',
+                lambda: FriendshipService.send_friend_request(viewer, stranger.id),
+                writes=True
+            ),
+            Case(
+                'service:block_user',
+                lambda: BlockingService.block_user(viewer, stranger.id),
+                writes=True
+            ),
+            Case(
+                'service:unblock_user',
+                lambda: BlockingService.unblock_user(viewer, stranger.id),
+                setup=lambda: BlockedUser.objects.create(blocker=viewer, blocked=stranger),
+                writes=True
+            ),
+        ]
+
+    return sorted(cases, key=lambda case: case.name)
+
+
+def percentile(quantiles, p):
+    return round(quantiles[p - 1] * 1000, 3)
+
+
+def measure(case, iterations, warmup):
+    durations = []
+    counter = QueryCounter()
+
+    def timed(func):
+        started = time.perf_counter()
+        func()
+        return time.perf_counter() - started
+
+    def counted(func):
+        # Запросы setup и транзакции-обёртки не учитываются
+        with connection.execute_wrapper(counter):
+            return timed(func)
+
+    for _ in range(warmup):
+        case.call(timed)
+
+    for _ in range(iterations):
+        durations.append(case.call(counted))
+
+    # Пик памяти — отдельным прогоном: tracemalloc сильно замедляет вызов
+    tracemalloc.start()
+    try:
+        case.call(timed)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    quantiles = statistics.quantiles(durations, n=100, method='inclusive')
+    return {
+        'iterations': iterations,
+        'mean_ms': round(statistics.fmean(durations) * 1000, 3),
+        'p50_ms': percentile(quantiles, 50),
+        'p95_ms': percentile(quantiles, 95),
+        'p99_ms': percentile(quantiles, 99),
+        'queries': round(counter.count / iterations, 2),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def run_suite(iterations=50, warmup=5, only=None, progress=None):
+    """
+    Выполнить набор
+
+    Args:
+        iterations: Измеряемых вызовов на сценарий (не меньше 2)
+        warmup: Прогревочных вызовов
+        only: Подстрока имени сценария для фильтра
+        progress: Функция для вывода хода выполнения
+
+    Returns:
+        dict: {'meta': {...}, 'results': {имя: метрики}}
+    """
+    results = {}
+    # Тестовый клиент ходит с Host: testserver; лимиты частоты сделали бы
+    # из повторов одного сценария замер ответа 429
+    with override_settings(ALLOWED_HOSTS=['testserver'], RATE_LIMIT={'ENABLED': False}):
+        for case in build_cases(pick_subjects()):
+            if only and only not in case.name:
+                continue
+            results[case.name] = measure(case, max(iterations, 2), warmup)
+            if progress:
+                progress(case.name, results[case.name])
+
+    return {
+        'meta': {
+            'created_at': timezone.now().isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'users': User.objects.count(),
+            'friendships': Profile.friends.through.objects.count() // 2,
+            'posts': Post.objects.count(),
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, latency_threshold=0.2, memory_threshold=0.25):
+    """
+    Регрессии относительно baseline
+
+    Время (p95) и память сравниваются с допуском; число SQL-запросов
+    детерминировано и не должно расти совсем.
+
+    Returns:
+        list: [(сценарий, метрика, было, стало)]
+    """
+    regressions = []
+    for name, result in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            continue
+        checks = (
+            ('p95_ms', latency_threshold),
+            ('peak_memory_kb', memory_threshold),
+            ('queries', 0),
+        )
+        for metric, threshold in checks:
+            if result[metric] > base[metric] * (1 + threshold):
+                regressions.append((name, metric, base[metric], result[metric]))
+    return regressions
@@ -0,0 +1,189 @@
+"""
+Условные GET-запросы (ETag) без рендеринга страницы
+
+@conditional(etag_parts) вычисляет слабый ETag из дешёвых данных —
+счётчиков версий в общем кэше, денормализованных полей закэшированных
+объектов — и при совпадении с If-None-Match отвечает 304 до вызова
+представления: без запросов к БД и рендеринга шаблона.
+
+Счётчики версий (bump/get_versions) увеличиваются обработчиками
+сигналов при каждом изменении данных сущности. Увеличение повторяется
+после фиксации транзакции: иначе параллельный запрос мог бы увидеть
+новую версию, отрендерить старые данные и закрепить их за новым ETag.
+Если счётчик вытеснен из кэша, он создаётся заново со случайным
+значением — клиент просто получит полный ответ.
+
+Для данных без счётчика (имена и аватары друзей в разделах профиля)
+max_age ограничивает, сколько секунд ETag может оставаться прежним.
+
+Счётчики должны быть общими для всех процессов: изменение в одном
+воркере, не замеченное другим, дало бы 304 на устаревшие данные. Если
+CACHE_ALIAS виден только своему процессу (instagram_clone.shared_cache),
+условные ответы отключаются.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from instagram_clone import shared_cache
+
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    # Меняется при изменении шаблонов/формата ответов
+    'VERSION': 1,
+    'TIMEOUT': 86400,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'CONDITIONAL_GET', {}).get(name, DEFAULTS[name])
+
+
+shared_cache.require(
+    'CONDITIONAL_GET', lambda: get_setting('CACHE_ALIAS') if get_setting('ENABLED') else None,
+    'условные GET (ETag, 304) отключены'
+)
+
+
+def enabled():
+    """Включены ли условные ответы (и общий ли кэш счётчиков)"""
+    return get_setting('ENABLED') and shared_cache.is_shared(get_setting('CACHE_ALIAS'))
+
+
+def _cache():
+    return caches[get_setting('CACHE_ALIAS')]
+
+
+def _key(scope, pk):
+    return f'ver:{scope}:{pk}'
+
+
+def _incr(keys):
+    cache = _cache()
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), get_setting('TIMEOUT'))
+
+
+def bump(scope, *pks, using=None):
+    """
+    Отметить изменение сущностей
+
+    Args:
+        scope: Тип сущности ('profile', 'notifications', 'post')
+        pks: Идентификаторы
+        using: БД, после фиксации транзакции которой повторить увеличение
+    """
+    keys = [_key(scope, pk) for pk in pks if pk is not None]
+    if not keys:
+        return
+    _incr(keys)
+    if transaction.get_connection(using).in_atomic_block:
+        transaction.on_commit(lambda: _incr(keys), using=using)
+
+
+def get_versions(scope, *pks):
+    """Текущие версии сущностей (кортеж в порядке pks)"""
+    cache = _cache()
+    keys = [_key(scope, pk) for pk in pks]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            initial = time.time_ns()
+            found[key] = initial if cache.add(key, initial, get_setting('TIMEOUT')) else cache.get(key)
+    return tuple(found[key] for key in keys)
+
+
+def page_parts(request):
+    """
+    Части ETag из base.html: счётчик входящих запросов в меню и
+    секрет CSRF (токен форм должен оставаться действительным)
+    """
+    # Как при рендеринге {% csrf_token %}: секрет создаётся, если его нет,
+    # и уходит в cookie вместе с ответом, на котором посчитан ETag
+    get_token(request)
+    return (
+        request.user.profile.pending_requests_count,
+        request.META['CSRF_COOKIE'],
+    )
+
+
+def make_etag(view, request, parts, max_age):
+    window = int(time.time() // max_age) if max_age else 0
+    # У as_view() безликая функция: различаем по классу
+    view = getattr(view, 'view_class', view)
+    raw = repr((get_setting('VERSION'), view.__module__, view.__qualname__,
+                request.get_full_path(), request.user.pk, parts, window))
+    return f'W/"{hashlib.sha1(raw.encode()).hexdigest()[:24]}"'
+
+
+def conditional(etag_parts, html=True, max_age=None):
+    """
+    Декоратор условного GET для представлений авторизованных
+    пользователей
+
+    Args:
+        etag_parts: Функция (request, *args, **kwargs) → данные для ETag
+            (JSON-подобные значения, без рендеринга) или None — не
+            применять. Для async-представлений вызывается в потоке
+            sync_to_async; должна обращаться только к кэшу и request.user
+        html: Страница на base.html — учитывать page_parts()
+        max_age: Не дольше скольких секунд держать прежний ETag
+    """
+    def decorator(view):
+        def precondition(request, args, kwargs):
+            if (not enabled() or request.method not in ('GET', 'HEAD')
+                    or not request.user.is_authenticated):
+                return None, None
+            # Непоказанные сообщения выводятся при рендеринге
+            storage = getattr(request, '_messages', None)
+            if html and storage is not None and len(storage):
+                return None, None
+
+            parts = etag_parts(request, *args, **kwargs)
+            if parts is None:
+                return None, None
+            if html:
+                parts = (parts, page_parts(request))
+            etag = make_etag(view, request, parts, max_age)
+            return etag, get_conditional_response(request, etag=etag)
+
+        def finish(response, etag):
+            if etag is not None and response.status_code in (200, 304):
+                response.headers.setdefault('ETag', etag)
+                # Ответ персональный: хранить только в браузере и
+                # перепроверять при каждом обращении
+                patch_cache_control(response, private=True, no_cache=True)
+                patch_vary_headers(response, ('Cookie',))
+            return response
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                # Пользователь загружается до вычисления ETag, не из event loop
+                request.user = await request.auser()
+                # Кэш версий и etag_parts синхронные: в потоке, не блокируя loop
+                etag, response = await sync_to_async(precondition)(request, args, kwargs)
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return finish(response, etag)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                etag, response = precondition(request, args, kwargs)
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                return finish(response, etag)
+        return wrapper
+    return decorator
@@ -0,0 +1,34 @@
+"""
+SQLite backend для конкурентной нагрузки
+
+Поверх стандартного django.db.backends.sqlite3:
+- PRAGMA из OPTIONS['pragmas'] выполняются для каждого нового соединения
+  (WAL, synchronous=NORMAL, busy_timeout, mmap_size);
+- OPTIONS['transaction_mode'] = 'IMMEDIATE' открывает транзакции через
+  BEGIN IMMEDIATE: блокировка записи берётся сразу и ожидается по
+  busy_timeout, вместо мгновенного "database is locked" при попытке
+  поднять блокировку чтения до записи.
+"""
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('transaction_mode', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.settings_dict['OPTIONS'].get('pragmas', {}).items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        mode = self.settings_dict['OPTIONS'].get('transaction_mode')
+        if mode:
+            self.cursor().execute(f'BEGIN {mode}')
+        else:
+            super()._start_transaction_under_autocommit()
@@ -0,0 +1,261 @@
+"""
+Пакетная загрузка связанных объектов в пределах запроса (DataLoader)
+
+Вместо «для каждого элемента загрузить связанный X» ключи собираются и
+загружаются вместе — одним запросом in_bulk на модель — а результат
+запоминается до конца запроса:
+
+    users = get_loader(User)
+    users.defer(*ids)          # поставить в пакет (из любого места кода)
+    users.get(user_id)         # загрузить все отложенные ключи разом
+
+attach(objects, 'from_user.profile') подставляет связанные объекты в
+кэш полей ForeignKey/OneToOne списка моделей, шаблоны делают то же
+фильтром без изменения представления (accounts/templatetags/loaders.py):
+
+    {% load loaders %}
+    {% for req in incoming_requests|attach:"from_user" %}
+
+Загрузчики живут в контексте запроса (LoaderMiddleware, contextvar:
+sync_to_async копирует контекст, поэтому async-представления делят их
+с ORM-кодом в потоках). Вне запроса — в management-командах и задачах —
+get_loader() возвращает новый загрузчик без общей памяти, если код не
+обёрнут в scope().
+
+Модель может зарегистрировать свою функцию загрузки (register_fetcher): так
+пользователи берутся из кэша accounts.cache, а не напрямую из БД.
+Сохранение и удаление объекта сбрасывают его из загрузчиков текущего
+запроса.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.apps import apps
+from django.db.models.signals import post_delete, post_save
+
+
+_scope = contextvars.ContextVar('loaders', default=None)
+
+# (модель, поле) → функция: список ключей → {ключ: объект}
+_fetchers = {}
+
+# Модели с подключёнными обработчиками сохранения и удаления
+_watched = set()
+
+
+def register_fetcher(model, fetch, field='pk'):
+    """Загружать объекты модели функцией fetch вместо in_bulk"""
+    _fetchers[(model, field)] = fetch
+
+
+class Loader:
+    """
+    Загрузчик объектов модели по уникальному полю
+
+    Args:
+        model: Модель
+        field: Уникальное поле ключа ('pk', 'user_id', ...)
+        fetch: Функция ключи → {ключ: объект} (по умолчанию — in_bulk)
+    """
+
+    def __init__(self, model, field='pk', fetch=None):
+        self.model = model
+        self.field = field
+        self.fetch = fetch or self.fetch_from_db
+        self.cache = {}
+        self.pending = {}
+        self.batches = 0
+
+    @property
+    def attname(self):
+        if self.field == 'pk':
+            return self.model._meta.pk.attname
+        return self.model._meta.get_field(self.field).attname
+
+    def fetch_from_db(self, keys):
+        meta = self.model._meta
+        field = meta.pk if self.field == 'pk' else meta.get_field(self.field)
+        manager = self.model._default_manager
+        if field.attname == field.name:
+            return manager.in_bulk(keys, field_name=self.field)
+        # in_bulk по внешнему ключу вернул бы ключами связанные объекты
+        return {
+            getattr(obj, field.attname): obj
+            for obj in manager.filter(**{f'{field.name}__in': keys})
+        }
+
+    def defer(self, *keys):
+        """Поставить ключи в следующий пакет"""
+        for key in keys:
+            if key is not None and key not in self.cache:
+                self.pending[key] = None
+
+    def dispatch(self):
+        """Загрузить все отложенные ключи одним вызовом fetch"""
+        if not self.pending:
+            return
+        keys = list(self.pending)
+        self.pending.clear()
+        found = self.fetch(keys)
+        self.batches += 1
+        for key in keys:
+            # None тоже запоминается: отсутствующий объект не ищется повторно
+            self.cache[key] = found.get(key)
+
+    def get_many(self, keys):
+        """{ключ: объект} для найденных; вместе с ключами загружаются отложенные"""
+        keys = [key for key in keys if key is not None]
+        self.defer(*keys)
+        self.dispatch()
+        return {key: self.cache[key] for key in keys if self.cache[key] is not None}
+
+    def get(self, key):
+        """Объект или None"""
+        return self.get_many([key]).get(key)
+
+    def prime(self, key, obj):
+        """Запомнить уже загруженный объект"""
+        self.cache[key] = obj
+        self.pending.pop(key, None)
+
+    def clear(self, *keys):
+        for key in keys:
+            self.cache.pop(key, None)
+
+
+def get_loader(model, field='pk'):
+    """
+    Загрузчик текущего запроса
+
+    Args:
+        model: Модель или 'app_label.Model'
+        field: Уникальное поле ключа
+    """
+    if isinstance(model, str):
+        model = apps.get_model(model)
+    key = (model, field)
+    watch(model)
+    loaders = _scope.get()
+    if loaders is None:
+        return Loader(model, field, _fetchers.get(key))
+    if key not in loaders:
+        loaders[key] = Loader(model, field, _fetchers.get(key))
+    return loaders[key]
+
+
+@contextmanager
+def scope():
+    """Общие загрузчики для кода внутри блока (запрос, задача, команда)"""
+    token = _scope.set({})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def forget(model, *pks):
+    """Сбросить объекты модели из загрузчиков по первичному ключу"""
+    for (loader_model, field), loader in (_scope.get() or {}).items():
+        if loader_model is model and field == 'pk':
+            loader.clear(*pks)
+
+
+def watch(model):
+    """
+    Сбрасывать объекты модели из загрузчиков при сохранении и удалении
+
+    Обработчики подключаются только к моделям с загрузчиками: обработчик
+    post_delete для всех моделей лишил бы остальные быстрого удаления
+    (QuerySet.delete() без выборки объектов).
+    """
+    if model in _watched:
+        return
+    post_save.connect(forget_instance, sender=model, weak=False)
+    post_delete.connect(forget_instance, sender=model, weak=False)
+    _watched.add(model)
+
+
+def forget_instance(sender, instance, **kwargs):
+    loaders = _scope.get()
+    if not loaders:
+        return
+    for (model, field), loader in loaders.items():
+        if model is sender:
+            loader.clear(getattr(instance, loader.attname))
+
+
+def _attach_level(objects, name):
+    """Подставить поле name всем объектам; вернуть связанные объекты"""
+    objects = [obj for obj in objects if obj is not None]
+    if not objects:
+        return []
+    field = objects[0]._meta.get_field(name)
+
+    if field.concrete and (field.many_to_one or field.one_to_one):
+        # Прямой ForeignKey/OneToOneField
+        target = field.target_field
+        loader = get_loader(field.related_model, 'pk' if target.primary_key else target.name)
+        key_attname = field.attname
+        remote = None
+    elif field.one_to_one:
+        # Обратная сторона OneToOneField (user.profile)
+        remote = field.field
+        loader = get_loader(field.related_model, remote.attname)
+        key_attname = remote.target_field.attname
+    else:
+        raise ValueError(f'attach поддерживает только ForeignKey и OneToOne: {name}')
+
+    missing = [obj for obj in objects if not field.is_cached(obj)]
+    found = loader.get_many(getattr(obj, key_attname) for obj in missing)
+
+    related = [field.get_cached_value(obj) for obj in objects if field.is_cached(obj)]
+    for obj in missing:
+        value = found.get(getattr(obj, key_attname))
+        if value is None:
+            continue
+        field.set_cached_value(obj, value)
+        if remote is not None:
+            remote.set_cached_value(value, obj)
+        related.append(value)
+    return related
+
+
+def attach(objects, path):
+    """
+    Загрузить связанные объекты пакетно: по одному вызову загрузчика
+    на уровень пути
+
+    Args:
+        objects: Список (или QuerySet) моделей одного типа
+        path: Путь через точку ('related_user', 'from_user.profile')
+
+    Returns:
+        list: objects списком
+    """
+    objects = list(objects)
+    level = objects
+    for name in path.split('.'):
+        level = _attach_level(level, name)
+    return objects
+
+
+class LoaderMiddleware:
+    """Загрузчики на время запроса"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with scope():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with scope():
+            return await self.get_response(request)
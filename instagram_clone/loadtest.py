@@ -0,0 +1,423 @@
+"""
+Нагрузочное воспроизведение запросов
+
+Поток запросов — словари
+    {"method": "GET", "path": "/accounts/users/", "user_id": 12, "data": {}}
+из JSONL-файла (его пишет RequestRecorderMiddleware), из синтетической
+смеси трафика или из сценария (SCENARIOS). Запросы выполняются
+CONCURRENCY потоками:
+- 'wsgi' — в процессе через тестовый клиент Django;
+- 'asgi' — в процессе через ASGIHandler (как под uvicorn/daphne);
+- 'http' — на запущенный сервер (runserver, gunicorn) по base_url.
+
+Пользователь запроса авторизуется заранее созданной сессией, так что
+вход не попадает в замеры. Отчёт — пропускная способность, доля ошибок
+и перцентили времени по маршрутам (имя URL).
+"""
+import asyncio
+import itertools
+import json
+import random
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.db import connections
+from django.core.handlers.asgi import ASGIHandler
+from django.test import Client
+from django.urls import Resolver404, resolve, reverse
+from django.utils.crypto import get_random_string
+
+from accounts.models import FriendRequest
+from posts.models import Post
+
+
+DEFAULTS = {
+    'RECORD_FILE': None,
+}
+
+# Поля форм, которые не попадают в запись
+SKIP_FIELDS = ('csrfmiddlewaretoken', 'password', 'password1', 'password2')
+
+AJAX = {'X-Requested-With': 'XMLHttpRequest'}
+
+
+def get_setting(name):
+    return getattr(settings, 'LOADTEST', {}).get(name, DEFAULTS[name])
+
+
+class RequestRecorderMiddleware:
+    """Пишет запросы в LOADTEST['RECORD_FILE'] (JSONL) для воспроизведения"""
+
+    sync_capable = True
+    async_capable = True
+    _lock = threading.Lock()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        path = get_setting('RECORD_FILE')
+        if path:
+            self.record(path, request)
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        path = get_setting('RECORD_FILE')
+        if path:
+            await sync_to_async(self.record)(path, request)
+        return response
+
+    def record(self, path, request):
+        user = getattr(request, 'user', None)
+        record = {
+            'ts': time.time(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'user_id': user.pk if user is not None and user.is_authenticated else None,
+            'data': {
+                key: value for key, value in request.POST.items()
+                if key not in SKIP_FIELDS
+            },
+        }
+        with self._lock, open(path, 'a') as fh:
+            fh.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def read_jsonl(path):
+    with open(path) as fh:
+        for line in fh:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+
+
+# ----- синтетический трафик и сценарии -----
+
+def synthetic_mix(total, seed=0):
+    """
+    Типичная смесь: лента и профили чаще всего, лайки и поиск реже
+    """
+    rng = random.Random(seed)
+    user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+    post_ids = list(Post.objects.order_by('id').values_list('id', flat=True))
+    if not user_ids:
+        raise ValueError('Нет пользователей: сначала выполните generate_social_graph')
+
+    def post_id():
+        return rng.choice(post_ids) if post_ids else 0
+
+    routes = [
+        (30, lambda: ('GET', reverse('posts:post_list'), {})),
+        (20, lambda: ('GET', reverse('posts:post_detail', args=[post_id()]), {})),
+        (20, lambda: ('GET', reverse('accounts:profile', args=[rng.choice(user_ids)]), {})),
+        (10, lambda: ('GET', reverse('accounts:get_unread_notifications'), {})),
+        (5, lambda: ('GET', reverse('accounts:friend_requests'), {})),
+        (5, lambda: ('GET', reverse('accounts:all_users'), {})),
+        (5, lambda: ('GET', reverse('accounts:search_users') + '?q=gen1', {})),
+        (5, lambda: ('POST', reverse('posts:post_like', args=[post_id()]), {})),
+    ]
+    weights = [weight for weight, _ in routes]
+    for make in rng.choices([make for _, make in routes], weights=weights, k=total):
+        method, path, data = make()
+        yield {'method': method, 'path': path, 'user_id': rng.choice(user_ids), 'data': data}
+
+
+def like_storm(total, seed=0):
+    """Вирусный пост: все лайкают одну и ту же запись"""
+    rng = random.Random(seed)
+    post = Post.objects.order_by('-likes', 'id').first()
+    if post is None:
+        raise ValueError('Нет постов')
+    user_ids = list(User.objects.values_list('id', flat=True)[:10000])
+    path = reverse('posts:post_like', args=[post.id])
+    for _ in range(total):
+        yield {'method': 'POST', 'path': path, 'user_id': rng.choice(user_ids), 'headers': AJAX}
+
+
+def celebrity_accepts(total, seed=0):
+    """
+    Знаменитость принимает total входящих запросов подряд
+
+    Подготовка создаёт недостающие входящие запросы (изменяет данные:
+    запускайте на тестовой базе).
+    """
+    celebrity = User.objects.order_by('-profile__friends_count', 'id').first()
+    if celebrity is None:
+        raise ValueError('Нет пользователей')
+    friend_ids = celebrity.profile.friends.values_list('user_id', flat=True)
+    requested = FriendRequest.objects.filter(to_user=celebrity).values_list('from_user_id', flat=True)
+    candidates = (
+        User.objects.exclude(id=celebrity.id)
+        .exclude(id__in=friend_ids).exclude(id__in=requested)
+        .order_by('id').values_list('id', flat=True)
+    )
+    FriendRequest.objects.bulk_create(
+        [FriendRequest(from_user_id=user_id, to_user=celebrity) for user_id in candidates[:total]],
+        ignore_conflicts=True
+    )
+    # Запросы от уже друзей (бывают в синтетических данных) accept отклонит
+    pending = (
+        FriendRequest.objects.filter(to_user=celebrity, status='pending')
+        .exclude(from_user_id__in=friend_ids).order_by('id')[:total]
+    )
+    for request_id in pending.values_list('id', flat=True):
+        yield {
+            'method': 'POST',
+            'path': reverse('accounts:accept_friend_request', args=[request_id]),
+            'user_id': celebrity.id,
+            'headers': AJAX,
+        }
+
+
+SCENARIOS = {
+    'mix': synthetic_mix,
+    'like_storm': like_storm,
+    'celebrity_accepts': celebrity_accepts,
+}
+
+
+# ----- выполнение -----
+
+def make_sessions(user_ids):
+    """Сессии пользователей без входа через форму: {user_id: session_key}"""
+    engine = import_module(settings.SESSION_ENGINE)
+    backend = settings.AUTHENTICATION_BACKENDS[0]
+    sessions = {}
+    for user in User.objects.filter(id__in=set(user_ids)):
+        store = engine.SessionStore()
+        store[SESSION_KEY] = user._meta.pk.value_to_string(user)
+        store[BACKEND_SESSION_KEY] = backend
+        store[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        store.save()
+        sessions[user.id] = store.session_key
+    return sessions
+
+
+def route_name(path):
+    try:
+        return resolve(urllib.parse.urlsplit(path).path).view_name
+    except Resolver404:
+        return '<unresolved>'
+
+
+class Result:
+
+    def __init__(self, route, status, duration, error=None):
+        self.route = route
+        self.status = status
+        self.duration = duration
+        self.error = error
+
+    @property
+    def failed(self):
+        return self.error is not None or self.status >= 400
+
+
+class LoadRunner:
+    """
+    Args:
+        target: 'wsgi', 'asgi' или 'http'
+        concurrency: Число одновременных запросов
+        base_url: Адрес сервера для target='http'
+    """
+
+    def __init__(self, target='wsgi', concurrency=10, base_url='http://127.0.0.1:8000'):
+        self.target = target
+        self.concurrency = concurrency
+        self.base_url = base_url.rstrip('/')
+        self.csrf_token = get_random_string(32)
+        self._local = threading.local()
+
+    def run(self, requests):
+        requests = list(requests)
+        self.sessions = make_sessions(r['user_id'] for r in requests if r.get('user_id'))
+
+        started = time.perf_counter()
+        if self.target == 'asgi':
+            results = asyncio.run(self._run_async(requests))
+        else:
+            with ThreadPoolExecutor(self.concurrency, initializer=self._init_worker) as pool:
+                results = list(pool.map(self._execute, requests))
+                # Закрыть подключения к БД в каждом потоке пула: барьер
+                # не даёт одному потоку взять две задачи
+                barrier = threading.Barrier(self.concurrency)
+                list(pool.map(lambda _: (barrier.wait(), connections.close_all()), range(self.concurrency)))
+        elapsed = time.perf_counter() - started
+        return summarize(results, elapsed)
+
+    def _init_worker(self):
+        self._local.client = Client(raise_request_exception=False)
+
+    def _cookies(self, spec):
+        session = self.sessions.get(spec.get('user_id'))
+        cookies = {settings.CSRF_COOKIE_NAME: self.csrf_token}
+        if session:
+            cookies[settings.SESSION_COOKIE_NAME] = session
+        return cookies
+
+    def _execute(self, spec):
+        route = spec.get('route') or route_name(spec['path'])
+        method = spec.get('method', 'GET').upper()
+        started = time.perf_counter()
+        try:
+            if self.target == 'http':
+                status = self._http(method, spec)
+            else:
+                client = self._local.client
+                client.cookies.clear()
+                for name, value in self._cookies(spec).items():
+                    client.cookies[name] = value
+                handler = client.post if method == 'POST' else client.get
+                status = handler(spec['path'], spec.get('data') or {}, headers=spec.get('headers')).status_code
+        except Exception as e:
+            return Result(route, 0, time.perf_counter() - started, repr(e))
+        return Result(route, status, time.perf_counter() - started)
+
+    def _http(self, method, spec):
+        cookies = '; '.join(f'{k}={v}' for k, v in self._cookies(spec).items())
+        headers = {'Cookie': cookies, 'X-CSRFToken': self.csrf_token, **(spec.get('headers') or {})}
+        body = None
+        url = self.base_url + spec['path']
+        if method == 'POST':
+            body = urllib.parse.urlencode(spec.get('data') or {}).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif spec.get('data'):
+            url += ('&' if '?' in url else '?') + urllib.parse.urlencode(spec['data'])
+
+        request = urllib.request.Request(url, data=body, headers=headers, method=method)
+        try:
+            with _NoRedirect.open(request, timeout=30) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    async def _run_async(self, requests):
+        # Настоящий ASGIHandler, а не AsyncClient: только он даёт каждому
+        # запросу свой поток для sync_to_async (ThreadSensitiveContext)
+        application = ASGIHandler()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def execute(spec):
+            async with semaphore:
+                route = spec.get('route') or route_name(spec['path'])
+                started = time.perf_counter()
+                try:
+                    status = await self._asgi(application, spec)
+                except Exception as e:
+                    return Result(route, 0, time.perf_counter() - started, repr(e))
+                return Result(route, status, time.perf_counter() - started)
+
+        return await asyncio.gather(*(execute(spec) for spec in requests))
+
+    async def _asgi(self, application, spec):
+        method = spec.get('method', 'GET').upper()
+        url = urllib.parse.urlsplit(spec['path'])
+        query = url.query
+        body = b''
+        headers = [
+            (b'host', b'testserver'),
+            (b'cookie', '; '.join(f'{k}={v}' for k, v in self._cookies(spec).items()).encode()),
+            (b'x-csrftoken', self.csrf_token.encode()),
+        ]
+        headers += [(k.lower().encode(), v.encode()) for k, v in (spec.get('headers') or {}).items()]
+        if method == 'POST':
+            body = urllib.parse.urlencode(spec.get('data') or {}).encode()
+            headers.append((b'content-type', b'application/x-www-form-urlencoded'))
+        elif spec.get('data'):
+            query = '&'.join(filter(None, [query, urllib.parse.urlencode(spec['data'])]))
+
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': url.path,
+            'raw_path': url.path.encode(),
+            'query_string': query.encode(),
+            'root_path': '',
+            'headers': headers,
+            'client': ('127.0.0.1', 0),
+            'server': ('testserver', 80),
+        }
+        messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+        status = []
+
+        async def receive():
+            if messages:
+                return messages.pop()
+            # Клиент ждёт ответ: «отключения» не будет
+            await asyncio.Future()
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+
+        await application(scope, receive, send)
+        return status[0]
+
+
+class _NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Редирект — ответ маршрута, а не новый запрос"""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_NoRedirect = urllib.request.build_opener(_NoRedirectHandler)
+
+
+def latency_summary(durations):
+    if len(durations) < 2:
+        value = round(durations[0] * 1000, 2) if durations else 0.0
+        return {'p50_ms': value, 'p95_ms': value, 'p99_ms': value, 'max_ms': value}
+    q = statistics.quantiles(durations, n=100, method='inclusive')
+    return {
+        'p50_ms': round(q[49] * 1000, 2),
+        'p95_ms': round(q[94] * 1000, 2),
+        'p99_ms': round(q[98] * 1000, 2),
+        'max_ms': round(max(durations) * 1000, 2),
+    }
+
+
+def summarize(results, elapsed):
+    routes = {}
+    for route, group in itertools.groupby(sorted(results, key=lambda r: r.route), key=lambda r: r.route):
+        group = list(group)
+        errors = [r for r in group if r.failed]
+        routes[route] = {
+            'requests': len(group),
+            'errors': len(errors),
+            'error_rate': round(len(errors) / len(group), 4),
+            'statuses': dict(sorted(Counter(str(r.status) for r in group).items())),
+            'sample_error': next((r.error for r in errors if r.error), None),
+            **latency_summary([r.duration for r in group]),
+        }
+
+    failed = sum(1 for r in results if r.failed)
+    return {
+        'requests': len(results),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(results) / elapsed, 1) if elapsed else 0.0,
+        'error_rate': round(failed / len(results), 4) if results else 0.0,
+        **latency_summary([r.duration for r in results]),
+        'routes': routes,
+    }
@@ -0,0 +1,231 @@
+"""
+Раздача загруженных файлов (MEDIA_ROOT) в продакшене
+
+serve_media проверяет доступ и условные заголовки, а сам файл отдаёт
+одним из способов (settings.MEDIA_SERVING['MODE']):
+
+- 'stream' — FileResponse. Под WSGI-сервером с wsgi.file_wrapper
+  (gunicorn, uWSGI) файл уходит через sendfile без копирования в
+  Python, в том числе для диапазонов: дескриптор уже спозиционирован,
+  длину ограничивает Content-Length;
+- 'x-accel' — заголовок X-Accel-Redirect: файл (и Range) отдаёт nginx
+  из internal-локации ACCEL_PREFIX;
+- 'x-sendfile' — заголовок X-Sendfile с абсолютным путём (Apache
+  mod_xsendfile, lighttpd).
+
+Поддерживаются ETag/Last-Modified (304), Range с одним диапазоном (206,
+416) и If-Range. Имена загрузок уникальны (storage добавляет суффикс),
+поэтому файлы кэшируются как immutable.
+
+Изображения постов (PROTECTED) доступны всем, только если профиль
+автора открыт; иначе — автору, его друзьям и персоналу. Такие ответы
+кэшируются только в браузере (private) и перепроверяются при каждом
+обращении (no-cache, обычно 304): доступ может быть отозван.
+"""
+import mimetypes
+import os
+import posixpath
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse, HttpResponse, HttpResponseForbidden, HttpResponseNotAllowed,
+    HttpResponseNotFound,
+)
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+
+DEFAULTS = {
+    # 'stream', 'x-accel' или 'x-sendfile'
+    'MODE': 'stream',
+    # Internal-локация nginx с alias на MEDIA_ROOT
+    'ACCEL_PREFIX': '/protected-media/',
+    'MAX_AGE': 365 * 86400,
+    'BLOCK_SIZE': 64 * 1024,
+}
+
+# Префикс пути → (модель, файловое поле, поле владельца)
+PROTECTED = {
+    'post_images/': ('posts.Post', 'image', 'author_id'),
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'MEDIA_SERVING', {}).get(name, DEFAULTS[name])
+
+
+def owner_of(name):
+    """
+    (id владельца, защищён ли путь); владелец None — файл ни к чему
+    не привязан
+    """
+    for prefix, (label, field, owner_field) in PROTECTED.items():
+        if name.startswith(prefix):
+            model = apps.get_model(label)
+            owner_id = model._default_manager.filter(**{field: name}).values_list(
+                owner_field, flat=True
+            ).first()
+            return owner_id, True
+    return None, False
+
+
+def can_view(user, owner_id):
+    """Доступ к файлам профиля: открытый профиль, владелец, друг или персонал"""
+    from accounts.cache import get_user
+    from accounts.models import Profile
+
+    owner = get_user(owner_id)
+    if owner is None:
+        return False
+    if not owner.profile.is_private:
+        return True
+    if not user.is_authenticated:
+        return False
+    if user.pk == owner_id or user.is_staff:
+        return True
+    return Profile.friends.through.objects.filter(
+        from_profile__user_id=user.pk, to_profile__user_id=owner_id
+    ).exists()
+
+
+def parse_range(header, size):
+    """
+    Диапазон из заголовка Range
+
+    Returns:
+        (start, end) включительно или None — отдать файл целиком
+        (нет заголовка, несколько диапазонов, неизвестные единицы)
+
+    Raises:
+        ValueError: Диапазон за пределами файла (416)
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, sep, end = header[6:].strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if start:
+            start = int(start)
+            end = min(int(end), size - 1) if end else size - 1
+        elif end:
+            # Последние N байт
+            start = max(size - int(end), 0)
+            end = size - 1
+        else:
+            return None
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+class RangeFile:
+    """
+    Файл, ограниченный диапазоном: read() не выходит за end, fileno()
+    позволяет серверу отдать диапазон через sendfile
+    """
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def offload(mode, name, path, content_type):
+    response = HttpResponse(content_type=content_type)
+    if mode == 'x-accel':
+        response['X-Accel-Redirect'] = get_setting('ACCEL_PREFIX') + name
+    else:
+        response['X-Sendfile'] = path
+    return response
+
+
+def stream(request, path, size, content_type, etag):
+    """FileResponse целиком или диапазоном (206/416)"""
+    if_range = request.headers.get('If-Range')
+    header = request.headers.get('Range') if if_range in (None, etag) else None
+    try:
+        byte_range = parse_range(header, size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    file = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = FileResponse(RangeFile(file, start, length), status=206, content_type=content_type)
+        response['Content-Length'] = length
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response.block_size = get_setting('BLOCK_SIZE')
+    return response
+
+
+def serve_media(request, path):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+
+    name = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, name)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        return HttpResponseNotFound()
+    if not os.path.isfile(full_path):
+        return HttpResponseNotFound()
+
+    owner_id, protected = owner_of(name)
+    if protected:
+        if owner_id is None:
+            return HttpResponseNotFound()
+        if not can_view(request.user, owner_id):
+            return HttpResponseForbidden()
+
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+
+    if response is None:
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        mode = get_setting('MODE')
+        if mode in ('x-accel', 'x-sendfile'):
+            response = offload(mode, name, full_path, content_type)
+        else:
+            response = stream(request, full_path, stat.st_size, content_type, etag)
+
+    response['Accept-Ranges'] = 'bytes'
+    if response.status_code not in (200, 206, 304):
+        return response
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if protected:
+        # Доступ зависит от пользователя и может быть отозван
+        # (профиль закрыт, дружба удалена): без immutable и max_age
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ('Cookie',))
+    else:
+        patch_cache_control(response, public=True, max_age=get_setting('MAX_AGE'), immutable=True)
+    return response
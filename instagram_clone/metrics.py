@@ -0,0 +1,352 @@
+"""
+Метрики в текстовом формате Prometheus
+
+Счётчики и гистограммы хранятся в памяти процесса (запись — словарь
+под блокировкой, без I/O). Для prefork-серверов (несколько процессов)
+задайте METRICS['MULTIPROCESS_DIR']: каждый процесс не чаще раза в
+FLUSH_INTERVAL секунд сохраняет снимок в <dir>/<pid>.json, а /metrics
+суммирует снимки всех процессов.
+
+/metrics доступен персоналу и по токену METRICS['TOKEN']
+(Authorization: Bearer <токен>, bearer_token в конфиге Prometheus).
+Адрес клиента доступа не даёт: за обратным прокси на той же машине
+все запросы приходят с 127.0.0.1. ALLOWED_IPS лишь дополнительно
+ограничивает, откуда принимается токен.
+"""
+import atexit
+import bisect
+import ipaddress
+import json
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from django.template.backends.django import DjangoTemplates, Template
+
+
+DEFAULTS = {
+    'ENABLED': True,
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_INTERVAL': 5,
+    # Токен для Prometheus; без него /metrics доступен только персоналу
+    'TOKEN': None,
+    # Пусто — токен принимается с любого адреса
+    'ALLOWED_IPS': [],
+}
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def get_setting(name):
+    return getattr(settings, 'METRICS', {}).get(name, DEFAULTS[name])
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dump(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def samples(self, values):
+        for key, value in values:
+            yield self.name + '_total', dict(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [счётчики по корзинам (+Inf последняя), сумма, количество]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def dump(self):
+        with self._lock:
+            return [[list(key), [list(s[0]), s[1], s[2]]] for key, s in self._values.items()]
+
+    @staticmethod
+    def merge(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def samples(self, values):
+        bounds = [*(repr(b) for b in self.buckets), '+Inf']
+        for key, (buckets, total, count) in values:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, n in zip(bounds, buckets):
+                cumulative += n
+                yield self.name + '_bucket', {**labels, 'le': bound}, cumulative
+            yield self.name + '_sum', labels, total
+            yield self.name + '_count', labels, count
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._last_flush = 0.0
+
+    def register(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def collector(self, func):
+        """
+        Функция, вызываемая при снимке: возвращает
+        [(имя счётчика, описание, имя метки, {значение метки: число})]
+        """
+        self._collectors.append(func)
+        return func
+
+    def snapshot(self):
+        data = {name: metric.dump() for name, metric in self._metrics.items()}
+        collected = {}
+        for func in self._collectors:
+            for name, documentation, label, values in func():
+                collected[name] = {
+                    'help': documentation,
+                    'label': label,
+                    'values': [[[k], v] for k, v in values.items()],
+                }
+        return {'metrics': data, 'collected': collected}
+
+    # ----- несколько процессов -----
+
+    def _path(self, directory, pid=None):
+        return os.path.join(directory, f'{pid or os.getpid()}.json')
+
+    def maybe_flush(self):
+        directory = get_setting('MULTIPROCESS_DIR')
+        if not directory:
+            return
+        now = time.monotonic()
+        if now - self._last_flush < get_setting('FLUSH_INTERVAL'):
+            return
+        self._last_flush = now
+        self.flush(directory)
+
+    def flush(self, directory=None):
+        directory = directory or get_setting('MULTIPROCESS_DIR')
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = self._path(directory)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump(self.snapshot(), fh)
+        os.replace(tmp, path)
+
+    def gather(self):
+        """Снимки всех процессов (текущий — живой, остальные — из файлов)"""
+        snapshots = [self.snapshot()]
+        directory = get_setting('MULTIPROCESS_DIR')
+        if directory and os.path.isdir(directory):
+            own = os.path.basename(self._path(directory))
+            for filename in os.listdir(directory):
+                if not filename.endswith('.json') or filename == own:
+                    continue
+                try:
+                    with open(os.path.join(directory, filename)) as fh:
+                        snapshots.append(json.load(fh))
+                except (OSError, ValueError):
+                    continue
+        return snapshots
+
+    def render(self):
+        snapshots = self.gather()
+        lines = []
+
+        for name, metric in self._metrics.items():
+            merged = {}
+            for snapshot in snapshots:
+                for key, value in snapshot['metrics'].get(name, []):
+                    key = tuple(key)
+                    merged[key] = metric.merge(merged[key], value) if key in merged else value
+
+            lines.append(f'# HELP {name} {metric.documentation}')
+            lines.append(f'# TYPE {name} {metric.type}')
+            for sample, labels, value in metric.samples(sorted(merged.items())):
+                lines.append(f'{sample}{format_labels(labels)} {value}')
+
+        names = {}
+        for snapshot in snapshots:
+            for name, item in snapshot['collected'].items():
+                entry = names.setdefault(name, {'help': item['help'], 'label': item['label'], 'values': {}})
+                for (key,), value in item['values']:
+                    entry['values'][key] = entry['values'].get(key, 0) + value
+
+        for name, entry in names.items():
+            lines.append(f'# HELP {name} {entry["help"]}')
+            lines.append(f'# TYPE {name} counter')
+            for key, value in sorted(entry['values'].items()):
+                lines.append(f'{name}_total{format_labels({entry["label"]: key})} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        '{}="{}"'.format(k, str(v).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for k, v in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+request_latency = registry.histogram(
+    'http_request_duration_seconds', 'Время обработки запроса', ('view', 'method')
+)
+requests_total = registry.counter(
+    'http_requests', 'Число запросов', ('view', 'method', 'status')
+)
+db_queries = registry.counter(
+    'db_queries', 'Число SQL-запросов', ('view',)
+)
+db_query_seconds = registry.counter(
+    'db_query_seconds', 'Суммарное время SQL-запросов', ('view',)
+)
+template_render = registry.histogram(
+    'template_render_seconds', 'Время рендеринга шаблонов', ('template',)
+)
+events = registry.counter(
+    'app_events', 'Доменные события (запросы в друзья, лайки, уведомления)', ('event',)
+)
+
+
+class MetricsMiddleware:
+    """Должен стоять первым, чтобы учитывать всё время обработки"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not get_setting('ENABLED'):
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not get_setting('ENABLED'):
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, elapsed):
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        request_latency.observe(elapsed, view=view, method=request.method)
+        requests_total.inc(view=view, method=request.method, status=str(response.status_code))
+
+        queries = getattr(request, 'query_stats', None)
+        if queries is not None:
+            db_queries.inc(queries.count, view=view)
+            db_query_seconds.inc(queries.duration, view=view)
+
+        registry.maybe_flush()
+
+
+class InstrumentedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            template_render.observe(
+                time.perf_counter() - started,
+                template=self.origin.template_name or '<string>'
+            )
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """DjangoTemplates с замером времени рендеринга каждого шаблона"""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return InstrumentedTemplate(template.template, self)
+
+
+def client_allowed(request):
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+    token = get_setting('TOKEN')
+    scheme, _, value = request.headers.get('Authorization', '').partition(' ')
+    if not token or scheme.lower() != 'bearer' or not constant_time_compare(value, token):
+        return False
+    networks = get_setting('ALLOWED_IPS')
+    if not networks:
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in networks)
+
+
+def metrics_view(request):
+    """Внутренний эндпоинт для Prometheus"""
+    if not client_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
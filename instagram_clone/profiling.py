@@ -0,0 +1,299 @@
+"""
+Профилирование отдельных запросов в продакшене
+
+Запрос профилируется, если:
+- в заголовке X-Profile-Token передан подписанный токен (make_token(),
+  manage.py profiling_token <username>), действующий TOKEN_MAX_AGE
+  секунд. Токен выпускается для сотрудника и действует только в его
+  сессии: попавший к другому токен профиль не сохраняет;
+- или он попал в случайную выборку SAMPLE_RATE.
+
+Режимы (MODE):
+- 'cprofile' — детерминированный cProfile, результат в .prof (pstats,
+  snakeviz, flameprof);
+- 'sampler' — фоновый поток снимает стек обрабатывающего потока каждые
+  SAMPLE_INTERVAL секунд; результат в .folded (формат flamegraph.pl /
+  speedscope), накладные расходы заметно ниже.
+
+Рядом сохраняется .json с метаданными запроса; список доступен
+персоналу на /_profiles/.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core import signing
+from django.http import FileResponse, Http404, HttpResponse
+from django.shortcuts import render
+from django.utils import timezone
+
+
+DEFAULTS = {
+    'ENABLED': True,
+    'DIR': None,
+    'MODE': 'cprofile',
+    'SAMPLE_RATE': 0.0,
+    'SAMPLE_INTERVAL': 0.001,
+    'TOKEN_MAX_AGE': 3600,
+    'MAX_PROFILES': 200,
+}
+
+HEADER = 'HTTP_X_PROFILE_TOKEN'
+SALT = 'instagram_clone.profiling'
+
+
+def get_setting(name):
+    return getattr(settings, 'PROFILING', {}).get(name, DEFAULTS[name])
+
+
+def profiles_dir():
+    return str(get_setting('DIR') or os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+def make_token(user):
+    """Подписанный токен для заголовка X-Profile-Token, привязанный к user"""
+    return signing.TimestampSigner(salt=SALT).sign(str(user.pk))
+
+
+def token_owner(token):
+    """id сотрудника, для которого выпущен токен, или None"""
+    try:
+        value = signing.TimestampSigner(salt=SALT).unsign(token, max_age=get_setting('TOKEN_MAX_AGE'))
+    except signing.BadSignature:
+        return None
+    return int(value) if value.isdigit() else None
+
+
+def owner_matches(request, owner):
+    """Запрос пришёл в сессии сотрудника, которому выдан токен"""
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_authenticated and user.is_staff and user.pk == owner
+
+
+class StackSampler:
+    """Сэмплирующий профайлер одного потока (folded stacks)"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def start_profiler(mode):
+    if mode == 'sampler':
+        profiler = StackSampler(threading.get_ident(), get_setting('SAMPLE_INTERVAL'))
+        profiler.start()
+    else:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    return profiler
+
+
+def stop_profiler(profiler):
+    if isinstance(profiler, StackSampler):
+        profiler.stop()
+    else:
+        profiler.disable()
+
+
+class ProfilingMiddleware:
+    """
+    В ASGI профилируется поток event loop: синхронный код, вынесенный
+    в sync_to_async (ORM), в профиль не попадает
+
+    Middleware стоит снаружи AuthenticationMiddleware, поэтому владелец
+    токена сверяется с request.user после ответа: чужой профиль
+    отбрасывается, не сохраняясь.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def should_profile(self, request):
+        """
+        Returns:
+            tuple: (профилировать ли, id владельца токена или None)
+        """
+        if not get_setting('ENABLED'):
+            return False, None
+        token = request.META.get(HEADER)
+        if token:
+            owner = token_owner(token)
+            return owner is not None, owner
+        rate = get_setting('SAMPLE_RATE')
+        return rate > 0 and random.random() < rate, None
+
+    def finish(self, request, response, profiler, mode, duration, owner):
+        if owner is None or owner_matches(request, owner):
+            save_profile(request, response, profiler, mode, duration)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile, owner = self.should_profile(request)
+        if not profile:
+            return self.get_response(request)
+
+        mode = get_setting('MODE')
+        started = time.perf_counter()
+        profiler = start_profiler(mode)
+        try:
+            response = self.get_response(request)
+        finally:
+            stop_profiler(profiler)
+
+        self.finish(request, response, profiler, mode, time.perf_counter() - started, owner)
+        return response
+
+    async def __acall__(self, request):
+        profile, owner = self.should_profile(request)
+        if not profile:
+            return await self.get_response(request)
+
+        mode = get_setting('MODE')
+        started = time.perf_counter()
+        profiler = start_profiler(mode)
+        try:
+            response = await self.get_response(request)
+        finally:
+            stop_profiler(profiler)
+
+        await sync_to_async(self.finish)(request, response, profiler, mode, time.perf_counter() - started, owner)
+        return response
+
+
+def save_profile(request, response, profiler, mode, duration):
+    directory = profiles_dir()
+    os.makedirs(directory, exist_ok=True)
+
+    profile_id = f"{timezone.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+    if mode == 'sampler':
+        filename = f'{profile_id}.folded'
+        with open(os.path.join(directory, filename), 'w') as fh:
+            fh.write(profiler.folded())
+    else:
+        filename = f'{profile_id}.prof'
+        profiler.dump_stats(os.path.join(directory, filename))
+
+    match = request.resolver_match
+    user = getattr(request, 'user', None)
+    queries = getattr(request, 'query_stats', None)
+    meta = {
+        'id': profile_id,
+        'file': filename,
+        'mode': mode,
+        'created_at': timezone.now().isoformat(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'view': match.view_name if match else None,
+        'user_id': user.pk if user is not None and user.is_authenticated else None,
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 2),
+        'queries': queries.count if queries is not None else None,
+    }
+    with open(os.path.join(directory, f'{profile_id}.json'), 'w') as fh:
+        json.dump(meta, fh)
+
+    prune(directory)
+    return meta
+
+
+def list_profiles(directory=None):
+    directory = directory or profiles_dir()
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for filename in os.listdir(directory):
+        if filename.endswith('.json'):
+            try:
+                with open(os.path.join(directory, filename)) as fh:
+                    profiles.append(json.load(fh))
+            except (OSError, ValueError):
+                continue
+    return sorted(profiles, key=lambda meta: meta['id'], reverse=True)
+
+
+def prune(directory):
+    """Хранить не больше MAX_PROFILES последних профилей"""
+    for meta in list_profiles(directory)[get_setting('MAX_PROFILES'):]:
+        for filename in (meta['file'], f"{meta['id']}.json"):
+            try:
+                os.remove(os.path.join(directory, filename))
+            except OSError:
+                pass
+
+
+def get_profile_meta(profile_id):
+    for meta in list_profiles():
+        if meta['id'] == profile_id:
+            return meta
+    raise Http404('Профиль не найден')
+
+
+@staff_member_required
+def profile_index(request):
+    return render(request, 'profiling/index.html', {'profiles': list_profiles()})
+
+
+@staff_member_required
+def profile_detail(request, profile_id):
+    """Топ функций (.prof) или сами folded stacks"""
+    meta = get_profile_meta(profile_id)
+    path = os.path.join(profiles_dir(), meta['file'])
+
+    if meta['mode'] == 'sampler':
+        with open(path) as fh:
+            return HttpResponse(fh.read(), content_type='text/plain; charset=utf-8')
+
+    sort = request.GET.get('sort', 'cumulative')
+    if sort not in ('cumulative', 'tottime', 'calls'):
+        sort = 'cumulative'
+    out = io.StringIO()
+    pstats.Stats(path, stream=out).sort_stats(sort).print_stats(60)
+    return HttpResponse(out.getvalue(), content_type='text/plain; charset=utf-8')
+
+
+@staff_member_required
+def profile_download(request, profile_id):
+    meta = get_profile_meta(profile_id)
+    path = os.path.join(profiles_dir(), meta['file'])
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=meta['file'])
@@ -0,0 +1,240 @@
+"""
+Учёт SQL-запросов по представлениям и поиск N+1
+
+QueryInspectorMiddleware для каждого запроса считает число SQL-запросов,
+суммарное время и повторяющиеся шаблоны запросов (fingerprint).
+Итоги копятся по имени URL (resolver_match.view_name).
+
+- Шаблон, выполненный больше REPEAT_THRESHOLD раз за запрос, — вероятный
+  N+1: пишется предупреждение в лог.
+- Превышение бюджета представления (@query_budget или BUDGETS в
+  настройках) пишется в лог, а при RAISE=True (тесты) — исключение.
+
+Обёртка выполнения запросов стоит на каждом подключении постоянно и
+пишет в RequestQueries текущего контекста (contextvar): так учитываются
+и запросы async-представлений, которые ORM выполняет в других потоках
+(sync_to_async копирует контекст).
+"""
+import contextvars
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+logger = logging.getLogger('instagram_clone.queries')
+
+DEFAULTS = {
+    'ENABLED': True,
+    'REPEAT_THRESHOLD': 5,
+    'RAISE': False,
+    # {'accounts:profile': 5}
+    'BUDGETS': {},
+}
+
+_IN_LIST = re.compile(r'\((?:%s|\?)(?:\s*,\s*(?:%s|\?))+\)')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+\b')
+_SPACES = re.compile(r'\s+')
+
+
+def get_setting(name):
+    return getattr(settings, 'QUERY_INSPECTOR', {}).get(name, DEFAULTS[name])
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def normalize_sql(sql):
+    """Шаблон запроса: без литералов и с одинаковыми IN-списками"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('(...)', sql)
+    return _SPACES.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    return hashlib.sha1(normalize_sql(sql).encode()).hexdigest()[:12]
+
+
+def query_budget(max_queries):
+    """
+    Объявить бюджет SQL-запросов представления
+
+    Для class-based views применяйте к результату as_view().
+    """
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+
+class RequestQueries:
+    """Запросы одного HTTP-запроса"""
+
+    def __init__(self, request=None):
+        self.request = request
+        self.count = 0
+        self.duration = 0.0
+        self.templates = Counter()
+        self.samples = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            normalized = normalize_sql(sql)
+            self.templates[normalized] += 1
+            self.samples.setdefault(normalized, sql)
+
+    def repeated(self, threshold):
+        return [(sql, n) for sql, n in self.templates.most_common() if n > threshold]
+
+
+class ViewQueryStats:
+    """Накопленная статистика по имени URL (в пределах процесса)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view_name, queries, repeated):
+        with self._lock:
+            stats = self._views.setdefault(view_name, {
+                'requests': 0,
+                'queries': 0,
+                'sql_time': 0.0,
+                'max_queries': 0,
+                'repeated': Counter(),
+            })
+            stats['requests'] += 1
+            stats['queries'] += queries.count
+            stats['sql_time'] += queries.duration
+            stats['max_queries'] = max(stats['max_queries'], queries.count)
+            for sql, _ in repeated:
+                stats['repeated'][fingerprint(sql)] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {**stats, 'repeated': dict(stats['repeated'])}
+                for name, stats in self._views.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._views.clear()
+
+
+view_stats = ViewQueryStats()
+
+_current = contextvars.ContextVar('request_queries', default=None)
+
+
+def current_request():
+    """HTTP-запрос, в контексте которого выполняется SQL (или None)"""
+    queries = _current.get()
+    return queries.request if queries is not None else None
+
+
+def record_query(execute, sql, params, many, context):
+    queries = _current.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+    return queries(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_wrapper(sender, connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+# Подключения, открытые до импорта модуля
+for _connection in connections.all(initialized_only=True):
+    install_wrapper(None, _connection)
+
+
+def get_budget(request):
+    match = request.resolver_match
+    if match is None:
+        return None
+    budget = getattr(match.func, 'query_budget', None)
+    if budget is None:
+        budget = get_setting('BUDGETS').get(match.view_name)
+    return budget
+
+
+class QueryInspectorMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not get_setting('ENABLED'):
+            return self.get_response(request)
+
+        queries = RequestQueries(request)
+        token = _current.set(queries)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.check(request, queries)
+        return response
+
+    async def __acall__(self, request):
+        if not get_setting('ENABLED'):
+            return await self.get_response(request)
+
+        queries = RequestQueries(request)
+        token = _current.set(queries)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.check(request, queries)
+        return response
+
+    def check(self, request, queries):
+        request.query_stats = queries
+        match = request.resolver_match
+        view_name = match.view_name if match else '<unresolved>'
+
+        threshold = get_setting('REPEAT_THRESHOLD')
+        repeated = queries.repeated(threshold)
+        view_stats.record(view_name, queries, repeated)
+
+        for sql, n in repeated:
+            logger.warning(
+                'Возможен N+1 в %s: запрос выполнен %d раз: %s',
+                view_name, n, queries.samples[sql]
+            )
+
+        budget = get_budget(request)
+        if budget is not None and queries.count > budget:
+            message = (
+                f'{view_name}: {queries.count} SQL-запросов при бюджете {budget} '
+                f'({queries.duration * 1000:.1f} мс)'
+            )
+            if get_setting('RAISE'):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
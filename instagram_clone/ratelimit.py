@@ -0,0 +1,262 @@
+"""
+Ограничение частоты запросов (token bucket) для пишущих представлений
+
+Лимит объявляется у представления (@rate_limit) или в
+settings.RATE_LIMIT['RULES'] по имени URL (настройки важнее
+декоратора). RateLimitMiddleware проверяет его после разрешения URL и
+при превышении отвечает 429 с Retry-After.
+
+Ведро хранится в общем кэше одним целым числом — TAT (theoretical
+arrival time, GCRA): момент в микросекундах, когда ведро снова будет
+полным. Запрос добавляет к TAT интервал одного токена атомарным
+cache.incr(); если TAT ушёл дальше now + burst * interval, запрос
+отклоняется и токен возвращается через decr(). Обычный путь — одна
+операция с кэшем, без чтения-изменения-записи.
+
+Решение согласовано между процессами, только если CACHE_ALIAS общий
+для них (instagram_clone.shared_cache). С LocMemCache у каждого
+процесса своё ведро и фактический лимит — N × rate при N процессах;
+об этом предупреждает проверка Django при запуске.
+"""
+import logging
+import math
+import re
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse, JsonResponse
+
+from instagram_clone import shared_cache
+from instagram_clone.metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'rl',
+    # Заголовок с адресом клиента за прокси (например, 'HTTP_X_REAL_IP');
+    # None — REMOTE_ADDR
+    'IP_META_KEY': None,
+    # {'posts:post_like': {'rate': '30/m', 'burst': 10, 'key': 'user', 'methods': ['POST']}}
+    'RULES': {},
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+_RATE = re.compile(r'^(\d+)/(\d*)([smhd])$')
+
+rate_limited = registry.counter(
+    'rate_limited_total', 'Запросы, отклонённые ограничением частоты', ('view',)
+)
+
+
+def get_setting(name):
+    return getattr(settings, 'RATE_LIMIT', {}).get(name, DEFAULTS[name])
+
+
+shared_cache.require(
+    'RATE_LIMIT', lambda: get_setting('CACHE_ALIAS') if get_setting('ENABLED') else None,
+    'лимит действует в каждом процессе отдельно (N × rate при N процессах)'
+)
+
+
+def parse_rate(rate):
+    """'30/m' → (30, 60); '100/5m' → (100, 300)"""
+    match = _RATE.match(rate)
+    if match is None:
+        raise ValueError(f'Неверный формат лимита: {rate!r}')
+    count, multiplier, unit = match.groups()
+    return int(count), int(multiplier or 1) * PERIODS[unit]
+
+
+class Rule:
+    """
+    Лимит представления
+
+    Args:
+        rate: Скорость пополнения, 'N/s|m|h|d' ('30/m', '100/5m')
+        burst: Ёмкость ведра (по умолчанию — N из rate)
+        key: 'user' (анонимные — по IP) или 'ip'
+        methods: Ограничиваемые HTTP-методы
+    """
+
+    def __init__(self, rate, burst=None, key='user', methods=('POST',)):
+        count, period = parse_rate(rate)
+        self.rate = rate
+        self.burst = burst or count
+        self.key = key
+        self.methods = frozenset(m.upper() for m in methods)
+        # Микросекунд на токен
+        self.interval = period * 1_000_000 // count
+        self.window = self.burst * self.interval
+        # Ключ живёт дольше окна: при истечении теряется «долг» клиента
+        self.timeout = max(2 * math.ceil(self.window / 1_000_000), 60)
+
+
+class Decision:
+
+    def __init__(self, allowed, remaining=0, retry_after=0.0):
+        self.allowed = allowed
+        self.remaining = remaining
+        self.retry_after = retry_after
+
+
+def rate_limit(rate, burst=None, key='user', methods=('POST',)):
+    """
+    Объявить лимит представления (проверяет RateLimitMiddleware)
+
+    Для class-based views применяйте к результату as_view().
+    """
+    rule = Rule(rate, burst, key, methods)
+
+    def decorator(view):
+        view.rate_limit = rule
+        return view
+    return decorator
+
+
+# Rule из настроек разбирается один раз
+_configured = {}
+
+
+@receiver(setting_changed)
+def reset_rules(setting, **kwargs):
+    if setting == 'RATE_LIMIT':
+        _configured.clear()
+
+
+def get_rule(match):
+    if match is None:
+        return None
+    rule = _configured.get(match.view_name)
+    if rule is None:
+        options = get_setting('RULES').get(match.view_name)
+        if options is None:
+            return getattr(match.func, 'rate_limit', None)
+        rule = _configured[match.view_name] = Rule(**options)
+    return rule
+
+
+def client_ip(request):
+    meta_key = get_setting('IP_META_KEY')
+    if meta_key and request.META.get(meta_key):
+        return request.META[meta_key].split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def identity(rule, request, user):
+    if rule.key == 'user' and user is not None and user.is_authenticated:
+        return f'u{user.pk}'
+    return f'ip{client_ip(request)}'
+
+
+def consume(rule, bucket, now=None):
+    """
+    Взять токен из ведра
+
+    Args:
+        rule: Rule
+        bucket: Ключ ведра в кэше
+        now: Текущее время в микросекундах (для тестов)
+
+    Returns:
+        Decision
+    """
+    cache = caches[get_setting('CACHE_ALIAS')]
+    now = now if now is not None else time.time_ns() // 1000
+    interval = rule.interval
+
+    try:
+        tat = cache.incr(bucket, interval)
+    except ValueError:
+        # Первый запрос (или ключ истёк): ведро полное
+        if cache.add(bucket, now + interval, rule.timeout):
+            return Decision(True, rule.burst - 1)
+        tat = cache.incr(bucket, interval)
+
+    if tat - interval < now:
+        # Ведро успело наполниться: TAT в прошлом. Сдвиг неатомарный, но
+        # гонка здесь возможна только при полном ведре
+        cache.set(bucket, now + interval, rule.timeout)
+        return Decision(True, rule.burst - 1)
+
+    if tat - now > rule.window:
+        # Отказ не расходует токен; ключ продлевается, чтобы «долг»
+        # не пропал с истечением
+        cache.decr(bucket, interval)
+        cache.touch(bucket, rule.timeout)
+        return Decision(False, 0, (tat - now - rule.window) / 1_000_000)
+
+    return Decision(True, (rule.window - (tat - now)) // interval)
+
+
+def check(request, user):
+    """Decision для запроса или None, если лимит не применяется"""
+    if not get_setting('ENABLED'):
+        return None
+    match = request.resolver_match
+    rule = get_rule(match)
+    if rule is None or request.method not in rule.methods:
+        return None
+
+    bucket = f"{get_setting('KEY_PREFIX')}:{match.view_name}:{identity(rule, request, user)}"
+    try:
+        decision = consume(rule, bucket)
+    except Exception:
+        # Недоступный кэш не должен останавливать запись
+        logger.exception('Ограничение частоты пропущено: ошибка кэша')
+        return None
+
+    if not decision.allowed:
+        rate_limited.inc(view=match.view_name)
+    return decision
+
+
+def too_many_requests(request, decision):
+    retry_after = max(1, math.ceil(decision.retry_after))
+    message = 'Слишком много запросов, попробуйте позже'
+    if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        response = JsonResponse({'success': False, 'error': message}, status=429)
+    else:
+        response = HttpResponse(message, status=429, content_type='text/plain; charset=utf-8')
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+class RateLimitMiddleware:
+    """
+    Проверка лимитов в process_view (нужны resolver_match и
+    пользователь, поэтому стоит после AuthenticationMiddleware)
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+            # Асинхронный стек: пользователь загружается через auser(),
+            # синхронные операции с кэшем — в потоке sync_to_async, не
+            # блокируя event loop
+            self.process_view = self.aprocess_view
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        decision = check(request, getattr(request, 'user', None))
+        if decision is not None and not decision.allowed:
+            return too_many_requests(request, decision)
+        return None
+
+    async def aprocess_view(self, request, view_func, view_args, view_kwargs):
+        user = await request.auser() if hasattr(request, 'auser') else None
+        decision = await sync_to_async(check)(request, user)
+        if decision is not None and not decision.allowed:
+            return too_many_requests(request, decision)
+        return None
@@ -0,0 +1,248 @@
+"""
+Пакетное JSON API чтения для мобильных клиентов
+
+Один запрос вместо запроса на каждый профиль, пост и уведомление:
+
+    GET /api/batch/?ids=profile:1,profile:2,post:7,notification:40
+                   &fields[profile]=username,avatar&fields[post]=title,likes
+
+    {"data": {"profile": {"1": {...}, "2": {...}}, "post": {"7": {...}}, ...},
+     "missing": ["notification:40"]}
+
+Типы ресурсов (Resource) объявляются в приложениях (accounts.api,
+posts.api) и подключаются через READ_API['RESOURCES']. Каждый тип
+загружается одним запросом values() только с колонками запрошенных
+полей (fields[тип]; без него — все поля типа). Недоступные и
+несуществующие объекты попадают в missing.
+
+Ответ сериализуется orjson, если он установлен (в несколько раз
+быстрее json), иначе — стандартным json с DjangoJSONEncoder.
+"""
+import json
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseNotAllowed
+from django.utils.module_loading import import_string
+
+from instagram_clone.conditional import conditional, get_versions
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+DEFAULTS = {
+    # Тип → путь к классу Resource
+    'RESOURCES': {
+        'profile': 'accounts.api.ProfileResource',
+        'notification': 'accounts.api.NotificationResource',
+        'post': 'posts.api.PostResource',
+    },
+    # Не больше идентификаторов в одном запросе
+    'MAX_IDS': 100,
+    # Сколько секунд ETag может не замечать данные без счётчика версий
+    # (онлайн-статус, имя автора поста)
+    'MAX_AGE': 60,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'READ_API', {}).get(name, DEFAULTS[name])
+
+
+def dumps(data):
+    """Сериализация в JSON (bytes)"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False).encode()
+
+
+class FastJsonResponse(HttpResponse):
+    """JsonResponse с сериализацией через dumps()"""
+
+    def __init__(self, data, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
+
+
+class Field:
+    """
+    Поле ресурса
+
+    Args:
+        paths: Колонки для values() (пути через __)
+        compute: Функция значений колонок → значение поля; без неё поле
+            равно единственной колонке
+    """
+
+    def __init__(self, *paths, compute=None):
+        self.paths = paths
+        self.compute = compute
+
+    def value(self, row):
+        if self.compute is None:
+            return row[self.paths[0]]
+        return self.compute(*(row[path] for path in self.paths))
+
+
+def file_url(field):
+    """compute для FileField: имя файла → URL в его storage"""
+    def compute(name):
+        return field.storage.url(name) if name else None
+    return compute
+
+
+class Resource:
+    """
+    Тип ресурса пакетного API
+
+    Подклассы задают model, fields ({имя: Field}) и при необходимости
+    lookup (колонка идентификатора), required (колонки, нужные
+    visible() независимо от запрошенных полей), queryset() и visible().
+    """
+    model = None
+    lookup = 'id'
+    fields = {}
+    required = ()
+    # Область счётчиков версий (instagram_clone.conditional) или None
+    version_scope = None
+
+    def queryset(self, request):
+        return self.model._default_manager.all()
+
+    def visible(self, request, rows):
+        """Отфильтровать строки, недоступные пользователю"""
+        return rows
+
+    def version_keys(self, request, ids):
+        """Идентификаторы счётчиков версий для ETag"""
+        return ids
+
+    def parse_fields(self, names):
+        """
+        Raises:
+            ValueError: Неизвестное поле
+        """
+        if not names:
+            return list(self.fields)
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ValueError(f'Неизвестные поля: {", ".join(unknown)}')
+        return names
+
+    def load(self, request, ids, names):
+        """
+        Объекты одним запросом
+
+        Returns:
+            dict: {id: {поле: значение}}
+        """
+        columns = {self.lookup, *self.required}
+        for name in names:
+            columns.update(self.fields[name].paths)
+
+        rows = self.queryset(request).filter(**{f'{self.lookup}__in': ids}).values(*columns)
+        return {
+            row[self.lookup]: {name: self.fields[name].value(row) for name in names}
+            for row in self.visible(request, list(rows))
+        }
+
+
+# Экземпляры Resource по типу (классы из настроек импортируются один раз)
+_resources = {}
+
+
+@receiver(setting_changed)
+def reset_resources(setting, **kwargs):
+    if setting == 'READ_API':
+        _resources.clear()
+
+
+def get_resource(kind):
+    """
+    Raises:
+        ValueError: Неизвестный тип
+    """
+    if kind not in _resources:
+        path = get_setting('RESOURCES').get(kind)
+        if path is None:
+            raise ValueError(f'Неизвестный тип: {kind}')
+        _resources[kind] = import_string(path)()
+    return _resources[kind]
+
+
+def parse_request(request):
+    """
+    Разбор ids и fields[тип]
+
+    Returns:
+        dict: {тип: (Resource, [id], [поле])} в порядке первого упоминания
+
+    Raises:
+        ValueError: Ошибка в параметрах запроса
+    """
+    tokens = [
+        token.strip()
+        for value in request.GET.getlist('ids')
+        for token in value.split(',') if token.strip()
+    ]
+    if not tokens:
+        raise ValueError('Не указаны ids')
+    if len(tokens) > get_setting('MAX_IDS'):
+        raise ValueError(f'Не больше {get_setting("MAX_IDS")} ids за запрос')
+
+    ids = {}
+    for token in tokens:
+        kind, sep, pk = token.partition(':')
+        if not sep or not pk.isdigit():
+            raise ValueError(f'Неверный идентификатор: {token!r} (ожидается тип:id)')
+        ids.setdefault(kind, [])
+        if int(pk) not in ids[kind]:
+            ids[kind].append(int(pk))
+
+    parsed = {}
+    for kind, pks in ids.items():
+        resource = get_resource(kind)
+        names = [name for name in request.GET.get(f'fields[{kind}]', '').split(',') if name]
+        parsed[kind] = (resource, pks, resource.parse_fields(names))
+    return parsed
+
+
+def batch_etag(request):
+    """Версии всех запрошенных объектов; None — запрос с ошибкой"""
+    try:
+        parsed = parse_request(request)
+    except ValueError:
+        return None
+    parts = []
+    for kind, (resource, ids, names) in parsed.items():
+        if resource.version_scope is None:
+            return None
+        keys = resource.version_keys(request, ids)
+        parts.append((kind, ids, names, get_versions(resource.version_scope, *keys)))
+    return parts
+
+
+@login_required
+@conditional(batch_etag, html=False, max_age=get_setting('MAX_AGE'))
+def batch_view(request):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    try:
+        parsed = parse_request(request)
+    except ValueError as e:
+        return FastJsonResponse({'error': str(e)}, status=400)
+
+    data = {}
+    missing = []
+    for kind, (resource, ids, names) in parsed.items():
+        found = resource.load(request, ids, names)
+        data[kind] = {str(pk): found[pk] for pk in ids if pk in found}
+        missing.extend(f'{kind}:{pk}' for pk in ids if pk not in found)
+
+    return FastJsonResponse({'data': data, 'missing': missing})
@@ -0,0 +1,131 @@
+"""
+Маршрутизация запросов к БД: запись — в primary, чтение — в реплики
+
+Реплики перечисляются в settings.DATABASE_REPLICAS['ALIASES']. Если
+список пуст, всё идёт в primary.
+
+Read-your-writes: после записи чтения до конца запроса идут в primary,
+а ReplicaPinningMiddleware ставит cookie на MAX_LAG секунд, чтобы
+следующие запросы того же клиента тоже читали из primary, пока реплики
+не догонят.
+"""
+import contextvars
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+
+PRIMARY = 'default'
+
+DEFAULTS = {
+    'ALIASES': [],
+    # Допустимое отставание реплик (секунды) = окно "прилипания" к primary
+    'MAX_LAG': 5,
+    'COOKIE_NAME': 'db_pin',
+}
+
+_pinned = contextvars.ContextVar('db_pinned', default=False)
+_wrote = contextvars.ContextVar('db_wrote', default=False)
+
+
+def get_setting(name):
+    return getattr(settings, 'DATABASE_REPLICAS', {}).get(name, DEFAULTS[name])
+
+
+def pin_primary():
+    """Направить все чтения текущего контекста в primary"""
+    _pinned.set(True)
+
+
+def is_pinned():
+    return _pinned.get()
+
+
+def reset():
+    _pinned.set(False)
+    _wrote.set(False)
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        replicas = get_setting('ALIASES')
+        if not replicas or _pinned.get():
+            return PRIMARY
+
+        # Внутри транзакции читаем то, что пишем
+        if connections[PRIMARY].in_atomic_block:
+            return PRIMARY
+
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _pinned.set(True)
+        _wrote.set(True)
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики содержат те же данные, что и primary
+        databases = {PRIMARY, *get_setting('ALIASES')}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_setting('ALIASES'):
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """
+    Read-your-writes между запросами: после записи клиент получает
+    cookie и MAX_LAG секунд читает только из primary
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        self.pin_from_cookie(request)
+        response = self.get_response(request)
+        self.set_cookie(response)
+        return response
+
+    async def __acall__(self, request):
+        self.pin_from_cookie(request)
+        response = await self.get_response(request)
+        self.set_cookie(response)
+        return response
+
+    def pin_from_cookie(self, request):
+        reset()
+        pinned_until = request.COOKIES.get(get_setting('COOKIE_NAME'))
+        try:
+            if pinned_until and float(pinned_until) > time.time():
+                pin_primary()
+        except ValueError:
+            pass
+
+    def set_cookie(self, response):
+        # Запись в sync_to_async тоже видна: asgiref возвращает
+        # изменения contextvars в вызывающий контекст
+        if _wrote.get():
+            max_lag = get_setting('MAX_LAG')
+            response.set_cookie(
+                get_setting('COOKIE_NAME'),
+                str(time.time() + max_lag),
+                max_age=max_lag,
+                httponly=True,
+                samesite='Lax',
+            )
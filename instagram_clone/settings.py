@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -28,6 +30,16 @@ DEBUG = True
 ALLOWED_HOSTS = []
 
 
+# Запуск через manage.py test
+TESTING = len(sys.argv) > 1 and sys.argv[1] == 'test'
+
+# Все запросы обслуживает один процесс (runserver, тесты): тогда
+# LocMemCache годится как общий кэш (instagram_clone.shared_cache)
+SINGLE_PROCESS = (
+    TESTING or sys.argv[1:2] == ['runserver'] or os.environ.get('SINGLE_PROCESS') == '1'
+)
+
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -42,11 +54,26 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Первым: время ответа учитывает все остальные middleware
+    'instagram_clone.metrics.MetricsMiddleware',
+    # Профилирование по подписанному заголовку или выборке
+    'instagram_clone.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # До SessionMiddleware: запись сессии тоже должна прилипать к primary
+    'instagram_clone.routers.ReplicaPinningMiddleware',
+    # Снаружи SessionMiddleware/AuthenticationMiddleware: их запросы тоже считаются
+    'instagram_clone.query_inspector.QueryInspectorMiddleware',
+    # Пакетные загрузчики связанных объектов на время запроса
+    'instagram_clone.loaders.LoaderMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'accounts.middleware.UserHydrationMiddleware',
+    # Лимиты частоты пишущих представлений (нужен request.user)
+    'instagram_clone.ratelimit.RateLimitMiddleware',
+    # Запись запросов для load_replay (LOADTEST['RECORD_FILE'])
+    'instagram_clone.loadtest.RequestRecorderMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -55,7 +82,8 @@ ROOT_URLCONF = 'instagram_clone.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates + замер времени рендеринга (instagram_clone.metrics)
+        'BACKEND': 'instagram_clone.metrics.InstrumentedDjangoTemplates',
         'DIRS': [BASE_DIR / 'templates'],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -81,12 +109,224 @@ WSGI_APPLICATION = 'instagram_clone.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # django.db.backends.sqlite3 + PRAGMA при подключении и BEGIN IMMEDIATE
+        'ENGINE': 'instagram_clone.db_backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Постоянные соединения вместо нового на каждый запрос
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Ожидание блокировки записи (секунды) на стороне sqlite3
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'busy_timeout': 20000,
+                'mmap_size': 268435456,
+                'cache_size': -65536,
+                'temp_store': 'MEMORY',
+            },
+        },
+    },
+    # Шард уведомлений; используется, только если указан в SHARDING['SHARDS']
+    'notifications_1': {
+        'ENGINE': 'instagram_clone.db_backends.sqlite3',
+        'NAME': BASE_DIR / 'notifications_1.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'busy_timeout': 20000,
+            },
+        },
+        'TEST': {'DEPENDENCIES': []},
+    },
+}
+
+# Шардирование уведомлений по user_id (accounts.sharding).
+# После изменения SHARDS запустите manage.py reshard_notifications
+SHARDING = {
+    'SHARDS': ['default'],
+    'MODELS': ['accounts.notification'],
+}
+
+# Реплики только для чтения. Для локальной проверки — копии db.sqlite3:
+# добавьте в DATABASES, например,
+#     'replica_1': {**DATABASES['default'], 'NAME': BASE_DIR / 'replica_1.sqlite3',
+#                   'TEST': {'MIRROR': 'default'}},
+# перечислите алиас в ALIASES и запустите manage.py sync_sqlite_replicas
+DATABASE_REPLICAS = {
+    'ALIASES': [],
+    'MAX_LAG': 5,
+    'COOKIE_NAME': 'db_pin',
+}
+
+DATABASE_ROUTERS = [
+    'accounts.sharding.ShardRouter',
+    'instagram_clone.routers.PrimaryReplicaRouter',
+]
+
+# Счётчик SQL-запросов по представлениям и детектор N+1
+# (instagram_clone.query_inspector). Бюджеты объявляются @query_budget
+# у представления или здесь по имени URL
+QUERY_INSPECTOR = {
+    'ENABLED': True,
+    'REPEAT_THRESHOLD': 5,
+    # В тестах превышение бюджета — ошибка, в продакшене — запись в лог
+    'RAISE': TESTING,
+    'BUDGETS': {},
+}
+
+# Журнал медленных SQL-запросов с EXPLAIN (instagram_clone.slow_queries),
+# сводка по шаблонам — /_slow_queries/
+SLOW_QUERIES = {
+    'ENABLED': True,
+    'THRESHOLD_MS': 100,
+    'EXPLAIN': True,
+    'WINDOW': 3600,
+    'MAX_FINGERPRINTS': 500,
+}
+
+# Метрики Prometheus на /metrics/ (instagram_clone.metrics).
+# Для gunicorn/uwsgi с несколькими воркерами укажите общий каталог
+# MULTIPROCESS_DIR и очищайте его при перезапуске
+METRICS = {
+    'ENABLED': True,
+    'MULTIPROCESS_DIR': None,
+    'FLUSH_INTERVAL': 5,
+    'TOKEN': os.environ.get('METRICS_TOKEN'),
+    'ALLOWED_IPS': [],
+}
+
+# Нагрузочное воспроизведение (manage.py load_replay). RECORD_FILE —
+# JSONL, куда RequestRecorderMiddleware пишет запросы для повтора
+LOADTEST = {
+    'RECORD_FILE': None,
+}
+
+# Ограничение частоты запросов (instagram_clone.ratelimit): лимиты
+# задаются @rate_limit у представления, RULES по имени URL их переопределяют
+RATE_LIMIT = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'rl',
+    'IP_META_KEY': None,
+    'RULES': {},
+}
+
+# Условные GET (instagram_clone.conditional): ETag из счётчиков версий
+# в кэше, 304 без рендеринга. VERSION меняется вместе с шаблонами
+CONDITIONAL_GET = {
+    'ENABLED': True,
+    'CACHE_ALIAS': 'default',
+    'VERSION': 1,
+    'TIMEOUT': 86400,
+}
+
+# Пакетное JSON API чтения (instagram_clone.read_api), /api/batch/
+READ_API = {
+    'RESOURCES': {
+        'profile': 'accounts.api.ProfileResource',
+        'notification': 'accounts.api.NotificationResource',
+        'post': 'posts.api.PostResource',
+    },
+    'MAX_IDS': 100,
+    'MAX_AGE': 60,
+}
+
+# Рейтинг «Интересное» (posts.trending), /explore/. Снимок
+# обновляет manage.py update_trending --interval 60
+TRENDING = {
+    'HALF_LIFE': 6 * 3600,
+    'WEIGHTS': {'post': 1.0, 'like': 1.0, 'comment': 3.0},
+    'TOP_K': 500,
+    'PAGE_SIZE': 24,
+    'BATCH_SIZE': 5000,
+    'MIN_SCORE': 0.01,
+}
+
+# Профилирование запросов (instagram_clone.profiling), список — /_profiles/
+PROFILING = {
+    'ENABLED': True,
+    'DIR': BASE_DIR / 'profiles',
+    # 'cprofile' или 'sampler' (сэмплирование стека, folded stacks)
+    'MODE': 'cprofile',
+    'SAMPLE_RATE': 0.0,
+    'SAMPLE_INTERVAL': 0.001,
+    'TOKEN_MAX_AGE': 3600,
+    'MAX_PROFILES': 200,
+}
+
+# Очередь записи с одним писателем (instagram_clone.write_queue)
+SQLITE_WRITE_QUEUE = {
+    'ENABLED': False,
+    'MAX_BATCH': 200,
+    'MAX_DELAY': 0.002,
+    'DATABASE': 'default',
+}
+
+# Фоновая очередь задач в БД (instagram_clone.task_queue), воркеры —
+# manage.py run_tasks. В тестах задачи выполняются сразу
+TASK_QUEUE = {
+    'EAGER': TESTING,
+    'DATABASE': 'default',
+    'BATCH_SIZE': 50,
+    'POLL_INTERVAL': 1.0,
+    'MAX_ATTEMPTS': 5,
+    'BACKOFF_BASE': 2,
+    'BACKOFF_MAX': 600,
+    'LOCK_TIMEOUT': 300,
+    'RETENTION': 7 * 86400,
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+# Несколько воркеров (gunicorn, uvicorn) должны делить кэш: счётчики
+# версий, бакеты rate limit и общий уровень кэша объектов. Без REDIS_URL
+# кэш локальный для процесса — см. SINGLE_PROCESS
+REDIS_URL = os.environ.get('REDIS_URL')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
     }
+
+# Двухуровневый кэш User/Profile (accounts.cache)
+OBJECT_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 300,
+    'NEGATIVE_TIMEOUT': 30,
+    'LOCAL_MAXSIZE': 2048,
+    'LOCAL_TIMEOUT': 5,
+    'VERSION': 2,
+    'STALE_TIMEOUT': 300,
+    'LOCK_TIMEOUT': 10,
+    'LOCK_WAIT': 0.5,
+    'EARLY_EXPIRATION_BETA': 1.0,
 }
 
 
+AUTHENTICATION_BACKENDS = [
+    'django.contrib.auth.backends.ModelBackend',
+]
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -131,3 +371,12 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Раздача MEDIA_ROOT (instagram_clone.media). За nginx — MODE 'x-accel' и
+#     location /protected-media/ { internal; alias <MEDIA_ROOT>/; }
+MEDIA_SERVING = {
+    'MODE': 'stream',
+    'ACCEL_PREFIX': '/protected-media/',
+    'MAX_AGE': 365 * 86400,
+    'BLOCK_SIZE': 64 * 1024,
+}
+
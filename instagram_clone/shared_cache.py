@@ -0,0 +1,76 @@
+"""
+Кэш, общий для всех процессов приложения
+
+Общий уровень кэша объектов (accounts.cache), бакеты rate limit и
+счётчики версий условных GET полезны, только если их видят все воркеры.
+LocMemCache хранит данные в памяти своего процесса: при нескольких
+воркерах запись, сделанная в одном, не видна остальным — объекты
+остаются устаревшими до TIMEOUT, лимит умножается на число воркеров,
+304 отдаётся на изменённые данные.
+
+Локальный кэш считается общим только при settings.SINGLE_PROCESS
+(runserver, тесты). Иначе зависящие от него функции отключаются (или
+работают в пределах процесса), а проверка Django (manage.py check,
+запуск сервера) об этом предупреждает.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Tags, Warning, register
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+# Функция → (алиас кэша, который ей нужен, или None; что будет без него)
+_required = {}
+
+# Алиас → общий ли он (проверяется на каждом запросе)
+_shared = {}
+
+
+@receiver(setting_changed)
+def reset_shared(setting, **kwargs):
+    if setting in ('CACHES', 'SINGLE_PROCESS'):
+        _shared.clear()
+
+
+def is_process_local(alias):
+    """Хранит ли бэкенд алиаса данные в памяти процесса"""
+    return isinstance(caches[alias], LocMemCache)
+
+
+def is_shared(alias):
+    """Видят ли алиас все процессы приложения"""
+    if alias not in _shared:
+        _shared[alias] = getattr(settings, 'SINGLE_PROCESS', False) or not is_process_local(alias)
+    return _shared[alias]
+
+
+def require(feature, get_alias, effect='функция отключена'):
+    """
+    Объявить, что функции нужен общий кэш
+
+    Args:
+        feature: Название для предупреждения
+        get_alias: Функция без аргументов → алиас кэша или None, если
+            функция выключена
+        effect: Что происходит без общего кэша
+    """
+    _required[feature] = (get_alias, effect)
+
+
+@register(Tags.caches)
+def check_shared_caches(app_configs, **kwargs):
+    warnings = []
+    for feature, (get_alias, effect) in _required.items():
+        alias = get_alias()
+        if alias is None or is_shared(alias):
+            continue
+        warnings.append(Warning(
+            f'{feature}: кэш {alias!r} ({type(caches[alias]).__name__}) виден только '
+            f'своему процессу: {effect}',
+            hint='Задайте общий кэш (REDIS_URL) или SINGLE_PROCESS = True, '
+                 'если все запросы обслуживает один процесс',
+            id='instagram_clone.W001',
+        ))
+    return warnings
@@ -0,0 +1,230 @@
+"""
+Журнал медленных SQL-запросов с планом выполнения
+
+Обёртка выполнения запросов ставится на каждое новое подключение
+(сигнал connection_created) и работает и в запросах, и в командах.
+Запрос дольше THRESHOLD_MS:
+- пишется в лог 'instagram_clone.slow_queries';
+- попадает в сводку по шаблону (fingerprint из query_inspector): число,
+  суммарное и максимальное время, места вызова (представление и функция
+  приложения) и план EXPLAIN QUERY PLAN, снятый один раз на шаблон.
+
+Шаблоны, не встречавшиеся дольше WINDOW секунд, из сводки удаляются.
+Сводка доступна персоналу на /_slow_queries/.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import DatabaseError
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import JsonResponse
+
+from .query_inspector import current_request, fingerprint, normalize_sql
+
+
+logger = logging.getLogger('instagram_clone.slow_queries')
+
+DEFAULTS = {
+    'ENABLED': True,
+    'THRESHOLD_MS': 100,
+    'EXPLAIN': True,
+    'WINDOW': 3600,
+    'MAX_FINGERPRINTS': 500,
+}
+
+_local = threading.local()
+
+
+def get_setting(name):
+    return getattr(settings, 'SLOW_QUERIES', {}).get(name, DEFAULTS[name])
+
+
+def call_site():
+    """
+    Место вызова в коде проекта
+
+    Returns:
+        tuple: (представление, функция) — самый внешний кадр из views.py
+            и самый внутренний кадр приложения, вида 'accounts.services.
+            FriendshipService.get_friend_suggestions'
+    """
+    base_dir = str(settings.BASE_DIR) + os.sep
+    view = caller = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        filename = frame.f_code.co_filename
+        if (
+            filename.startswith(base_dir)
+            and 'site-packages' not in filename
+            and module != '__main__'
+            and not module.startswith('instagram_clone.')
+        ):
+            name = f'{module}.{frame.f_code.co_qualname}'
+            if caller is None:
+                caller = name
+            if module.endswith('.views'):
+                view = name
+        frame = frame.f_back
+
+    if view is None:
+        # Запросы async-представлений выполняются в другом потоке,
+        # и кадра представления в стеке нет
+        request = current_request()
+        match = request.resolver_match if request is not None else None
+        if match is not None:
+            view = match._func_path
+    return view, caller
+
+
+def explain(connection, sql, params):
+    """План запроса или None (только SELECT)"""
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    _local.explaining = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            rows = cursor.fetchall()
+    except DatabaseError:
+        return None
+    finally:
+        _local.explaining = False
+    # SQLite: (id, parent, notused, detail); остальные СУБД — одна колонка
+    return [row[-1] for row in rows]
+
+
+def has_full_scan(plan):
+    """SQLite помечает чтение всей таблицы как 'SCAN <таблица>'"""
+    return any(line.startswith('SCAN ') and 'USING' not in line for line in plan or ())
+
+
+class SlowQueryLog:
+    """Сводка медленных запросов по шаблону (в пределах процесса)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def has_plan(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry['plan'] is not None
+
+    def record(self, key, sql, duration, view, caller, alias, plan=None):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {
+                    'fingerprint': key,
+                    'normalized': normalize_sql(sql),
+                    'sample': sql,
+                    'database': alias,
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'first_seen': now,
+                    'last_seen': now,
+                    'views': Counter(),
+                    'callers': Counter(),
+                    'plan': None,
+                    'full_scan': False,
+                }
+            entry['count'] += 1
+            entry['total_ms'] += duration * 1000
+            if duration * 1000 > entry['max_ms']:
+                entry['max_ms'] = duration * 1000
+                entry['sample'] = sql
+            entry['last_seen'] = now
+            entry['views'][view or '<none>'] += 1
+            entry['callers'][caller or '<none>'] += 1
+            if plan is not None:
+                entry['plan'] = plan
+                entry['full_scan'] = has_full_scan(plan)
+            self._prune(now)
+
+    def _prune(self, now):
+        window = get_setting('WINDOW')
+        for key in [k for k, e in self._entries.items() if now - e['last_seen'] > window]:
+            del self._entries[key]
+        excess = len(self._entries) - get_setting('MAX_FINGERPRINTS')
+        if excess > 0:
+            oldest = sorted(self._entries.values(), key=lambda e: e['last_seen'])[:excess]
+            for entry in oldest:
+                del self._entries[entry['fingerprint']]
+
+    def report(self):
+        """Шаблоны по убыванию суммарного времени"""
+        with self._lock:
+            self._prune(time.time())
+            entries = [
+                {
+                    **entry,
+                    'total_ms': round(entry['total_ms'], 2),
+                    'max_ms': round(entry['max_ms'], 2),
+                    'avg_ms': round(entry['total_ms'] / entry['count'], 2),
+                    'views': dict(entry['views'].most_common()),
+                    'callers': dict(entry['callers'].most_common()),
+                }
+                for entry in self._entries.values()
+            ]
+        return sorted(entries, key=lambda e: e['total_ms'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+
+
+slow_query_log = SlowQueryLog()
+
+
+def slow_query_wrapper(execute, sql, params, many, context):
+    if getattr(_local, 'explaining', False) or not get_setting('ENABLED'):
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    # Только успешные запросы: после ошибки (IntegrityError, таймаут
+    # блокировки) EXPLAIN в сломанной транзакции подменил бы исключение
+    result = execute(sql, params, many, context)
+    duration = time.perf_counter() - started
+    if duration * 1000 >= get_setting('THRESHOLD_MS'):
+        record_slow_query(context['connection'], sql, params, many, duration)
+    return result
+
+
+def record_slow_query(connection, sql, params, many, duration):
+    key = fingerprint(sql)
+    view, caller = call_site()
+
+    plan = None
+    if get_setting('EXPLAIN') and not many and not slow_query_log.has_plan(key):
+        plan = explain(connection, sql, params)
+
+    slow_query_log.record(key, sql, duration, view, caller, connection.alias, plan)
+    logger.warning(
+        'Медленный запрос %.1f мс [%s] в %s (%s): %s',
+        duration * 1000, key, caller or '<none>', view or '<none>', sql
+    )
+
+
+@receiver(connection_created)
+def install_wrapper(sender, connection, **kwargs):
+    if slow_query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, slow_query_wrapper)
+
+
+@staff_member_required
+def slow_queries_view(request):
+    return JsonResponse({
+        'threshold_ms': get_setting('THRESHOLD_MS'),
+        'window': get_setting('WINDOW'),
+        'queries': slow_query_log.report(),
+    }, json_dumps_params={'ensure_ascii': False, 'indent': 2})
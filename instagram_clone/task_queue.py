@@ -0,0 +1,286 @@
+"""
+Фоновая очередь задач в БД (без внешнего брокера)
+
+Побочные эффекты запроса (уведомления, а дальше — обработка медиа и
+рассылка по лентам) ставятся в очередь вместо выполнения внутри
+транзакции запроса:
+
+    @task(max_attempts=3)
+    def create_notification(user_id, ...):
+        ...
+
+    create_notification.enqueue(user_id, ..., key=f'friend_request:{id}')
+
+- enqueue() вставляет задачу через transaction.on_commit: откат
+  транзакции запроса отменяет и её побочные эффекты;
+- key — ключ идемпотентности: задача с уже существующим ключом не
+  ставится повторно;
+- manage.py run_tasks запускает воркеры (несколько процессов). Каждый
+  забирает задачи пачкой: в транзакции (BEGIN IMMEDIATE в SQLite,
+  SKIP LOCKED там, где он есть) помечает их своими и выполняет;
+- при ошибке задача возвращается в очередь с экспоненциальной
+  задержкой, после max_attempts попыток — status='failed';
+- задачи зависшего воркера (locked_at старше LOCK_TIMEOUT) забираются
+  повторно. Доставка «хотя бы один раз»: задача должна переносить
+  повторное выполнение — например, сохранять current_key() в записи с
+  уникальным ограничением.
+
+Если TASK_QUEUE['EAGER'] (в тестах), задача выполняется сразу в
+текущем потоке, без очереди.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from instagram_clone.metrics import events
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'EAGER': False,
+    'DATABASE': 'default',
+    'BATCH_SIZE': 50,
+    'POLL_INTERVAL': 1.0,
+    'MAX_ATTEMPTS': 5,
+    # Задержка перед повтором: BACKOFF_BASE * 2^(попытка-1), не больше BACKOFF_MAX
+    'BACKOFF_BASE': 2,
+    'BACKOFF_MAX': 600,
+    # Через сколько секунд задачу «выполняющегося» воркера можно забрать
+    'LOCK_TIMEOUT': 300,
+    # Сколько хранить выполненные задачи (и их ключи идемпотентности)
+    'RETENTION': 7 * 86400,
+}
+
+
+_local = threading.local()
+
+
+def get_setting(name):
+    return getattr(settings, 'TASK_QUEUE', {}).get(name, DEFAULTS[name])
+
+
+def current_key():
+    """
+    Ключ идемпотентности выполняемой задачи: key из enqueue(), а без
+    него — 'task:<id>' (одинаковый при всех повторах задачи). None вне
+    задачи и в режиме EAGER без key.
+    """
+    return getattr(_local, 'key', None)
+
+
+def run_task(func, args, kwargs, key):
+    _local.key = key
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _local.key = None
+
+
+def _model():
+    from accounts.models import BackgroundTask
+    return BackgroundTask
+
+
+def task(func=None, *, max_attempts=None):
+    """
+    Объявить функцию задачей: добавляет func.enqueue(*args, key=None,
+    delay=None, **kwargs). Аргументы должны сериализоваться в JSON.
+    """
+    if func is None:
+        return partial(task, max_attempts=max_attempts)
+
+    func.task_name = f'{func.__module__}.{func.__qualname__}'
+    func.max_attempts = max_attempts
+    func.enqueue = partial(enqueue, func)
+    return func
+
+
+def enqueue(func, *args, key=None, delay=None, **kwargs):
+    """
+    Поставить задачу в очередь после фиксации текущей транзакции
+
+    Args:
+        func: Функция, объявленная через @task
+        key: Ключ идемпотентности
+        delay: Отложить выполнение на столько секунд
+    """
+    if get_setting('EAGER'):
+        return run_task(func, args, kwargs, key)
+
+    using = get_setting('DATABASE')
+    BackgroundTask = _model()
+    row = BackgroundTask(
+        name=func.task_name,
+        args=list(args),
+        kwargs=kwargs,
+        key=key,
+        max_attempts=func.max_attempts or get_setting('MAX_ATTEMPTS'),
+        run_at=timezone.now() + timedelta(seconds=delay or 0),
+    )
+
+    def insert():
+        BackgroundTask.objects.using(using).bulk_create([row], ignore_conflicts=True)
+        events.inc(event='task_enqueued')
+
+    transaction.on_commit(insert, using=using)
+
+
+def backoff(attempts):
+    """Задержка перед следующей попыткой (с разбросом ±25%)"""
+    delay = min(get_setting('BACKOFF_BASE') * 2 ** (attempts - 1), get_setting('BACKOFF_MAX'))
+    return delay * random.uniform(0.75, 1.25)
+
+
+class Worker:
+    """
+    Воркер очереди: забирает задачи пачками и выполняет их
+
+    Args:
+        name: Имя воркера в locked_by (по умолчанию host:pid)
+        batch_size: Задач за одну выборку
+    """
+
+    def __init__(self, name=None, batch_size=None):
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.batch_size = batch_size or get_setting('BATCH_SIZE')
+        self.using = get_setting('DATABASE')
+        self.processed = 0
+        self.failed = 0
+
+    def claim(self):
+        """Пометить пачку готовых задач своими и вернуть их"""
+        BackgroundTask = _model()
+        now = timezone.now()
+        stale = now - timedelta(seconds=get_setting('LOCK_TIMEOUT'))
+        ready = (
+            Q(status='queued', run_at__lte=now) |
+            Q(status='running', locked_at__lt=stale)
+        )
+        manager = BackgroundTask.objects.using(self.using)
+
+        with transaction.atomic(using=self.using):
+            ids = list(
+                manager.select_for_update(skip_locked=True)
+                .filter(ready)
+                .order_by('run_at', 'id')
+                .values_list('id', flat=True)[:self.batch_size]
+            )
+            if not ids:
+                return []
+            # Условие ready повторяется: задачу мог забрать другой воркер
+            manager.filter(ready, id__in=ids).update(
+                status='running', locked_by=self.name, locked_at=now,
+                attempts=F('attempts') + 1
+            )
+            return list(
+                manager.filter(id__in=ids, status='running', locked_by=self.name, locked_at=now)
+                .order_by('run_at', 'id')
+            )
+
+    def execute(self, row):
+        """Выполнить задачу; вернуть текст ошибки или None"""
+        try:
+            func = import_string(row.name)
+            run_task(func, row.args, row.kwargs, row.key or f'task:{row.id}')
+        except Exception:
+            return traceback.format_exc()
+        finally:
+            # Задачи пишут и в шарды: не держим сломанные соединения
+            for connection in connections.all(initialized_only=True):
+                connection.close_if_unusable_or_obsolete()
+        return None
+
+    def run_once(self):
+        """Одна пачка; возвращает число забранных задач"""
+        BackgroundTask = _model()
+        manager = BackgroundTask.objects.using(self.using)
+        rows = self.claim()
+        done = []
+
+        for row in rows:
+            attempts = row.attempts
+            if attempts > row.max_attempts:
+                # Забрана у зависшего воркера после последней попытки
+                error = 'Попытки исчерпаны: воркер не завершил задачу'
+            else:
+                error = self.execute(row)
+            if error is None:
+                done.append(row.id)
+                continue
+
+            self.failed += 1
+            final = attempts >= row.max_attempts
+            logger.warning(
+                'Задача %s #%s, попытка %s/%s: %s',
+                row.name, row.id, attempts, row.max_attempts, error.strip().splitlines()[-1]
+            )
+            manager.filter(id=row.id, locked_by=self.name).update(
+                status='failed' if final else 'queued',
+                last_error=error,
+                run_at=timezone.now() + timedelta(seconds=0 if final else backoff(attempts)),
+                finished_at=timezone.now() if final else None,
+                locked_by='',
+                locked_at=None,
+            )
+            events.inc(event='task_failed' if final else 'task_retried')
+
+        if done:
+            # Подтверждение пачкой
+            manager.filter(id__in=done, locked_by=self.name).update(
+                status='done', finished_at=timezone.now(), locked_by='', locked_at=None
+            )
+            events.inc(len(done), event='task_done')
+
+        self.processed += len(rows)
+        return len(rows)
+
+    def run(self, should_stop=lambda: False, once=False):
+        """
+        Цикл воркера: пачка за пачкой, при пустой очереди — ожидание
+        POLL_INTERVAL. once — выйти, когда очередь опустела.
+        """
+        poll_interval = get_setting('POLL_INTERVAL')
+        last_prune = 0
+
+        while not should_stop():
+            if time.monotonic() - last_prune > 60:
+                prune()
+                last_prune = time.monotonic()
+            if self.run_once():
+                continue
+            if once:
+                break
+            time.sleep(poll_interval)
+
+
+def prune():
+    """Удалить выполненные задачи старше RETENTION"""
+    BackgroundTask = _model()
+    cutoff = timezone.now() - timedelta(seconds=get_setting('RETENTION'))
+    deleted, _ = BackgroundTask.objects.using(get_setting('DATABASE')).filter(
+        status='done', finished_at__lt=cutoff
+    ).delete()
+    return deleted
+
+
+def stats():
+    """Число задач по статусам"""
+    BackgroundTask = _model()
+    return dict(
+        BackgroundTask.objects.using(get_setting('DATABASE'))
+        .order_by().values('status').annotate(n=Count('id'))
+        .values_list('status', 'n')
+    )
@@ -1,17 +1,28 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
+
+from .media import serve_media
+from .metrics import metrics_view
+from .profiling import profile_index, profile_detail, profile_download
+from .read_api import batch_view
+from .slow_queries import slow_queries_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics/', metrics_view, name='metrics'),
+    path('_slow_queries/', slow_queries_view, name='slow_queries'),
+    path('_profiles/', profile_index, name='profile_index'),
+    path('_profiles/<str:profile_id>/', profile_detail, name='profile_detail'),
+    path('_profiles/<str:profile_id>/download/', profile_download, name='profile_download'),
+    # Пакетное чтение профилей, постов и уведомлений (instagram_clone.read_api)
+    path('api/batch/', batch_view, name='api_batch'),
+    # Загрузки пользователей — с проверкой доступа (instagram_clone.media)
+    path(settings.MEDIA_URL.lstrip('/') + '<path:path>', serve_media, name='media'),
     path('', include('posts.urls')),
     path('accounts/', include('accounts.urls', namespace='accounts')),  # добавлен namespace
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-
 handler404 = 'accounts.views.handler404'
 handler500 = 'accounts.views.handler500'
 handler403 = 'accounts.views.handler403'
@@ -0,0 +1,127 @@
+"""
+Очередь записи с одним писателем
+
+SQLite допускает одного писателя. Вместо того чтобы множество потоков
+конкурировали за блокировку, мелкие записи отправляются в очередь,
+а фоновый поток выполняет их пачками в одной транзакции (каждая — в
+своей точке сохранения, так что ошибка одной не откатывает остальные).
+
+Включается через settings.SQLITE_WRITE_QUEUE['ENABLED']; если очередь
+выключена, execute() выполняет функцию сразу в текущем потоке.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import connections, transaction
+
+
+DEFAULTS = {
+    'ENABLED': False,
+    'MAX_BATCH': 200,
+    'MAX_DELAY': 0.002,
+    'DATABASE': 'default',
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'SQLITE_WRITE_QUEUE', {}).get(name, DEFAULTS[name])
+
+
+class WriteQueue:
+    def __init__(self, using='default', max_batch=200, max_delay=0.002):
+        self.using = using
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.writes = 0
+
+    def submit(self, func, *args, **kwargs):
+        """Поставить запись в очередь, вернуть Future с результатом"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='sqlite-writer', daemon=True
+                )
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            results = []
+            try:
+                with transaction.atomic(using=self.using):
+                    for future, func, args, kwargs in batch:
+                        try:
+                            with transaction.atomic(using=self.using):
+                                results.append((future, func(*args, **kwargs), None))
+                        except Exception as exc:
+                            results.append((future, None, exc))
+            except Exception as exc:
+                # Не удалось зафиксировать всю пачку
+                results = [(future, None, exc) for future, *_ in batch]
+            finally:
+                connections[self.using].close_if_unusable_or_obsolete()
+
+            self.batches += 1
+            self.writes += len(batch)
+            for future, result, exc in results:
+                if exc is not None:
+                    future.set_exception(exc)
+                else:
+                    future.set_result(result)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_write_queue():
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = WriteQueue(
+                    using=get_setting('DATABASE'),
+                    max_batch=get_setting('MAX_BATCH'),
+                    max_delay=get_setting('MAX_DELAY'),
+                )
+    return _writer
+
+
+def execute(func, *args, **kwargs):
+    """
+    Выполнить запись через очередь (если включена) и дождаться результата
+
+    Нельзя вызывать внутри открытой транзакции: запись выполняется
+    другим соединением и не увидит незафиксированных данных.
+    """
+    if not get_setting('ENABLED'):
+        return func(*args, **kwargs)
+    return get_write_queue().submit(func, *args, **kwargs).result()
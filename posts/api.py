@@ -0,0 +1,42 @@
+"""
+Ресурсы пакетного API чтения (instagram_clone.read_api): посты
+"""
+from accounts.models import Profile
+from instagram_clone.read_api import Field, Resource, file_url
+
+from .models import Post
+
+
+class PostResource(Resource):
+    """
+    Посты. Посты закрытых профилей видны автору, его друзьям и
+    персоналу — как изображения постов (instagram_clone.media)
+    """
+    model = Post
+    version_scope = 'post'
+    required = ('author_id', 'author__profile__is_private')
+    fields = {
+        'id': Field('id'),
+        'title': Field('title'),
+        'content': Field('content'),
+        'image': Field('image', compute=file_url(Post._meta.get_field('image'))),
+        'created_at': Field('created_at'),
+        'likes': Field('likes'),
+        'author_id': Field('author_id'),
+        'author': Field('author__username'),
+    }
+
+    def visible(self, request, rows):
+        user = request.user
+        if user.is_staff:
+            return rows
+        private = {
+            row['author_id'] for row in rows
+            if row['author__profile__is_private'] and row['author_id'] != user.id
+        }
+        if private:
+            # Дружба со всеми закрытыми авторами — одним запросом
+            private -= set(Profile.friends.through.objects.filter(
+                from_profile__user_id=user.id, to_profile__user_id__in=private
+            ).values_list('to_profile__user_id', flat=True))
+        return [row for row in rows if row['author_id'] not in private]
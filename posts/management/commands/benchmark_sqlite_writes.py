@@ -0,0 +1,96 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from instagram_clone.write_queue import WriteQueue
+
+
+ALIAS = 'benchmark_writes'
+
+
+class Command(BaseCommand):
+    help = ('Многопоточная нагрузка мелкими записями (лайки) на временную '
+            'SQLite базу: прямые UPDATE против очереди с одним писателем')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--writes', type=int, default=200, help='Записей на поток')
+        parser.add_argument('--rows', type=int, default=10, help='Число "постов"')
+        parser.add_argument('--max-delay', type=float, default=0.002,
+                            help='Сколько ждать пополнения пачки (секунды)')
+
+    def handle(self, *args, **options):
+        self.threads = options['threads']
+        self.writes = options['writes']
+        self.rows = options['rows']
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db = dict(connections.databases['default'])
+            db['NAME'] = os.path.join(tmp, 'bench.sqlite3')
+            connections.databases[ALIAS] = db
+
+            try:
+                with connections[ALIAS].cursor() as cursor:
+                    cursor.execute('CREATE TABLE likes (id INTEGER PRIMARY KEY, n INTEGER NOT NULL)')
+                    cursor.executemany('INSERT INTO likes (id, n) VALUES (%s, 0)', [(i,) for i in range(self.rows)])
+                    cursor.execute('PRAGMA journal_mode')
+                    journal = cursor.fetchone()[0]
+                self.stdout.write(f'journal_mode={journal}, потоков={self.threads}, записей на поток={self.writes}')
+
+                self.report('direct', self.run(self.direct_write))
+                writer = WriteQueue(using=ALIAS, max_delay=options['max_delay'])
+                self.report('write queue', self.run(lambda i: writer.submit(self.increment, i).result()))
+                self.stdout.write(f'пачек: {writer.batches}, средний размер: {writer.writes / max(writer.batches, 1):.1f}')
+            finally:
+                connections[ALIAS].close()
+                del connections.databases[ALIAS]
+
+    def increment(self, i):
+        with connections[ALIAS].cursor() as cursor:
+            cursor.execute('UPDATE likes SET n = n + 1 WHERE id = %s', [i % self.rows])
+
+    def direct_write(self, i):
+        self.increment(i)
+
+    def run(self, write):
+        errors = []
+        latencies = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(self.threads)
+
+        def worker():
+            own = []
+            barrier.wait()
+            for i in range(self.writes):
+                started = time.perf_counter()
+                try:
+                    write(i)
+                except Exception as exc:
+                    with lock:
+                        errors.append(exc)
+                own.append(time.perf_counter() - started)
+            connections[ALIAS].close()
+            with lock:
+                latencies.extend(own)
+
+        threads = [threading.Thread(target=worker) for _ in range(self.threads)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started, sorted(latencies), errors
+
+    def report(self, name, result):
+        elapsed, latencies, errors = result
+        total = len(latencies)
+        p50 = latencies[total // 2] * 1000
+        p99 = latencies[min(total - 1, int(total * 0.99))] * 1000
+        self.stdout.write(
+            f'{name:>12}: {total / elapsed:8.0f} записей/с, p50 {p50:.2f} мс, '
+            f'p99 {p99:.2f} мс, ошибок {len(errors)}'
+        )
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import trending
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт рейтинга «Интересное» по накопленным событиям (posts.trending)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять каждые N секунд (0 — один раз)')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='Пересчитать все посты по счётчикам (после '
+                                 'generate_social_graph или смены HALF_LIFE/весов)')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            total = trending.rebuild(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Постов в рейтинге: {total}'))
+            return
+
+        try:
+            while True:
+                started = time.monotonic()
+                processed = trending.update(batch_size=options['batch_size'])
+                self.stdout.write(
+                    f'Событий: {processed}, {(time.monotonic() - started) * 1000:.0f} мс'
+                )
+                if not options['interval']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
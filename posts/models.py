@@ -1,7 +1,12 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
 from django.utils import timezone
 from django.contrib.auth.models import User
 
+from instagram_clone.conditional import bump
+
 
 class Post(models.Model):
     author = models.ForeignKey(
@@ -13,21 +18,286 @@ class Post(models.Model):
     )
     title = models.CharField(max_length=200, default="Без заголовка")
     content = models.TextField(default="Пост пока пустой")
-    image = models.ImageField(upload_to='post_images/', blank=True, null=True)
+    # Индекс: владелец файла ищется по имени при раздаче (instagram_clone.media)
+    image = models.ImageField(upload_to='post_images/', blank=True, null=True, db_index=True)
     created_at = models.DateTimeField(default=timezone.now)
     likes = models.IntegerField(default=0)
+    # Денормализованный счётчик (обновляется через F-выражения)
+    comments_count = models.PositiveIntegerField(default=0)
+
+    COUNTER_FIELDS = ('comments_count',)
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # Счётчик меняется только атомарно, не перезаписываем его устаревшим значением
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.COUNTER_FIELDS
+            ]
+        super().save(*args, **kwargs)
+
 
 
 class Comment(models.Model):
+    """
+    Комментарий с ответами в виде дерева (materialized path)
+
+    path — id всех предков и самого комментария, каждый дополнен нулями
+    до PATH_STEP символов. Строковый порядок path совпадает с порядком
+    обхода дерева, поэтому любое поддерево — один диапазонный запрос по
+    индексу (subtree_range), а предки извлекаются из path без запросов.
+    """
+    PATH_STEP = 10
+    # Ответ глубже становится ответом последнего допустимого предка
+    MAX_DEPTH = 8
+
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
+    parent = models.ForeignKey(
+        'self', on_delete=models.CASCADE, related_name='replies', null=True, blank=True
+    )
     author = models.CharField(max_length=100, default="Аноним")
     text = models.TextField()
     created_at = models.DateTimeField(default=timezone.now)
+    path = models.CharField(max_length=PATH_STEP * MAX_DEPTH, blank=True, db_index=True)
+    # Число всех ответов в ветке (потомков), обновляется через F-выражения
+    reply_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Страницы комментариев верхнего уровня по курсору
+            models.Index(fields=['post', 'parent', 'id']),
+        ]
 
     def __str__(self):
         return f'{self.author}: {self.text[:20]}'
 
+    @classmethod
+    def path_segment(cls, pk):
+        return str(pk).zfill(cls.PATH_STEP)
+
+    @property
+    def depth(self):
+        """0 — комментарий верхнего уровня"""
+        return len(self.path) // self.PATH_STEP - 1
+
+    @property
+    def ancestor_ids(self):
+        step = self.PATH_STEP
+        return [int(self.path[i:i + step]) for i in range(0, len(self.path) - step, step)]
+
+    def subtree_range(self):
+        """Границы path потомков (без самого комментария) для path__gt/path__lt"""
+        # '~' больше любой цифры
+        return self.path, self.path + '~'
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+
+        prefix = ''
+        if self.parent_id:
+            parent = self.parent
+            self.post_id = parent.post_id
+            prefix = parent.path[:(self.MAX_DEPTH - 1) * self.PATH_STEP]
+            if prefix != parent.path:
+                self.parent_id = int(prefix[-self.PATH_STEP:])
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            # path содержит собственный id — известен только после вставки
+            self.path = prefix + self.path_segment(self.pk)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+            Comment.objects.filter(id__in=self.ancestor_ids).update(reply_count=F('reply_count') + 1)
+            Post.objects.filter(id=self.post_id).update(comments_count=F('comments_count') + 1)
+            EngagementEvent.objects.create(post_id=self.post_id, kind='comment', created_at=self.created_at)
+
+
+class Hashtag(models.Model):
+    # В нижнем регистре, без '#'
+    name = models.CharField(max_length=100, unique=True)
+    # Денормализованный счётчик (обновляется через F-выражения)
+    posts_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'#{self.name}'
+
+
+class PostHashtag(models.Model):
+    """
+    Инвертированный индекс хэштег → посты
+
+    Только дописывается: пост попадает в индекс тега при первом
+    появлении тега в тексте поста или комментария к нему и остаётся там
+    до удаления поста. id растёт со временем, поэтому страницы тега —
+    keyset-пагинация по (hashtag, id).
+    """
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name='entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='hashtag_entries')
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'hashtag'], name='unique_post_hashtag'),
+        ]
+        indexes = [
+            models.Index(fields=['hashtag', 'id']),
+        ]
+
+    def __str__(self):
+        return f'{self.hashtag} → {self.post_id}'
+
+
+class EngagementEvent(models.Model):
+    """
+    Событие вовлечённости для рейтинга (posts.trending)
+
+    Только дописывается: лайк, комментарий или публикация поста — одна
+    короткая вставка. Задача пересчёта забирает события по id и удаляет
+    обработанные, поэтому таблица хранит только ещё не учтённые.
+    """
+    KIND_CHOICES = [
+        ('post', 'Публикация'),
+        ('like', 'Лайк'),
+        ('comment', 'Комментарий'),
+    ]
+
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='engagement_events')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.kind} → {self.post_id}'
+
+
+class PostScore(models.Model):
+    """
+    Затухающий счёт поста (posts.trending)
+
+    score — натуральный логарифм суммы весов событий, приведённых к
+    эпохе рейтинга: с течением времени не пересчитывается, новое событие
+    только увеличивает его.
+    """
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='trending_score')
+    score = models.FloatField(db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.post_id}: {self.score:.3f}'
+
+
+class TrendingPost(models.Model):
+    """
+    Снимок топа рейтинга: rank от 1, перезаписывается целиком задачей
+    пересчёта. Страница раздела «Интересное» — один запрос по rank
+    """
+    rank = models.PositiveIntegerField(primary_key=True)
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, related_name='trending_rank')
+    # В единицах PostScore.score
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['rank']
+
+    def __str__(self):
+        return f'#{self.rank}: {self.post_id}'
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def bump_post(sender, instance, **kwargs):
+    bump('post', instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def record_post_published(sender, instance, created, **kwargs):
+    # Свежесть: пост попадает в рейтинг с весом публикации
+    if created:
+        EngagementEvent.objects.create(post_id=instance.pk, kind='post', created_at=instance.created_at)
+
+
+@receiver(post_save, sender=Comment)
+def bump_comment_post(sender, instance, **kwargs):
+    # Счётчики нового комментария обновляет Comment.save()
+    bump('post', instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, origin=None, **kwargs):
+    # Пост удаляется вместе с комментариями: считать нечего
+    if isinstance(origin, Post):
+        return
+    # По одному на каждый удалённый комментарий ветки: уцелевшие предки
+    # уменьшаются на число удалённых потомков, у удалённых update ничего
+    # не находит
+    Comment.objects.filter(
+        id__in=instance.ancestor_ids, reply_count__gt=0
+    ).update(reply_count=F('reply_count') - 1)
+    Post.objects.filter(id=instance.post_id, comments_count__gt=0).update(
+        comments_count=F('comments_count') - 1
+    )
+    bump('post', instance.post_id)
+
+
+# ============ Хэштеги и упоминания ============
+
+TEXT_FIELDS = {'title', 'content'}
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_text(sender, instance, update_fields=None, **kwargs):
+    # Уведомляем только о новых упоминаниях: нужен текст до правки
+    instance._previous_text = ''
+    if instance._state.adding or (update_fields is not None and not TEXT_FIELDS & set(update_fields)):
+        return
+    row = Post.objects.filter(pk=instance.pk).values_list('title', 'content').first()
+    if row is not None:
+        instance._previous_text = '\n'.join(row)
+
+
+@receiver(post_save, sender=Post)
+def process_post_text(sender, instance, created, update_fields=None, **kwargs):
+    if not created and update_fields is not None and not TEXT_FIELDS & set(update_fields):
+        return
+    from .services import MentionService, TagService
+
+    text = f'{instance.title}\n{instance.content}'
+    TagService.index_post(instance.pk, TagService.extract(text))
+
+    previous = set(MentionService.extract(getattr(instance, '_previous_text', '')))
+    names = [name for name in MentionService.extract(text) if name not in previous]
+    if names:
+        author = instance.author.username if instance.author_id else 'Кто-то'
+        MentionService.notify(
+            names, instance.author_id,
+            f'{author} упомянул вас в посте «{instance.title}»',
+            MentionService.post_link(instance.pk),
+            key=f'mention:post:{instance.pk}'
+        )
+
+
+@receiver(pre_delete, sender=Post)
+def uncount_post_hashtags(sender, instance, **kwargs):
+    # Записи индекса удалятся каскадом
+    Hashtag.objects.filter(entries__post=instance, posts_count__gt=0).update(
+        posts_count=F('posts_count') - 1
+    )
+
+
+@receiver(post_save, sender=Comment)
+def process_comment_text(sender, instance, created, **kwargs):
+    if not created:
+        return
+    from .services import MentionService, TagService
+
+    TagService.index_post(instance.post_id, TagService.extract(instance.text))
+    # Автор комментария — только имя, без пользователя
+    MentionService.notify(
+        MentionService.extract(instance.text), None,
+        f'{instance.author} упомянул вас в комментарии',
+        MentionService.post_link(instance.post_id),
+        key=f'mention:comment:{instance.pk}'
+    )
@@ -0,0 +1,221 @@
+"""
+Сервисный слой постов: страницы комментариев по курсору, хэштеги и
+упоминания
+"""
+import hashlib
+import re
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.urls import reverse
+
+from .models import Comment, Hashtag, PostHashtag
+
+# '#' и '@' только в начале слова: не в email, URL-якорях и '##'
+HASHTAG_RE = re.compile(r'(?<![\w#&/])#(\w+)')
+MENTION_RE = re.compile(r'(?<![\w@/])@([\w.+-]+)')
+
+
+class CommentService:
+    """Сервис для дерева комментариев"""
+
+    PAGE_SIZE = 20
+    REPLIES_PAGE_SIZE = 10
+    MAX_PAGE_SIZE = 100
+
+    @staticmethod
+    def page_size(value, default):
+        try:
+            return min(max(int(value), 1), CommentService.MAX_PAGE_SIZE)
+        except (TypeError, ValueError):
+            return default
+
+    @staticmethod
+    def top_level_page(post_id, after=None, limit=None):
+        """
+        Комментарии верхнего уровня по порядку создания
+
+        Один запрос по индексу (post, parent, id) — время не зависит от
+        числа комментариев поста.
+
+        Args:
+            post_id: ID поста
+            after: Курсор — id последнего комментария предыдущей страницы
+            limit: Размер страницы
+
+        Returns:
+            tuple: (список Comment, курсор следующей страницы или None)
+        """
+        limit = limit or CommentService.PAGE_SIZE
+        queryset = Comment.objects.filter(post_id=post_id, parent__isnull=True)
+        if after:
+            queryset = queryset.filter(id__gt=after)
+        comments = list(queryset.order_by('id')[:limit + 1])
+        next_cursor = comments[limit - 1].id if len(comments) > limit else None
+        return comments[:limit], next_cursor
+
+    @staticmethod
+    def replies_page(comment, after=None, limit=None):
+        """
+        Ответы ветки (все уровни) в порядке обхода дерева
+
+        Args:
+            comment: Корень ветки (Comment)
+            after: Курсор — path последнего ответа предыдущей страницы
+            limit: Размер страницы
+
+        Returns:
+            tuple: (список Comment, курсор следующей страницы или None)
+
+        Raises:
+            ValueError: Курсор не из этой ветки
+        """
+        limit = limit or CommentService.REPLIES_PAGE_SIZE
+        start, end = comment.subtree_range()
+        if after:
+            if not (after.isdigit() and start < after < end):
+                raise ValueError('Неверный курсор')
+            start = after
+        # Диапазон по индексу path
+        replies = list(
+            Comment.objects.filter(path__gt=start, path__lt=end).order_by('path')[:limit + 1]
+        )
+        next_cursor = replies[limit - 1].path if len(replies) > limit else None
+        return replies[:limit], next_cursor
+
+    @staticmethod
+    def as_dict(comment):
+        return {
+            'id': comment.id,
+            'parent_id': comment.parent_id,
+            'author': comment.author,
+            'text': comment.text,
+            'created_at': comment.created_at.isoformat(),
+            'depth': comment.depth,
+            'reply_count': comment.reply_count,
+        }
+
+
+class TagService:
+    """Сервис для хэштегов и инвертированного индекса"""
+
+    PAGE_SIZE = 24
+
+    @staticmethod
+    def extract(text):
+        """Хэштеги текста в нижнем регистре, без повторов, по порядку"""
+        max_length = Hashtag._meta.get_field('name').max_length
+        names = []
+        for match in HASHTAG_RE.finditer(text or ''):
+            name = match.group(1).lower()
+            # Только цифры ('#1') — не хэштег
+            if name.isdigit() or len(name) > max_length or name in names:
+                continue
+            names.append(name)
+        return names
+
+    @staticmethod
+    def index_post(post_id, names):
+        """
+        Дописать пост в индекс тегов
+
+        Теги, в индексе которых пост уже есть, пропускаются: четыре
+        запроса независимо от числа тегов.
+
+        Returns:
+            list: id тегов, в индекс которых пост добавлен
+        """
+        if not names:
+            return []
+        with transaction.atomic():
+            Hashtag.objects.bulk_create([Hashtag(name=name) for name in names], ignore_conflicts=True)
+            tag_ids = list(Hashtag.objects.filter(name__in=names).values_list('id', flat=True))
+            indexed = set(PostHashtag.objects.filter(
+                post_id=post_id, hashtag_id__in=tag_ids
+            ).values_list('hashtag_id', flat=True))
+            new = [tag_id for tag_id in tag_ids if tag_id not in indexed]
+            if new:
+                PostHashtag.objects.bulk_create(
+                    [PostHashtag(hashtag_id=tag_id, post_id=post_id) for tag_id in new],
+                    ignore_conflicts=True
+                )
+                Hashtag.objects.filter(id__in=new).update(posts_count=F('posts_count') + 1)
+        return new
+
+    @staticmethod
+    def tag_page(hashtag, before=None, limit=None):
+        """
+        Посты тега от новых к старым
+
+        Keyset по индексу (hashtag, id): страница — один запрос без
+        OFFSET, сколько бы постов ни было у тега.
+
+        Args:
+            hashtag: Hashtag
+            before: Курсор — id записи индекса последнего поста
+                предыдущей страницы
+            limit: Размер страницы
+
+        Returns:
+            tuple: (список Post, курсор следующей страницы или None)
+        """
+        limit = limit or TagService.PAGE_SIZE
+        entries = PostHashtag.objects.filter(hashtag=hashtag)
+        if before:
+            entries = entries.filter(id__lt=before)
+        entries = list(entries.select_related('post').order_by('-id')[:limit + 1])
+        next_cursor = entries[limit - 1].id if len(entries) > limit else None
+        return [entry.post for entry in entries[:limit]], next_cursor
+
+
+class MentionService:
+    """Сервис для упоминаний @username"""
+
+    @staticmethod
+    def extract(text):
+        """Имена пользователей без повторов, по порядку"""
+        names = []
+        for match in MENTION_RE.finditer(text or ''):
+            # Точка в конце — конец предложения, а не часть имени
+            name = match.group(1).rstrip('.')
+            if name and name not in names:
+                names.append(name)
+        return names
+
+    @staticmethod
+    def notify(names, author_id, message, link, key):
+        """
+        Уведомить упомянутых пользователей одной фоновой задачей (один
+        bulk INSERT); автора и заблокировавших его не уведомляем
+
+        Args:
+            names: Имена пользователей
+            author_id: Кто упомянул (или None)
+            message: Текст уведомления
+            link: Ссылка на пост
+            key: Префикс ключа идемпотентности (источник упоминания)
+
+        Returns:
+            list: id уведомляемых пользователей
+        """
+        if not names:
+            return []
+        users = User.objects.filter(username__in=names)
+        if author_id:
+            users = users.exclude(id=author_id).exclude(blocking__blocked_id=author_id)
+        user_ids = sorted(users.values_list('id', flat=True))
+        if not user_ids:
+            return []
+
+        from accounts.tasks import create_notifications
+        digest = hashlib.sha1(repr(user_ids).encode()).hexdigest()[:12]
+        create_notifications.enqueue(
+            user_ids, 'mention', message[:255],
+            related_user_id=author_id, link=link, key=f'{key}:{digest}'
+        )
+        return user_ids
+
+    @staticmethod
+    def post_link(post_id):
+        return reverse('posts:post_detail', args=[post_id])
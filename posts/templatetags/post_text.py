@@ -0,0 +1,24 @@
+from django import template
+from django.urls import reverse
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe
+
+from posts.models import Hashtag
+from posts.services import HASHTAG_RE
+
+register = template.Library()
+
+
+@register.filter(needs_autoescape=True)
+def hashtag_links(text, autoescape=True):
+    """Хэштеги текста — ссылками на страницы тегов"""
+    text = conditional_escape(text) if autoescape else text
+    max_length = Hashtag._meta.get_field('name').max_length
+
+    def link(match):
+        name = match.group(1).lower()
+        if name.isdigit() or len(name) > max_length:
+            return match.group(0)
+        return f'<a href="{reverse("posts:tag_detail", args=[name])}">#{match.group(1)}</a>'
+
+    return mark_safe(HASHTAG_RE.sub(link, text))
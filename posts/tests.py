@@ -1,3 +1,355 @@
-from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser, User
+from datetime import timedelta
 
-# Create your tests here.
+from django.db.models import F
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from instagram_clone.conditional import get_versions
+from instagram_clone.write_queue import WriteQueue
+from accounts.models import BlockedUser, Notification
+from . import trending
+from .models import Comment, EngagementEvent, Hashtag, Post, PostScore, TrendingPost
+from .services import CommentService, MentionService, TagService
+
+
+class PostLikeTests(TestCase):
+    def test_like_increments_atomically(self):
+        post = Post.objects.create(title='1')
+        self.client.post(reverse('posts:post_like', args=[post.id]))
+        self.client.post(reverse('posts:post_like', args=[post.id]))
+        post.refresh_from_db()
+        self.assertEqual(post.likes, 2)
+
+    def test_like_changes_post_version(self):
+        post = Post.objects.create(title='1')
+        before = get_versions('post', post.id)
+        self.client.post(reverse('posts:post_like', args=[post.id]))
+        self.assertNotEqual(get_versions('post', post.id), before)
+
+
+class WriteQueueTests(TransactionTestCase):
+    def test_batched_writes(self):
+        post = Post.objects.create(title='1')
+        writer = WriteQueue(max_delay=0.05)
+
+        def like():
+            Post.objects.filter(id=post.id).update(likes=F('likes') + 1)
+            return True
+
+        futures = [writer.submit(like) for _ in range(20)]
+        self.assertTrue(all(f.result(timeout=5) for f in futures))
+
+        post.refresh_from_db()
+        self.assertEqual(post.likes, 20)
+        self.assertLess(writer.batches, 20)
+
+    def test_failed_write_does_not_abort_batch(self):
+        writer = WriteQueue(max_delay=0.05)
+
+        def fail():
+            raise ValueError('boom')
+
+        bad = writer.submit(fail)
+        good = writer.submit(Post.objects.create, title='ok')
+
+        with self.assertRaises(ValueError):
+            bad.result(timeout=5)
+        self.assertEqual(good.result(timeout=5).title, 'ok')
+        self.assertTrue(Post.objects.filter(title='ok').exists())
+
+
+class CommentTreeTests(TestCase):
+    def setUp(self):
+        self.post = Post.objects.create(title='1')
+
+    def comment(self, parent=None, text='c'):
+        return Comment.objects.create(post=self.post, parent=parent, text=text)
+
+    def refresh(self, *objects):
+        for obj in objects:
+            obj.refresh_from_db()
+
+    def test_paths_and_counters(self):
+        root = self.comment()
+        reply = self.comment(root)
+        nested = self.comment(reply)
+        other = self.comment()
+
+        self.assertEqual(nested.path, root.path + reply.path[-10:] + nested.path[-10:])
+        self.assertEqual(nested.depth, 2)
+        self.assertEqual(nested.ancestor_ids, [root.id, reply.id])
+        self.refresh(root, reply, self.post)
+        self.assertEqual((root.reply_count, reply.reply_count), (2, 1))
+        self.assertEqual(self.post.comments_count, 4)
+
+        # Сохранение поста не перезаписывает счётчик
+        stale = Post.objects.get(id=self.post.id)
+        self.comment(other)
+        stale.title = '2'
+        stale.save()
+        self.refresh(self.post)
+        self.assertEqual(self.post.comments_count, 5)
+
+        reply.delete()
+        self.refresh(root, self.post)
+        self.assertEqual(root.reply_count, 0)
+        self.assertEqual(self.post.comments_count, 3)
+        self.post.delete()
+
+    def test_depth_is_limited(self):
+        parent = self.comment()
+        for _ in range(Comment.MAX_DEPTH + 2):
+            parent = self.comment(parent)
+        self.assertEqual(parent.depth, Comment.MAX_DEPTH - 1)
+        self.assertEqual(parent.parent.depth, Comment.MAX_DEPTH - 2)
+
+    def test_pages(self):
+        roots = [self.comment(text=str(i)) for i in range(5)]
+        replies = [self.comment(roots[0]) for _ in range(3)]
+        nested = self.comment(replies[0])
+        self.comment(roots[1])
+
+        with self.assertNumQueries(1):
+            page, after = CommentService.top_level_page(self.post.id, limit=2)
+        self.assertEqual(page, roots[:2])
+        page, after = CommentService.top_level_page(self.post.id, after=after, limit=2)
+        page, after = CommentService.top_level_page(self.post.id, after=after, limit=2)
+        self.assertEqual((page, after), (roots[4:], None))
+
+        # Вся ветка в порядке обхода, без ответов соседней
+        with self.assertNumQueries(1):
+            page, after = CommentService.replies_page(roots[0], limit=2)
+        self.assertEqual(page, [replies[0], nested])
+        page, after = CommentService.replies_page(roots[0], after=after, limit=2)
+        self.assertEqual((page, after), (replies[1:], None))
+        with self.assertRaises(ValueError):
+            CommentService.replies_page(roots[1], after=nested.path)
+
+    def test_views(self):
+        url = reverse('posts:post_comments', args=[self.post.id])
+        self.client.post(url, {'author': 'a', 'text': 'root'})
+        root = Comment.objects.get()
+        response = self.client.post(
+            url, {'author': 'b', 'text': 'reply', 'parent_id': root.id},
+            headers={'X-Requested-With': 'XMLHttpRequest'}
+        )
+        self.assertEqual(response.json()['comment']['depth'], 1)
+
+        # Ответ на комментарий другого поста
+        other = Comment.objects.create(post=Post.objects.create(title='2'), text='x')
+        response = self.client.post(
+            url, {'author': 'c', 'text': 'x', 'parent_id': other.id},
+            headers={'X-Requested-With': 'XMLHttpRequest'}
+        )
+        self.assertEqual(response.status_code, 400)
+
+        data = self.client.get(url).json()
+        self.assertEqual([(c['text'], c['reply_count']) for c in data['comments']], [('root', 1)])
+
+        replies_url = reverse('posts:comment_replies', args=[root.id])
+        self.assertEqual(self.client.get(replies_url).json()['replies'][0]['text'], 'reply')
+        self.assertEqual(self.client.get(replies_url, {'after': '1'}).status_code, 400)
+
+        self.post.author = User.objects.create_user('alice', password='pass12345')
+        self.post.save()
+        response = self.client.get(reverse('posts:post_detail', args=[self.post.id]))
+        self.assertContains(response, 'Комментарии (2)')
+        self.assertContains(response, 'Показать ответы (1)')
+
+
+class HashtagMentionTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pass12345')
+        self.bob = User.objects.create_user('bob', password='pass12345')
+        self.carol = User.objects.create_user('carol', password='pass12345')
+
+    def mentions(self, user):
+        return list(Notification.objects.for_user(user).filter(notification_type='mention'))
+
+    def test_extract(self):
+        self.assertEqual(
+            TagService.extract("#Django и #django, #123 a#b #тег &#39; http://x/#anchor"),
+            ['django', 'тег']
+        )
+        self.assertEqual(
+            MentionService.extract('@alice, @bob. mail@example.com @alice @a.b'),
+            ['alice', 'bob', 'a.b']
+        )
+
+    def test_index_and_tag_pages(self):
+        first = Post.objects.create(author=self.alice, title='1', content='#sun #sea')
+        second = Post.objects.create(author=self.alice, title='2', content='#sun')
+        Comment.objects.create(post=first, text='#sun и #beach')
+
+        sun = Hashtag.objects.get(name='sun')
+        self.assertEqual(sun.posts_count, 2)
+        self.assertEqual(Hashtag.objects.get(name='beach').posts_count, 1)
+
+        # Правка дописывает новые теги, прежние записи остаются
+        second.content = '#Sea'
+        second.save()
+        self.assertEqual(Hashtag.objects.get(name='sea').posts_count, 2)
+        self.assertEqual(Hashtag.objects.get(name='sun').posts_count, 2)
+
+        with self.assertNumQueries(1):
+            posts, before = TagService.tag_page(sun, limit=1)
+        self.assertEqual(posts, [second])
+        posts, before = TagService.tag_page(sun, before=before, limit=1)
+        self.assertEqual((posts, before), ([first], None))
+
+        response = self.client.get(reverse('posts:tag_detail', args=['SUN']))
+        self.assertContains(response, 'Постов: 2')
+        self.assertEqual(self.client.get(reverse('posts:tag_detail', args=['none'])).status_code, 404)
+
+        first.delete()
+        self.assertEqual(Hashtag.objects.get(name='sun').posts_count, 1)
+
+    def test_mentions_notify_once(self):
+        BlockedUser.objects.create(blocker=self.carol, blocked=self.alice)
+        post = Post.objects.create(author=self.alice, title='1', content='@bob @carol @alice')
+        self.assertEqual(len(self.mentions(self.bob)), 1)
+        self.assertEqual(self.mentions(self.bob)[0].related_user_id, self.alice.id)
+        self.assertEqual(self.mentions(self.carol), [])
+        self.assertEqual(self.mentions(self.alice), [])
+
+        dave = User.objects.create_user('dave', password='pass12345')
+        post.content = '@bob @dave'
+        post.save()
+        self.assertEqual(len(self.mentions(self.bob)), 1)
+        self.assertEqual(len(self.mentions(dave)), 1)
+
+        Comment.objects.create(post=post, author='Гость', text='@bob смотри')
+        self.assertEqual(self.mentions(self.bob)[0].message, 'Гость упомянул вас в комментарии')
+
+    def test_hashtag_links(self):
+        output = Template('{% load post_text %}{{ text|hashtag_links }}').render(
+            Context({'text': '<b>#Sun</b> #1'})
+        )
+        self.assertEqual(
+            output, '&lt;b&gt;<a href="/tags/sun/">#Sun</a>&lt;/b&gt; #1'
+        )
+
+
+
+class TrendingTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pass12345')
+        self.bob = User.objects.create_user('bob', password='pass12345')
+
+    def ranking(self):
+        return list(TrendingPost.objects.values_list('post_id', flat=True))
+
+    def test_events_update_scores_incrementally(self):
+        first = Post.objects.create(author=self.alice, title='1')
+        second = Post.objects.create(author=self.alice, title='2')
+        self.client.post(reverse('posts:post_like', args=[first.id]))
+        Comment.objects.create(post=second, text='!')
+        self.assertEqual(EngagementEvent.objects.count(), 4)
+
+        self.assertEqual(trending.update(), 4)
+        self.assertFalse(EngagementEvent.objects.exists())
+        # Комментарий весит больше лайка
+        self.assertEqual(self.ranking(), [second.id, first.id])
+        score = PostScore.objects.get(post=first).score
+        self.assertAlmostEqual(trending.current(score), 2, places=2)
+
+        for _ in range(3):
+            self.client.post(reverse('posts:post_like', args=[first.id]))
+        self.assertEqual(trending.update(), 3)
+        self.assertEqual(self.ranking(), [first.id, second.id])
+        self.assertAlmostEqual(trending.current(PostScore.objects.get(post=first).score), 5, places=2)
+
+    def test_older_engagement_decays(self):
+        half_life = trending.get_setting('HALF_LIFE')
+        old = Post.objects.create(
+            author=self.alice, title='old', created_at=timezone.now() - timedelta(seconds=half_life)
+        )
+        new = Post.objects.create(author=self.alice, title='new')
+        trending.update()
+        self.assertEqual(self.ranking(), [new.id, old.id])
+        self.assertAlmostEqual(trending.current(PostScore.objects.get(post=old).score), 0.5, places=2)
+
+    @override_settings(TRENDING={'TOP_K': 2})
+    def test_heap_keeps_top_k(self):
+        posts = [Post.objects.create(author=self.alice, title=str(i)) for i in range(3)]
+        for i, post in enumerate(posts):
+            for _ in range(i):
+                EngagementEvent.objects.create(post=post, kind='like')
+        trending.update()
+        self.assertEqual(self.ranking(), [posts[2].id, posts[1].id])
+
+        # Пост вне снимка обгоняет остальных
+        for _ in range(5):
+            EngagementEvent.objects.create(post=posts[0], kind='like')
+        trending.update(batch_size=2)
+        self.assertEqual(self.ranking(), [posts[0].id, posts[2].id])
+
+        # Удалённый пост освобождает место: снимок добирается по счетам
+        posts[2].delete()
+        EngagementEvent.objects.create(post=posts[0], kind='like')
+        trending.update()
+        self.assertEqual(self.ranking(), [posts[0].id, posts[1].id])
+
+    def test_rebuild_from_counters(self):
+        first = Post.objects.create(author=self.alice, title='1')
+        second = Post.objects.create(author=self.alice, title='2')
+        Post.objects.filter(id=first.id).update(likes=10)
+        self.assertEqual(trending.rebuild(), 2)
+        self.assertFalse(EngagementEvent.objects.exists())
+        self.assertEqual(self.ranking(), [first.id, second.id])
+        self.assertAlmostEqual(trending.current(PostScore.objects.get(post=first).score), 11, places=1)
+
+    @override_settings(TRENDING={'TOP_K': 1})
+    def test_prune_decayed_scores(self):
+        Post.objects.create(author=self.alice, title='1')
+        stale = Post.objects.create(
+            author=self.alice, title='2', created_at=timezone.now() - timedelta(days=30)
+        )
+        trending.update()
+        self.assertFalse(PostScore.objects.filter(post=stale).exists())
+
+    def test_page_filters_blocks_and_private_profiles(self):
+        carol = User.objects.create_user('carol', password='pass12345')
+        staff = User.objects.create_user('staff', password='pass12345', is_staff=True)
+        public = Post.objects.create(author=self.alice, title='public')
+        private = Post.objects.create(author=carol, title='private')
+        carol.profile.is_private = True
+        carol.profile.save()
+        orphan = Post.objects.create(title='orphan')
+        trending.update()
+        everything = {public, private, orphan}
+
+        def visible(user):
+            posts, _ = trending.page(user)
+            return set(posts)
+
+        self.assertEqual(visible(staff), everything)
+        self.assertEqual(visible(carol), everything)
+        self.assertEqual(visible(self.bob), {public, orphan})
+        carol.profile.friends.add(self.bob.profile)
+        self.assertEqual(visible(self.bob), everything)
+
+        BlockedUser.objects.create(blocker=self.alice, blocked=self.bob)
+        self.assertEqual(visible(self.bob), {private, orphan})
+        self.assertEqual(visible(self.alice), {public, orphan})
+
+        self.assertEqual(visible(AnonymousUser()), {public, orphan})
+
+        with self.assertNumQueries(1):
+            posts, after = trending.page(self.bob, limit=1)
+            [post.author.profile for post in posts if post.author_id]
+        self.assertIsNotNone(after)
+        rest, after = trending.page(self.bob, after=after, limit=5)
+        self.assertEqual(set(posts + rest), {private, orphan})
+        self.assertIsNone(after)
+
+    def test_explore_view(self):
+        post = Post.objects.create(author=self.alice, title='Горячий пост')
+        trending.update()
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('posts:explore'))
+        self.assertContains(response, 'Горячий пост')
+        self.assertContains(response, reverse('posts:post_detail', args=[post.id]))
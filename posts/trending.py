@@ -0,0 +1,283 @@
+"""
+Рейтинг раздела «Интересное»: затухающий счёт вовлечённости
+
+Счёт поста — сумма весов его событий (публикация, лайки, комментарии),
+вклад каждого уменьшается вдвое за HALF_LIFE секунд:
+
+    счёт(t) = Σ вес_i · 2^(-(t - t_i) / HALF_LIFE)
+
+Множитель 2^(-t / HALF_LIFE) общий для всех постов и на порядок не
+влияет, поэтому хранится счёт, приведённый к эпохе EPOCH, —
+Σ вес_i · 2^((t_i - EPOCH) / HALF_LIFE), в логарифме, чтобы не
+переполниться. Со временем счета не пересчитываются: событие только
+прибавляется к счёту своего поста (logaddexp).
+
+- в пути записи — только вставка EngagementEvent (лайк, комментарий,
+  публикация);
+- update() (manage.py update_trending, периодически) забирает
+  накопленные события пачками, обновляет счета только затронутых
+  постов и сливает их с текущим снимком в топ TOP_K кучей (heapq):
+  порядок незатронутых постов не изменился, поэтому кандидаты в топ —
+  прежний снимок и затронутые посты;
+- снимок TrendingPost перезаписывается в той же транзакции, страница
+  читается из него одним запросом по rank; блокировки и закрытые
+  профили отфильтровываются в этом же запросе — при чтении, для
+  конкретного пользователя.
+
+Новые HALF_LIFE и веса действуют на новые события; пересчитать всё по
+счётчикам постов — update_trending --rebuild.
+"""
+import heapq
+import math
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from accounts.models import BlockedUser, Profile
+
+from .models import EngagementEvent, Post, PostScore, TrendingPost
+
+
+DEFAULTS = {
+    # За сколько секунд вклад события уменьшается вдвое
+    'HALF_LIFE': 6 * 3600,
+    'WEIGHTS': {'post': 1.0, 'like': 1.0, 'comment': 3.0},
+    # Постов в снимке
+    'TOP_K': 500,
+    'PAGE_SIZE': 24,
+    # Событий за одну транзакцию пересчёта
+    'BATCH_SIZE': 5000,
+    # Затухшие ниже счета удаляются: пост вернётся со следующим событием
+    'MIN_SCORE': 0.01,
+}
+
+# 2024-01-01 00:00 UTC
+EPOCH = 1704067200
+
+
+def get_setting(name):
+    return getattr(settings, 'TRENDING', {}).get(name, DEFAULTS[name])
+
+
+def decay_rate():
+    return math.log(2) / get_setting('HALF_LIFE')
+
+
+def log_weight(weight, at):
+    """Логарифм вклада события веса weight в момент at (в единицах PostScore.score)"""
+    return math.log(weight) + decay_rate() * (at.timestamp() - EPOCH)
+
+
+def current(score, now=None):
+    """Счёт на момент now по значению PostScore.score"""
+    now = now or timezone.now()
+    return math.exp(score - decay_rate() * (now.timestamp() - EPOCH))
+
+
+def logaddexp(a, b):
+    """log(e^a + e^b) без переполнения; a может быть None"""
+    if a is None:
+        return b
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def top(candidates, size=None):
+    """
+    Топ кандидатов по счёту
+
+    Args:
+        candidates: Пары (post_id, score)
+        size: Размер топа (по умолчанию TOP_K)
+
+    Returns:
+        list: Пары (post_id, score) по убыванию счёта
+    """
+    return heapq.nlargest(size or get_setting('TOP_K'), candidates, key=lambda item: item[1])
+
+
+def write_snapshot(ranked):
+    """Перезаписать снимок (вызывается в транзакции)"""
+    TrendingPost.objects.all().delete()
+    TrendingPost.objects.bulk_create([
+        TrendingPost(rank=rank, post_id=post_id, score=score)
+        for rank, (post_id, score) in enumerate(ranked, start=1)
+    ])
+
+
+def merge(scores):
+    """
+    Слить новые счета затронутых постов с текущим снимком
+
+    Args:
+        scores: {post_id: score}
+    """
+    top_k = get_setting('TOP_K')
+    snapshot = list(TrendingPost.objects.values_list('post_id', 'score'))
+    candidates = dict(snapshot)
+    if len(snapshot) < top_k:
+        # Снимок неполон (посты удалены, TOP_K увеличен): добрать по индексу счёта
+        candidates.update(PostScore.objects.order_by('-score').values_list('post_id', 'score')[:top_k])
+    candidates.update(scores)
+    ranked = top(candidates.items(), top_k)
+    if ranked != snapshot:
+        write_snapshot(ranked)
+
+
+def add_scores(gains):
+    """
+    Прибавить вклады событий к счетам постов
+
+    Args:
+        gains: {post_id: логарифм суммарного вклада}
+
+    Returns:
+        dict: {post_id: новый score}
+    """
+    existing = dict(PostScore.objects.filter(post_id__in=list(gains)).values_list('post_id', 'score'))
+    now = timezone.now()
+    rows = [
+        PostScore(post_id=post_id, score=logaddexp(existing.get(post_id), gain), updated_at=now)
+        for post_id, gain in gains.items()
+    ]
+    # Один INSERT ... ON CONFLICT DO UPDATE вместо UPDATE с CASE на каждую строку
+    PostScore.objects.bulk_create(
+        rows, update_conflicts=True, unique_fields=['post'], update_fields=['score', 'updated_at']
+    )
+    return {row.post_id: row.score for row in rows}
+
+
+def update(batch_size=None):
+    """
+    Учесть накопленные события и обновить снимок
+
+    Каждая пачка событий — одна транзакция: счета, удаление событий и
+    снимок фиксируются вместе, повторный запуск после сбоя ничего не
+    учитывает дважды.
+
+    Returns:
+        int: Число обработанных событий
+    """
+    batch_size = batch_size or get_setting('BATCH_SIZE')
+    weights = get_setting('WEIGHTS')
+    processed = 0
+
+    while True:
+        with transaction.atomic():
+            events = list(
+                EngagementEvent.objects.order_by('id')
+                .values_list('id', 'post_id', 'kind', 'created_at')[:batch_size]
+            )
+            if not events:
+                break
+            gains = {}
+            for _, post_id, kind, created_at in events:
+                weight = weights.get(kind, 0)
+                if weight > 0:
+                    gains[post_id] = logaddexp(gains.get(post_id), log_weight(weight, created_at))
+            merge(add_scores(gains))
+            EngagementEvent.objects.filter(id__in=[event[0] for event in events]).delete()
+        processed += len(events)
+
+    prune()
+    return processed
+
+
+def rebuild(batch_size=None):
+    """
+    Пересчитать счета всех постов по их счётчикам — начальное заполнение
+    и смена HALF_LIFE или весов. Время лайков и комментариев не
+    хранится: они учитываются на момент публикации поста.
+
+    Returns:
+        int: Число постов со счётом
+    """
+    batch_size = batch_size or get_setting('BATCH_SIZE')
+    weights = get_setting('WEIGHTS')
+    floor = score_floor()
+    ranked = []
+    total = 0
+
+    with transaction.atomic():
+        # Счётчики постов уже включают неучтённые события
+        EngagementEvent.objects.all().delete()
+        PostScore.objects.all().delete()
+        last_id = 0
+        while True:
+            batch = list(
+                Post.objects.filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'created_at', 'likes', 'comments_count')[:batch_size]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+            rows = []
+            for post_id, created_at, likes, comments in batch:
+                weight = (
+                    weights.get('post', 0) + likes * weights.get('like', 0)
+                    + comments * weights.get('comment', 0)
+                )
+                if weight <= 0:
+                    continue
+                score = log_weight(weight, created_at)
+                # Уже затухшие посты prune() удалил бы сразу
+                if score >= floor:
+                    rows.append(PostScore(post_id=post_id, score=score))
+            PostScore.objects.bulk_create(rows)
+            ranked = top(ranked + [(row.post_id, row.score) for row in rows])
+            total += len(rows)
+        write_snapshot(ranked)
+    return total
+
+
+def score_floor(now=None):
+    """PostScore.score, соответствующий MIN_SCORE на момент now"""
+    return log_weight(get_setting('MIN_SCORE'), now or timezone.now())
+
+
+def prune(now=None):
+    """Удалить затухшие счета постов вне снимка; вернуть число удалённых"""
+    deleted, _ = PostScore.objects.filter(
+        score__lt=score_floor(now), post__trending_rank__isnull=True
+    ).delete()
+    return deleted
+
+
+def page(user, after=None, limit=None):
+    """
+    Страница рейтинга для пользователя — один запрос к снимку
+
+    Скрываются посты заблокированных пользователей и заблокировавших
+    user, посты закрытых профилей видны автору, его друзьям и персоналу
+    (как в posts.api.PostResource).
+
+    Args:
+        user: Текущий пользователь (может быть анонимным)
+        after: Курсор — rank последнего поста предыдущей страницы
+        limit: Размер страницы
+
+    Returns:
+        tuple: (список Post, курсор следующей страницы или None)
+    """
+    limit = limit or get_setting('PAGE_SIZE')
+    entries = TrendingPost.objects.select_related('post__author__profile')
+    if after:
+        entries = entries.filter(rank__gt=after)
+
+    if not user.is_staff:
+        hidden = Q(post__author__profile__is_private=True)
+        if user.is_authenticated:
+            author = OuterRef('post__author_id')
+            entries = entries.filter(~Exists(BlockedUser.objects.filter(
+                Q(blocker_id=user.id, blocked_id=author) | Q(blocker_id=author, blocked_id=user.id)
+            )))
+            hidden &= ~Q(post__author_id=user.id) & ~Exists(Profile.friends.through.objects.filter(
+                from_profile__user_id=user.id, to_profile__user_id=author
+            ))
+        entries = entries.filter(~hidden)
+
+    entries = list(entries.order_by('rank')[:limit + 1])
+    next_cursor = entries[limit - 1].rank if len(entries) > limit else None
+    return [entry.post for entry in entries[:limit]], next_cursor
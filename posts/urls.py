@@ -10,4 +10,8 @@ urlpatterns = [
     path('<int:pk>/edit/', views.post_edit, name='post_edit'),
     path('like/<int:post_id>/', views.post_like, name='post_like'),
     path('<int:pk>/delete/', views.post_delete, name='post_delete'),
+    path('<int:pk>/comments/', views.post_comments, name='post_comments'),
+    path('comments/<int:comment_id>/replies/', views.comment_replies, name='comment_replies'),
+    path('tags/<str:name>/', views.tag_detail, name='tag_detail'),
+    path('explore/', views.explore, name='explore'),
 ]
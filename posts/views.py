@@ -1,7 +1,15 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from .models import Post, Comment
+from django.db import transaction
+from django.db.models import F
+from instagram_clone import write_queue
+from instagram_clone.conditional import bump
+from instagram_clone.metrics import events
+from instagram_clone.ratelimit import rate_limit
+from .models import EngagementEvent, Post, Comment
 from .forms import PostForm, CommentForm
 
+# Ограничивается только отправка комментария (POST)
+@rate_limit('10/m', burst=5)
 def post_list(request):
     posts = Post.objects.all().order_by('-created_at')
 
@@ -13,7 +21,7 @@ def post_list(request):
             comment = comment_form.save(commit=False)
             comment.post = post
             comment.save()
-            return redirect('post_list')
+            return redirect('posts:post_list')
     else:
         comment_form = CommentForm()
 
@@ -27,7 +35,7 @@ def post_create(request):
             post = form.save(commit=False)
             post.author = request.user   # 🔥 ВАЖНО
             post.save()
-            return redirect('post_list')
+            return redirect('posts:post_list')
     else:
         form = PostForm()
     return render(request, 'posts/post_create.html', {'form': form})
@@ -40,31 +48,150 @@ def post_edit(request, pk):
         form = PostForm(request.POST, request.FILES, instance=post)  # ← ОБЯЗАТЕЛЬНО!
         if form.is_valid():
             form.save()
-            return redirect('post_list')
+            return redirect('posts:post_list')
     else:
         form = PostForm(instance=post)
 
     return render(request, 'posts/post_edit.html', {'form': form, 'post': post})
 
 
+def add_like(post_id):
+    with transaction.atomic():
+        Post.objects.filter(id=post_id).update(likes=F('likes') + 1)
+        # update() не отправляет post_save: версию поста (ETag страницы
+        # и /api/batch/) меняем сами
+        bump('post', post_id)
+        # Для рейтинга «Интересное» (posts.trending)
+        EngagementEvent.objects.create(post_id=post_id, kind='like')
+
+
+# GET тоже ставит лайк
+@rate_limit('30/m', burst=10, methods=('GET', 'POST'))
 def post_like(request, post_id):
     post = get_object_or_404(Post, id=post_id)
-    post.likes += 1
-    post.save()
-    return redirect('post_list')
+    # Атомарный инкремент (без потерянных обновлений), через очередь записи
+    write_queue.execute(add_like, post.id)
+    events.inc(event='post_like')
+    return redirect('posts:post_list')
 
 
 def post_delete(request, pk):
     post = get_object_or_404(Post, pk=pk)
     if request.method == 'POST':
         post.delete()
-        return redirect('post_list')
+        return redirect('posts:post_list')
     return render(request, 'posts/post_delete.html', {'post': post})
 
+from django.http import HttpResponseNotAllowed, HttpResponseNotFound, JsonResponse
 from django.shortcuts import render, get_object_or_404
-from .models import Post
+from instagram_clone.conditional import conditional, get_versions
+from instagram_clone.query_inspector import query_budget
+from .models import Hashtag, Post
+from .services import CommentService, TagService
+from . import trending
 
-def post_detail(request, pk):
-    post = get_object_or_404(Post, pk=pk)
-    return render(request, 'posts/post_detail.html', {'post': post})
 
+def cursor(request):
+    value = request.GET.get('after', '')
+    return int(value) if value.isdigit() else None
+
+
+# Имя автора версией поста не отслеживается — max_age. Комментарии
+# и лайки меняют версию поста
+@query_budget(5)
+@conditional(lambda request, pk: get_versions('post', pk), max_age=300)
+def post_detail(request, pk):
+    post = get_object_or_404(Post.objects.select_related('author'), pk=pk)
+    # Первая страница — без подсчёта и загрузки всех комментариев
+    comments, next_cursor = CommentService.top_level_page(post.id, after=cursor(request))
+    return render(request, 'posts/post_detail.html', {
+        'post': post,
+        'comments': comments,
+        'next_cursor': next_cursor,
+        'comment_form': CommentForm(),
+    })
+
+
+@rate_limit('10/m', burst=5)
+def post_comments(request, pk):
+    """
+    GET — страница комментариев верхнего уровня (JSON, ?after=&limit=),
+    POST — новый комментарий или ответ (parent_id)
+    """
+    post = get_object_or_404(Post.objects.only('id'), pk=pk)
+
+    if request.method == 'GET':
+        limit = CommentService.page_size(request.GET.get('limit'), CommentService.PAGE_SIZE)
+        comments, next_cursor = CommentService.top_level_page(post.id, after=cursor(request), limit=limit)
+        return JsonResponse({
+            'comments': [CommentService.as_dict(c) for c in comments],
+            'next_cursor': next_cursor,
+        })
+
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['GET', 'POST'])
+
+    form = CommentForm(request.POST)
+    parent_id = request.POST.get('parent_id', '')
+    parent = None
+    if parent_id:
+        if parent_id.isdigit():
+            parent = Comment.objects.filter(pk=parent_id, post_id=post.id).first()
+        if parent is None:
+            form.add_error(None, 'Комментарий для ответа не найден')
+    is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+    if not form.is_valid():
+        if is_ajax:
+            return JsonResponse({'success': False, 'errors': form.errors}, status=400)
+        return redirect('posts:post_detail', pk=post.id)
+
+    comment = form.save(commit=False)
+    comment.post = post
+    comment.parent = parent
+    comment.save()
+    if is_ajax:
+        return JsonResponse({'success': True, 'comment': CommentService.as_dict(comment)})
+    return redirect('posts:post_detail', pk=post.id)
+
+
+def comment_replies(request, comment_id):
+    """Ответы ветки порциями (JSON, ?after=<курсор>&limit=)"""
+    comment = get_object_or_404(Comment.objects.only('id', 'path'), pk=comment_id)
+    limit = CommentService.page_size(request.GET.get('limit'), CommentService.REPLIES_PAGE_SIZE)
+    try:
+        replies, next_cursor = CommentService.replies_page(
+            comment, after=request.GET.get('after'), limit=limit
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse({
+        'replies': [CommentService.as_dict(r) for r in replies],
+        'next_cursor': next_cursor,
+    })
+
+
+@query_budget(4)
+def tag_detail(request, name):
+    """Посты хэштега страницами по курсору (?before=)"""
+    hashtag = Hashtag.objects.filter(name=name.lower()).first()
+    if hashtag is None:
+        return HttpResponseNotFound('Хэштег не найден')
+    before = request.GET.get('before', '')
+    posts, next_cursor = TagService.tag_page(hashtag, before=int(before) if before.isdigit() else None)
+    return render(request, 'posts/tag_detail.html', {
+        'hashtag': hashtag,
+        'posts': posts,
+        'next_cursor': next_cursor,
+    })
+
+
+
+@query_budget(3)
+def explore(request):
+    """Посты с самым быстрым ростом вовлечённости по снимку рейтинга (?after=)"""
+    posts, next_cursor = trending.page(request.user, after=cursor(request))
+    return render(request, 'posts/explore.html', {
+        'posts': posts,
+        'next_cursor': next_cursor,
+    })